@@ -0,0 +1,41 @@
+import { NextRequest, NextResponse } from 'next/server'
+
+const LATEX_SERVICE_URL = process.env.LATEX_SERVICE_URL || 'http://localhost:8000'
+
+export const dynamic = 'force-dynamic'
+
+export async function GET(
+    request: NextRequest,
+    { params }: { params: { jobId: string } }
+) {
+    try {
+        const response = await fetch(`${LATEX_SERVICE_URL}/compile/jobs/${params.jobId}/events`, {
+            headers: { Accept: 'text/event-stream' },
+            cache: 'no-store',
+            signal: request.signal,
+        })
+
+        if (!response.ok || !response.body) {
+            const error = await response.json()
+            return NextResponse.json(
+                { error: error.detail || 'Failed to subscribe to compile job' },
+                { status: response.status }
+            )
+        }
+
+        // Pass the event stream through without buffering it
+        return new Response(response.body, {
+            headers: {
+                'Content-Type': 'text/event-stream',
+                'Cache-Control': 'no-cache, no-transform',
+                Connection: 'keep-alive',
+            },
+        })
+    } catch (error) {
+        console.error('Compile job events error:', error)
+        return NextResponse.json(
+            { error: error instanceof Error ? error.message : 'Failed to subscribe to compile job' },
+            { status: 500 }
+        )
+    }
+}
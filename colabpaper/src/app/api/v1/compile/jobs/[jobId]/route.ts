@@ -0,0 +1,37 @@
+import { NextRequest, NextResponse } from 'next/server'
+
+const LATEX_SERVICE_URL = process.env.LATEX_SERVICE_URL || 'http://localhost:8000'
+
+export async function GET(
+    request: NextRequest,
+    { params }: { params: { jobId: string } }
+) {
+    try {
+        const response = await fetch(`${LATEX_SERVICE_URL}/compile/jobs/${params.jobId}`, {
+            cache: 'no-store',
+        })
+
+        if (!response.ok) {
+            const error = await response.json()
+            return NextResponse.json(
+                { error: error.detail || 'Failed to get compile job' },
+                { status: response.status }
+            )
+        }
+
+        const result = await response.json()
+
+        // Local storage URLs are relative to the LaTeX service
+        if (result.result?.storage_type === 'local') {
+            result.result.url = `${LATEX_SERVICE_URL}/storage/${result.result.file_path}`
+        }
+
+        return NextResponse.json(result)
+    } catch (error) {
+        console.error('Compile job fetch error:', error)
+        return NextResponse.json(
+            { error: error instanceof Error ? error.message : 'Failed to get compile job' },
+            { status: 500 }
+        )
+    }
+}
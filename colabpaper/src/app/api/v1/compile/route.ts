@@ -5,10 +5,14 @@ const LATEX_SERVICE_URL = process.env.LATEX_SERVICE_URL || 'http://localhost:800
 export async function POST(request: Request) {
     try {
         const body = await request.json()
-        const { texContent, projectId, filename } = body
+        const { texContent, projectId, filename, async: asyncMode } = body
+
+        // In async mode the service answers immediately with a job id whose
+        // progress is streamed from /compile/jobs/{jobId}/events
+        const endpoint = asyncMode ? 'compile/jobs' : 'compile'
 
         // Call LaTeX service
-        const response = await fetch(`${LATEX_SERVICE_URL}/compile`, {
+        const response = await fetch(`${LATEX_SERVICE_URL}/${endpoint}`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -27,6 +31,17 @@ export async function POST(request: Request) {
 
         const result = await response.json()
 
+        if (asyncMode) {
+            return NextResponse.json(
+                {
+                    ...result,
+                    status_url: `/api/${process.env.NEXT_PUBLIC_API_VERSION}/compile/jobs/${result.job_id}`,
+                    events_url: `/api/${process.env.NEXT_PUBLIC_API_VERSION}/compile/jobs/${result.job_id}/events`,
+                },
+                { status: 202 }
+            )
+        }
+
         // If using local storage in development, we need to adjust the URL
         if (result.storage_type === 'local') {
             // Convert the file system path to a local URL
@@ -1,25 +1,64 @@
 # app/api/routes.py
-from fastapi import APIRouter, HTTPException, BackgroundTasks, UploadFile, File, Request, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends, UploadFile, Request, Response, Query
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 import os
-from PIL import Image
-import io
+import re
+import uuid
+from pathlib import Path
 from datetime import datetime
 import traceback
 import logging
+import time
+import asyncio
+import json
+import aiofiles
+from starlette.datastructures import UploadFile as FormFile
 
-from app.latex_compiler import LatexCompiler
+from app.latex_compiler import CompileMode, LatexCompiler, LatexCompilationError, ResourceLimitError
+from app.scheduler import QueueFullError, CompilationTimeoutError
+from app.jobs import CompileJob, JobManager, JobState
+from app.uploads import SpooledUpload, UploadValidationError, optimize_upload, spool_upload
+from app.blob_store import (
+    SHA256_PATTERN,
+    BlobRejectedError,
+    BlobTooLargeError,
+    ManifestError,
+    MissingBlobsError,
+    validate_manifest
+)
+from app.metrics import REGISTRY, UPLOAD_BYTES, UPLOAD_SECONDS, runtime_metrics
+from app.pdf_delivery import pdf_response, pdf_url
+from app.page_previews import PREVIEW_FORMATS
 from app.config import settings
 
 router = APIRouter()
 logger = logging.getLogger("latex-service")
 
+SSE_KEEPALIVE_INTERVAL = 15  # Seconds between keep-alive comments on idle event streams
+MULTIPART_OVERHEAD = 16 * 1024  # Bytes allowed for boundaries, part headers and other fields of an upload
+
+class PreviewOptions(BaseModel):
+    dpi: int = 96
+    format: str = "png"  # png or webp
+
 class CompilationRequest(BaseModel):
-    tex_content: str
+    tex_content: Optional[str] = None  # Required unless files and main_file are given
     project_id: str
     output_filename: str
+    incremental: Optional[bool] = None  # Defaults to WARM_BUILDS_ENABLED, always on for previews
+    mode: str = CompileMode.FINAL  # "preview" trades fidelity for latency while editing; "final" for export
+    fail_fast: bool = False  # Stop at the first TeX error instead of finishing the pass
+    files: Optional[Dict[str, str]] = None  # Project manifest: path -> sha256 of a blob uploaded with PUT /blobs
+    main_file: Optional[str] = None  # Manifest path of the root document, used when tex_content is omitted
+    timings: bool = False  # Include the job's span tree in the response
+    keep_output: bool = False  # Keep raw engine output as job artifacts even if the compile succeeds
+    preview: Optional[PreviewOptions] = None  # Rasterize the pages after compiling
+
+class ProjectManifest(BaseModel):
+    files: Dict[str, str]  # path -> sha256
+    main_file: Optional[str] = None
 
 class ImageMetadata(BaseModel):
     file_path: str
@@ -29,54 +68,64 @@ class ImageMetadata(BaseModel):
     created_at: str
     name: str
     dimensions: Optional[dict] = None
+    sha256: Optional[str] = None
 
-async def validate_image(file: UploadFile) -> None:
-    """Validate image file before processing"""
-    logger.debug(f"Validating image: {file.filename} ({file.content_type})")
-    
-    # Check file type
-    if file.content_type not in settings.ALLOWED_IMAGE_TYPES:
-        logger.warning(f"Invalid file type: {file.content_type}")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Unsupported file type. Allowed types: {', '.join(settings.ALLOWED_IMAGE_TYPES)}"
-        )
-    
-    # Check file size
-    contents = await file.read()
-    file_size = len(contents)
-    await file.seek(0)  # Reset file pointer
-    
-    logger.debug(f"File size: {file_size / 1024 / 1024:.2f}MB")
-    
-    if file_size > settings.MAX_IMAGE_SIZE:
-        logger.warning(f"File too large: {file_size / 1024 / 1024:.2f}MB")
+async def image_upload_file(request: Request) -> AsyncIterator[UploadFile]:
+    """The "file" part of an image upload
+
+    The form is parsed here rather than by a File() parameter, which FastAPI
+    would read in full before any code of the route runs. That way uploads
+    that declare a Content-Length over the limit are refused unread. Bodies
+    without one are only checked once the form has been received.
+    """
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > settings.MAX_IMAGE_SIZE + MULTIPART_OVERHEAD:
         raise HTTPException(
-            status_code=400,
+            status_code=413,
             detail=f"File too large. Maximum size: {settings.MAX_IMAGE_SIZE / (1024 * 1024)}MB"
         )
+    async with request.form(max_files=1) as form:
+        file = form.get("file")
+        if not isinstance(file, FormFile):
+            raise HTTPException(status_code=422, detail="Missing file field")
+        yield file
+
+async def validate_image(file: UploadFile, downsample: bool = False) -> SpooledUpload:
+    """Spool an upload to disk, validating its size, type and dimensions in the same pass
+
+    Images wider or taller than MAX_IMAGE_DIMENSION are rejected unless
+    they are going to be downsampled.
+    """
+    logger.debug(f"Validating image: {file.filename} ({file.content_type})")
+    try:
+        upload = await spool_upload(
+            file,
+            Path(settings.TEMP_DIR) / "uploads",
+            settings.MAX_IMAGE_SIZE,
+            settings.ALLOWED_IMAGE_TYPES
+        )
+    except UploadValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    logger.debug(f"File size: {upload.size / 1024 / 1024:.2f}MB")
     
-    # Optionally validate and optimize image dimensions
-    if settings.OPTIMIZE_IMAGES and file.content_type != 'application/pdf':
-        try:
-            img = Image.open(io.BytesIO(contents))
-            width, height = img.size
-            logger.debug(f"Image dimensions: {width}x{height}")
-            
-            if width > settings.MAX_IMAGE_DIMENSION or height > settings.MAX_IMAGE_DIMENSION:
-                logger.warning(f"Image dimensions too large: {width}x{height}")
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Image dimensions too large. Maximum dimension: {settings.MAX_IMAGE_DIMENSION}px"
-                )
-        except Exception as e:
-            logger.error(f"Error processing image dimensions: {str(e)}")
+    if upload.content_type != "application/pdf":
+        if upload.dimensions is None:
+            # Corrupt headers and decompression bombs both end up here
+            upload.discard()
+            raise HTTPException(status_code=400, detail="Error processing image: could not read its dimensions")
+        width, height = upload.dimensions["width"], upload.dimensions["height"]
+        logger.debug(f"Image dimensions: {width}x{height}")
+        if not downsample and (width > settings.MAX_IMAGE_DIMENSION or height > settings.MAX_IMAGE_DIMENSION):
+            logger.warning(f"Image dimensions too large: {width}x{height}")
+            upload.discard()
             raise HTTPException(
                 status_code=400,
-                detail=f"Error processing image: {str(e)}"
+                detail=f"Image dimensions too large. Maximum dimension: {settings.MAX_IMAGE_DIMENSION}px"
             )
     
     logger.debug("Image validation successful")
+    return upload
 
 @router.get("/health")
 async def health_check(request: Request):
@@ -90,20 +139,31 @@ async def health_check(request: Request):
         "timestamp": datetime.now().isoformat()
     }
 
-@router.post("/upload-image/{project_id}")
+@router.post("/upload-image/{project_id}", openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"]
+        }}}
+    }
+})
 async def upload_image(
     request: Request,
     project_id: str,
-    file: UploadFile = File(...),
+    file: UploadFile = Depends(image_upload_file),
     optimize: bool = Query(False, description="Whether to optimize the image before saving")
 ) -> ImageMetadata:
     """Upload an image file"""
+    started = time.perf_counter()
     try:
         logger.info(f"Starting image upload for project {project_id}")
         logger.debug(f"File details - name: {file.filename}, content_type: {file.content_type}")
         
-        # Validate image
-        await validate_image(file)
+        # Validate image while spooling it to disk
+        downsample = optimize or settings.OPTIMIZE_IMAGES
+        upload = await validate_image(file, downsample)
         logger.debug("Image validation passed")
         
         storage_provider = request.app.state.storage_provider
@@ -116,37 +176,34 @@ async def upload_image(
         logger.debug(f"Saving image with filename: {new_filename}")
         
         # Save image using storage provider
-        file_path, url = await storage_provider.save_image(
-            file,
-            project_id,
-            new_filename,
-            optimize=optimize
-        )
+        try:
+            if downsample:
+                # Downsample to MAX_IMAGE_DIMENSION, recompress and strip metadata
+                compiler: LatexCompiler = request.app.state.latex_compiler
+                upload = await optimize_upload(upload, compiler.image_derivatives)
+            file_path, url = await storage_provider.save_image(
+                upload,
+                project_id,
+                new_filename
+            )
+        finally:
+            upload.discard()
         
         logger.debug(f"Image saved successfully at {file_path}")
-        
-        # Get image dimensions if possible
-        dimensions = None
-        if file.content_type != 'application/pdf':
-            contents = await file.read()
-            await file.seek(0)
-            try:
-                with Image.open(io.BytesIO(contents)) as img:
-                    dimensions = {"width": img.width, "height": img.height}
-                logger.debug(f"Image dimensions: {dimensions}")
-            except Exception as e:
-                logger.warning(f"Could not get image dimensions: {e}")
 
         response = ImageMetadata(
             file_path=file_path,
             url=url,
-            file_type=file.content_type,
-            size=file.size if hasattr(file, 'size') else 0,
+            file_type=upload.content_type,
+            size=upload.size,
             created_at=datetime.now().isoformat(),
             name=new_filename,
-            dimensions=dimensions
+            dimensions=upload.dimensions,
+            sha256=upload.sha256
         )
         
+        UPLOAD_SECONDS.observe(time.perf_counter() - started, kind="image")
+        UPLOAD_BYTES.inc(upload.size, kind="image")
         logger.info(f"Successfully uploaded image {new_filename} for project {project_id}")
         return response
         
@@ -161,13 +218,19 @@ async def list_images(
     request: Request,
     project_id: str,
     page: int = Query(1, ge=1),
-    limit: int = Query(50, ge=1, le=100)
+    limit: int = Query(50, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Path of the last file on the previous page; takes precedence over page")
 ) -> dict:
     """List all images for a project"""
-    logger.info(f"Listing images for project {project_id} (page {page}, limit {limit})")
+    logger.info(f"Listing images for project {project_id} (page {page}, limit {limit}, cursor {cursor})")
     try:
         storage_provider = request.app.state.storage_provider
-        images = await storage_provider.list_images(project_id, skip=(page-1)*limit, limit=limit)
+        images = await storage_provider.list_images(
+            project_id,
+            skip=(page-1)*limit,
+            limit=limit,
+            after=cursor
+        )
         total = await storage_provider.count_images(project_id)
         
         logger.debug(f"Found {total} total images, returning {len(images)} for current page")
@@ -179,8 +242,10 @@ async def list_images(
                 "page": page,
                 "limit": limit,
                 "total": total,
-                "pages": (total + limit - 1) // limit
-            }
+                "pages": (total + limit - 1) // limit,
+                "next_cursor": images[-1]["path"] if len(images) == limit else None
+            },
+            "usage": await storage_provider.get_usage(project_id)
         }
     except Exception as e:
         logger.error(f"Error listing images: {str(e)}\n{''.join(traceback.format_tb(e.__traceback__))}")
@@ -213,50 +278,123 @@ async def delete_image(
         logger.error(f"Error deleting image: {str(e)}\n{''.join(traceback.format_tb(e.__traceback__))}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def _preview_options(dpi: int, image_format: str) -> Tuple[int, str]:
+    """Validate a preview resolution and format"""
+    if not 1 <= dpi <= settings.PREVIEW_MAX_DPI:
+        raise HTTPException(status_code=400, detail=f"Preview dpi must be between 1 and {settings.PREVIEW_MAX_DPI}")
+    if image_format not in PREVIEW_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Preview format must be one of {', '.join(PREVIEW_FORMATS)}")
+    return dpi, image_format
+
+def _submit_compile_job(request: Request, compilation_request: CompilationRequest) -> CompileJob:
+    """Submit a compile job, translating a full queue into a 503 with Retry-After"""
+    job_manager: JobManager = request.app.state.job_manager
+    incremental = compilation_request.incremental
+    files = None
+    if compilation_request.files is not None:
+        try:
+            files = validate_manifest(
+                compilation_request.files,
+                compilation_request.main_file,
+                settings.MANIFEST_MAX_FILES
+            )
+        except ManifestError as me:
+            raise HTTPException(status_code=400, detail=str(me))
+    if compilation_request.tex_content is None and (files is None or compilation_request.main_file is None):
+        raise HTTPException(status_code=400, detail="Either tex_content or files with a main_file is required")
+    if compilation_request.mode not in CompileMode.ALL:
+        raise HTTPException(status_code=400, detail=f"Compile mode must be one of {', '.join(CompileMode.ALL)}")
+    if incremental is None:
+        incremental = compilation_request.mode == CompileMode.PREVIEW or settings.WARM_BUILDS_ENABLED
+    preview = None
+    if compilation_request.preview is not None:
+        preview = _preview_options(compilation_request.preview.dpi, compilation_request.preview.format)
+
+    try:
+        return job_manager.submit(
+            compilation_request.tex_content,
+            compilation_request.project_id,
+            compilation_request.output_filename,
+            incremental=incremental,
+            keep_output=compilation_request.keep_output,
+            preview=preview,
+            fail_fast=compilation_request.fail_fast,
+            files=files,
+            main_file=compilation_request.main_file,
+            mode=compilation_request.mode
+        )
+    except QueueFullError as qe:
+        raise HTTPException(
+            status_code=503,
+            detail={"message": str(qe), "queue": job_manager.scheduler.stats()},
+            headers={"Retry-After": str(qe.retry_after)}
+        )
+
+def _timing_headers(job: CompileJob) -> Dict[str, str]:
+    """Server-Timing headers summarizing the job's trace"""
+    if job.trace is None:
+        return {}
+    timing = job.trace.server_timing()
+    return {"Server-Timing": timing, "X-Server-Timing": timing}
+
 @router.post("/compile")
 async def compile_document(
     request: Request,
+    response: Response,
     compilation_request: CompilationRequest,
     background_tasks: BackgroundTasks
 ) -> dict:
-    """Compile LaTeX document"""
+    """Compile LaTeX document and wait for the result"""
     logger.info(f"Starting LaTeX compilation for project {compilation_request.project_id}")
     try:
-        storage_provider = request.app.state.storage_provider
-        compiler = LatexCompiler(storage_provider)
+        compiler: LatexCompiler = request.app.state.latex_compiler
         
         logger.debug("Initializing compilation process")
-        # Compile the document
+        # Compile the document as a job and wait for it to finish
+        job = _submit_compile_job(request, compilation_request)
+        await job.wait()
         try:
-            pdf_path = await compiler.compile(
-                compilation_request.tex_content,
-                compilation_request.project_id
+            if job.exception is not None:
+                raise job.exception
+        except QueueFullError as qe:
+            raise HTTPException(
+                status_code=503,
+                detail={"message": str(qe)},
+                headers={"Retry-After": str(qe.retry_after)}
+            )
+        except CompilationTimeoutError as te:
+            raise HTTPException(status_code=504, detail={"message": str(te)})
+        except MissingBlobsError as me:
+            # Evicted or never uploaded; the client uploads these and retries
+            raise HTTPException(status_code=409, detail={"message": str(me), "missing": me.missing})
+        except LatexCompilationError as le:
+            raise HTTPException(
+                status_code=422,
+                detail={
+                    "message": le.message,
+                    "type": type(le).__name__,
+                    "limit": le.limit if isinstance(le, ResourceLimitError) else None,
+                    "log": le.log_content,
+                    # A superseded job reports the failure, and artifacts, of the job that replaced it
+                    "job_id": job.superseded_by or job.id,
+                    "artifacts": (job.error or {}).get("artifacts", [])
+                },
+                headers=_timing_headers(job)
             )
         except HTTPException as he:
             # Log the detailed error and return it to the client
             logger.error(f"LaTeX compilation failed:\n{he.detail.get('log', '')}")
             raise
-
-        logger.debug(f"Compilation successful, saving PDF to storage: {compilation_request.output_filename}")
-        # Save to storage
-        file_path, url = await storage_provider.save_pdf(
-            pdf_path,
-            compilation_request.project_id,
-            compilation_request.output_filename
-        )
         
         logger.debug("Scheduling cleanup task")
         # Schedule cleanup in background
         background_tasks.add_task(compiler.cleanup_old_files)
         
         logger.info(f"Successfully compiled document for project {compilation_request.project_id}")
-        return {
-            "status": "success",
-            "file_path": file_path,
-            "url": url,
-            "storage_type": "local" if settings.IS_LOCAL else "supabase",
-            "compiled_at": datetime.now().isoformat()
-        }
+        response.headers.update(_timing_headers(job))
+        if compilation_request.timings and job.trace is not None:
+            return {**job.result, "job_id": job.id, "timings": job.trace.to_dict()}
+        return {**job.result, "job_id": job.id}
         
     except HTTPException:
         raise
@@ -270,37 +408,236 @@ async def compile_document(
             }
         )
 
+@router.post("/compile/manifest")
+async def check_manifest(request: Request, manifest: ProjectManifest) -> dict:
+    """Return the hashes in a project manifest whose content still has to be uploaded"""
+    try:
+        files = validate_manifest(manifest.files, manifest.main_file, settings.MANIFEST_MAX_FILES)
+    except ManifestError as me:
+        raise HTTPException(status_code=400, detail=str(me))
+    compiler: LatexCompiler = request.app.state.latex_compiler
+    missing = compiler.blob_store.missing(files.values())
+    logger.debug(f"Manifest of {len(files)} file(s) is missing {len(missing)} blob(s)")
+    return {"files": len(files), "missing": missing}
+
+@router.put("/blobs/{sha256}")
+async def upload_blob(request: Request, sha256: str) -> dict:
+    """Upload the raw content of one project file, verified against its sha256"""
+    if not SHA256_PATTERN.match(sha256):
+        raise HTTPException(status_code=400, detail="Blob name must be a lowercase hex sha256")
+    declared_size = request.headers.get("content-length")
+    if declared_size and declared_size.isdigit() and int(declared_size) > settings.BLOB_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Blob exceeds {settings.BLOB_MAX_SIZE} bytes")
+
+    compiler: LatexCompiler = request.app.state.latex_compiler
+    started = time.perf_counter()
+    try:
+        size = await compiler.blob_store.store(sha256, request.stream())
+    except BlobTooLargeError as te:
+        raise HTTPException(status_code=413, detail=str(te))
+    except BlobRejectedError as be:
+        raise HTTPException(status_code=400, detail=str(be))
+    UPLOAD_SECONDS.observe(time.perf_counter() - started, kind="blob")
+    UPLOAD_BYTES.inc(size, kind="blob")
+    return {"sha256": sha256, "size": size}
+
+@router.post("/compile/jobs", status_code=202)
+async def submit_compile_job(
+    request: Request,
+    compilation_request: CompilationRequest,
+    background_tasks: BackgroundTasks
+) -> dict:
+    """Submit a compile job and return immediately with its id"""
+    logger.info(f"Submitting compile job for project {compilation_request.project_id}")
+    job = _submit_compile_job(request, compilation_request)
+    background_tasks.add_task(request.app.state.latex_compiler.cleanup_old_files)
+    return {
+        "job_id": job.id,
+        "state": job.state,
+        "status_url": f"/compile/jobs/{job.id}",
+        "events_url": f"/compile/jobs/{job.id}/events"
+    }
+
+def _get_job(request: Request, job_id: str) -> CompileJob:
+    job = request.app.state.job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Compile job not found")
+    return job
+
+@router.get("/compile/jobs/{job_id}")
+async def get_compile_job(request: Request, job_id: str) -> dict:
+    """Get the state of a compile job"""
+    return _get_job(request, job_id).to_dict()
+
+@router.get("/compile/jobs/{job_id}/events")
+async def stream_compile_job_events(request: Request, job_id: str) -> StreamingResponse:
+    """Stream a compile job's progress as Server-Sent Events"""
+    job = _get_job(request, job_id)
+    logger.debug(f"Client subscribed to events of compile job {job_id}")
+
+    async def event_stream():
+        queue = job.subscribe()
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Comment lines keep idle connections open through proxies
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {event['seq']}\nevent: {event['phase']}\ndata: {json.dumps(event)}\n\n"
+                if event["phase"] in JobState.TERMINAL:
+                    return
+        finally:
+            job.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/compile/jobs/{job_id}/artifacts")
+async def list_compile_job_artifacts(request: Request, job_id: str) -> dict:
+    """List the raw engine output kept for a compile job"""
+    names = request.app.state.job_manager.artifacts.list(job_id)
+    if names is None:
+        raise HTTPException(status_code=404, detail="No output was kept for this compile job")
+    return {"job_id": job_id, "artifacts": names}
+
+@router.get("/compile/jobs/{job_id}/artifacts/{name}")
+async def get_compile_job_artifact(request: Request, job_id: str, name: str) -> FileResponse:
+    """Download one kept output artifact of a compile job"""
+    path = request.app.state.job_manager.artifacts.path(job_id, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    return FileResponse(path, media_type="text/plain")
+
 @router.get("/compile/status/{project_id}/{filename}")
 async def get_compilation_status(
     request: Request,
     project_id: str,
     filename: str
 ) -> dict:
-    """Get status of compiled PDF"""
+    """Get status of the latest compile job and the compiled PDF"""
     logger.info(f"Checking compilation status for {filename} in project {project_id}")
     try:
         storage_provider = request.app.state.storage_provider
+        job = request.app.state.job_manager.latest_for(project_id, filename)
+        job_info = job.to_dict() if job else None
         exists = await storage_provider.check_pdf_exists(project_id, filename)
         
         if not exists:
             logger.debug(f"PDF not found: {filename}")
             return {
-                "status": "not_found",
-                "exists": False
+                "status": job.state if job else "not_found",
+                "exists": False,
+                "job": job_info
             }
             
         url = await storage_provider.get_pdf_url(project_id, filename)
         logger.debug(f"PDF found with URL: {url}")
         
         return {
-            "status": "success",
+            "status": job.state if job and not job.done else "success",
             "exists": True,
-            "url": url
+            "url": url,
+            "pdf_url": pdf_url(project_id, filename),
+            "job": job_info
         }
     except Exception as e:
         logger.error(f"Error checking compilation status: {str(e)}\n{''.join(traceback.format_tb(e.__traceback__))}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.api_route("/pdf/{project_id}/{filename}", methods=["GET", "HEAD"])
+async def get_pdf(request: Request, project_id: str, filename: str) -> Response:
+    """Serve a compiled PDF with ETag revalidation and byte-range requests"""
+    storage_provider = request.app.state.storage_provider
+    stored = await storage_provider.get_pdf_file(project_id, filename)
+    if stored is not None:
+        path, size, etag = stored
+        return pdf_response(request, path, size, etag, filename)
+    if not await storage_provider.check_pdf_exists(project_id, filename):
+        raise HTTPException(status_code=404, detail="PDF not found")
+    # Remote storage serves ETags and ranges itself
+    return RedirectResponse(await storage_provider.get_pdf_url(project_id, filename), status_code=307)
+
+@router.get("/pdf/{project_id}/{filename}/pages")
+async def get_pdf_pages(
+    request: Request,
+    project_id: str,
+    filename: str,
+    dpi: int = Query(96),
+    image_format: str = Query("png", alias="format")
+) -> dict:
+    """List the pages of a compiled PDF with content hashes and preview image URLs"""
+    dpi, image_format = _preview_options(dpi, image_format)
+    storage_provider = request.app.state.storage_provider
+    previews = request.app.state.job_manager.previews
+    stored = await storage_provider.get_pdf_file(project_id, filename)
+    download = None
+    if stored is not None:
+        pdf_path, _, etag = stored
+        # The ETag is the PDF's SHA-256, so pages of an unchanged PDF aren't parsed again
+        pdf_digest = etag.strip('"')
+    else:
+        if not await storage_provider.check_pdf_exists(project_id, filename):
+            raise HTTPException(status_code=404, detail="PDF not found")
+        download = Path(settings.TEMP_DIR) / f"preview_{uuid.uuid4().hex}.pdf"
+        async with aiofiles.open(download, 'wb') as f:
+            await f.write(await storage_provider.read_file(f"{project_id}/{filename}"))
+        pdf_path, pdf_digest = download, None
+    try:
+        pages = await previews.render(pdf_path, dpi, image_format, pdf_digest)
+    finally:
+        if download is not None:
+            download.unlink(missing_ok=True)
+    if pages is None:
+        raise HTTPException(status_code=422, detail="The stored PDF could not be read")
+    return {"project_id": project_id, "filename": filename, "dpi": dpi, "format": image_format, "pages": pages}
+
+@router.get("/previews/{name}")
+async def get_preview(request: Request, name: str) -> FileResponse:
+    """Serve a rendered page image; its name is derived from the page content, so it never changes"""
+    key, _, extension = name.partition(".")
+    media_type = next((media for _, ext, media in PREVIEW_FORMATS.values() if ext == f".{extension}"), None)
+    path = request.app.state.job_manager.previews.path(key) if media_type and re.fullmatch(r'[0-9a-f]{64}', key) else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Preview not found")
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@router.get("/stats")
+async def get_stats(request: Request) -> dict:
+    """Get runtime statistics for the compilation pipeline"""
+    logger.debug("Retrieving runtime statistics")
+    compiler: LatexCompiler = request.app.state.latex_compiler
+    linearizer = request.app.state.storage_provider.linearizer
+    return {
+        "compile_cache": compiler.compile_cache.stats() if compiler.compile_cache else None,
+        "format_cache": compiler.format_cache.stats() if compiler.format_cache else None,
+        "image_cache": compiler.image_cache.stats(),
+        "image_derivatives": compiler.image_derivatives.stats(),
+        "class_cache": compiler.class_cache.stats(),
+        "bib_cache": compiler.bib_cache.stats(),
+        "blob_store": compiler.blob_store.stats(),
+        "storage": request.app.state.storage_provider.stats(),
+        "pdf_linearizer": linearizer.stats() if linearizer else None,
+        "warm_builds": compiler.build_dirs.stats(),
+        "resource_limits": compiler.resource_limiter.stats(),
+        "scheduler": request.app.state.compile_scheduler.stats(),
+        "jobs": request.app.state.job_manager.stats(),
+        "artifacts": request.app.state.job_manager.artifacts.stats(),
+        "previews": request.app.state.job_manager.previews.stats()
+    }
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(request: Request) -> PlainTextResponse:
+    """Expose pipeline metrics in the Prometheus text format"""
+    return PlainTextResponse(
+        REGISTRY.render(runtime_metrics(request.app.state)),
+        media_type="text/plain; version=0.0.4"
+    )
+
 @router.get("/config")
 async def get_config() -> dict:
     """Get public configuration settings"""
@@ -308,6 +645,7 @@ async def get_config() -> dict:
     return {
         "max_image_size_mb": settings.MAX_IMAGE_SIZE / (1024 * 1024),
         "allowed_image_types": settings.ALLOWED_IMAGE_TYPES,
+        # Larger uploads are rejected, or downsampled to it when optimized
         "max_image_dimension": settings.MAX_IMAGE_DIMENSION,
         "storage_type": "local" if settings.IS_LOCAL else "supabase",
         "optimize_images": settings.OPTIMIZE_IMAGES
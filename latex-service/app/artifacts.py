@@ -0,0 +1,110 @@
+# app/artifacts.py
+import re
+import shutil
+import asyncio
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import aiofiles
+
+logger = logging.getLogger("latex-service")
+
+# Job ids and artifact names; a leading dot would allow "." and ".."
+ARTIFACT_NAME = re.compile(r'^\w[\w.-]*$')
+
+class JobArtifacts:
+    """Raw engine and tool output of one compile job, held in memory
+
+    The total is capped at max_bytes: oversized entries keep their tail,
+    which is where TeX reports what went wrong, and the oldest entries are
+    dropped to make room. Nothing touches the disk unless the job fails or
+    the caller asked to keep its output.
+    """
+    def __init__(self, max_bytes: int, keep: bool = False):
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.truncated = False
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._seq = 0
+
+    def add(self, name: str, data: Union[str, bytes]) -> None:
+        """Record output under a sequence-numbered name, e.g. 01-pdflatex.out"""
+        if isinstance(data, str):
+            data = data.encode("utf-8", errors="replace")
+        if len(data) > self.max_bytes:
+            data = data[-self.max_bytes:]
+            self.truncated = True
+        self._seq += 1
+        self._entries[f"{self._seq:02d}-{name}"] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, dropped = self._entries.popitem(last=False)
+            self._size -= len(dropped)
+            self.truncated = True
+
+    async def add_file(self, name: str, path: Path) -> None:
+        """Record the tail of a file, such as the .log of a failed pass"""
+        if not path.exists():
+            return
+        async with aiofiles.open(path, 'rb') as f:
+            await f.seek(max(0, path.stat().st_size - self.max_bytes))
+            self.add(name, await f.read())
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._entries)
+
+    def items(self) -> List[Tuple[str, bytes]]:
+        return list(self._entries.items())
+
+class ArtifactStore:
+    """Per-job directories of kept output, the newest max_jobs of them"""
+    def __init__(self, base_dir: str, max_job_bytes: int, max_jobs: int):
+        self.base_dir = Path(base_dir)
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        self.max_job_bytes = max_job_bytes
+        self.max_jobs = max_jobs
+        self.saved = 0
+
+    def create(self, keep: bool = False) -> JobArtifacts:
+        return JobArtifacts(self.max_job_bytes, keep)
+
+    async def save(self, job_id: str, artifacts: JobArtifacts) -> List[str]:
+        """Write a job's artifacts to disk and return their names"""
+        if not artifacts.names:
+            return []
+        job_dir = self.base_dir / job_id
+        job_dir.mkdir(parents=True, exist_ok=True)
+        for name, data in artifacts.items():
+            async with aiofiles.open(job_dir / name, 'wb') as f:
+                await f.write(data)
+        self.saved += 1
+        logger.debug(f"Kept {len(artifacts.names)} output artifact(s) for job {job_id}")
+        await asyncio.get_running_loop().run_in_executor(None, self._prune)
+        return artifacts.names
+
+    def _prune(self) -> None:
+        job_dirs = sorted(
+            (path for path in self.base_dir.iterdir() if path.is_dir()),
+            key=lambda path: path.stat().st_mtime
+        )
+        for job_dir in job_dirs[:max(0, len(job_dirs) - self.max_jobs)]:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def list(self, job_id: str) -> Optional[List[str]]:
+        job_dir = self.base_dir / job_id
+        if not ARTIFACT_NAME.match(job_id) or not job_dir.is_dir():
+            return None
+        return sorted(path.name for path in job_dir.iterdir())
+
+    def path(self, job_id: str, name: str) -> Optional[Path]:
+        if not ARTIFACT_NAME.match(job_id) or not ARTIFACT_NAME.match(name):
+            return None
+        path = self.base_dir / job_id / name
+        return path if path.is_file() else None
+
+    def stats(self) -> Dict:
+        return {"saved": self.saved, "max_jobs": self.max_jobs, "max_job_bytes": self.max_job_bytes}
@@ -0,0 +1,147 @@
+# app/blob_store.py
+import os
+import re
+import stat
+import uuid
+import hashlib
+import logging
+from pathlib import Path, PurePosixPath
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+import aiofiles
+
+from app.cache import DiskCache, link_or_copy
+
+logger = logging.getLogger("latex-service")
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# Files TeX writes while compiling; a hard-linked blob under one of these names would be overwritten in place
+GENERATED_EXTENSIONS = {".aux", ".log", ".fls", ".fmt", ".toc", ".lof", ".lot", ".out", ".blg"}
+# Jobname the compiler gives the main document, so top-level document.* files are its outputs
+JOB_NAME = "document"
+
+class ManifestError(ValueError):
+    """Raised when a project manifest names unsafe paths or malformed hashes"""
+
+class BlobRejectedError(Exception):
+    """Raised when an uploaded blob doesn't match its hash"""
+
+class BlobTooLargeError(BlobRejectedError):
+    """Raised when an uploaded blob exceeds the size limit"""
+
+class MissingBlobsError(Exception):
+    """Raised when a manifest references blobs the store doesn't hold"""
+    def __init__(self, missing: List[str]):
+        self.missing = missing
+        super().__init__(f"{len(missing)} blob(s) referenced by the manifest have not been uploaded")
+
+def validate_manifest(files: Dict[str, str], main_file: Optional[str], max_files: int) -> Dict[str, str]:
+    """Check a {path: sha256} manifest and return it with normalized paths"""
+    if len(files) > max_files:
+        raise ManifestError(f"Manifest lists {len(files)} files, the limit is {max_files}")
+
+    normalized: Dict[str, str] = {}
+    for path, digest in files.items():
+        if not SHA256_PATTERN.match(digest or ""):
+            raise ManifestError(f"Invalid sha256 for {path}: {digest}")
+        parts = PurePosixPath(path).parts
+        if not parts or path.startswith("/") or "\\" in path or any(part in ("..", ".", "") for part in parts):
+            raise ManifestError(f"Invalid path in manifest: {path}")
+        clean = str(PurePosixPath(*parts))
+        name = PurePosixPath(clean)
+        if clean != main_file and (
+            name.suffix in GENERATED_EXTENSIONS
+            or (len(parts) == 1 and name.stem == JOB_NAME)
+            or parts[0].startswith(".")
+        ):
+            raise ManifestError(f"Path is reserved for compiler output: {path}")
+        normalized[clean] = digest
+
+    if main_file is not None and main_file not in normalized:
+        raise ManifestError(f"Main file {main_file} is not in the manifest")
+    return normalized
+
+class BlobStore:
+    """Content-addressed store of project files uploaded for manifest compiles
+
+    Blobs are kept read-only under their sha256 and hard-linked into build
+    directories, so a project tree costs no copies however often it is built.
+    """
+    def __init__(self, cache_dir: str, max_bytes: int, max_blob_bytes: int):
+        self.cache = DiskCache(cache_dir, max_bytes)
+        self.max_blob_bytes = max_blob_bytes
+        self.uploads = 0
+        self.bytes_uploaded = 0
+        self.linked_files = 0
+        self._tmp_dir = Path(cache_dir) / "tmp"
+        self._tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    def missing(self, digests: Iterable[str]) -> List[str]:
+        """Return the digests the store doesn't hold, without duplicates"""
+        return sorted({digest for digest in digests if not self.cache.contains(digest)})
+
+    async def store(self, digest: str, chunks: AsyncIterator[bytes]) -> int:
+        """Stream a blob to disk, verifying it against digest, and return its size"""
+        if self.cache.contains(digest):
+            return self.cache.get(digest).stat().st_size
+
+        tmp_path = self._tmp_dir / f"{digest}.{uuid.uuid4().hex}.part"
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_blob_bytes:
+                        raise BlobTooLargeError(f"Blob exceeds {self.max_blob_bytes} bytes")
+                    hasher.update(chunk)
+                    await f.write(chunk)
+
+            if hasher.hexdigest() != digest:
+                raise BlobRejectedError(f"Content hashes to {hasher.hexdigest()}, not {digest}")
+
+            path = self.cache.put(digest, tmp_path, move=True)
+            if path == tmp_path:
+                raise BlobTooLargeError(f"Blob of {size} bytes doesn't fit in the blob store")
+            os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        self.uploads += 1
+        self.bytes_uploaded += size
+        logger.debug(f"Stored blob {digest[:12]} ({size} bytes)")
+        return size
+
+    def read_text(self, digest: str) -> str:
+        path = self.cache.get(digest)
+        if path is None:
+            raise MissingBlobsError([digest])
+        return path.read_text(encoding="utf-8", errors="replace")
+
+    def materialize(self, files: Dict[str, str], work_dir: Path) -> Dict[Path, str]:
+        """Hard-link every manifest file into work_dir and return {path: digest}
+
+        Files already linked to the right blob (in a warm directory) are left alone.
+        """
+        sources = {path: self.cache.get(digest) for path, digest in files.items()}
+        missing = sorted({files[path] for path, source in sources.items() if source is None})
+        if missing:
+            raise MissingBlobsError(missing)
+
+        linked: Dict[Path, str] = {}
+        for path, source in sources.items():
+            target = work_dir / path
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if not (target.exists() and os.path.samefile(source, target)):
+                link_or_copy(source, target)
+                self.linked_files += 1
+            linked[target] = files[path]
+        return linked
+
+    def stats(self) -> Dict:
+        return {
+            **self.cache.stats(),
+            "uploads": self.uploads,
+            "bytes_uploaded": self.bytes_uploaded,
+            "linked_files": self.linked_files
+        }
@@ -0,0 +1,129 @@
+# app/build_dirs.py
+import re
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Set
+
+logger = logging.getLogger("latex-service")
+
+def _directory_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+class WarmBuildDirectories:
+    """Per-project build directories that keep auxiliary files between compiles"""
+    # Seconds between eviction sweeps when no compile releases a directory
+    EVICTION_INTERVAL = 60
+    # Evicted directories are moved here and deleted off the event loop; never a project name, which ends in a hash
+    TRASH_DIR = ".trash"
+
+    def __init__(self, root_dir: str, max_bytes: int, idle_seconds: int):
+        self.root_dir = Path(root_dir)
+        self._trash_dir = self.root_dir / self.TRASH_DIR
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.evictions = 0
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._in_use: Set[str] = set()
+        self._last_used: Dict[str, float] = {}
+        self._sizes: Dict[str, int] = {}
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        """Pick up build directories left by a previous run"""
+        shutil.rmtree(self._trash_dir, ignore_errors=True)
+        self._trash_dir.mkdir()
+        for path in self.root_dir.iterdir():
+            if path.is_dir() and path != self._trash_dir:
+                self._last_used[path.name] = path.stat().st_mtime
+                self._sizes[path.name] = _directory_size(path)
+
+    @staticmethod
+    def _dir_name(project_id: str) -> str:
+        safe_id = re.sub(r'[^A-Za-z0-9_.-]', '_', project_id)[:64]
+        return f"{safe_id}-{hashlib.sha256(project_id.encode()).hexdigest()[:8]}"
+
+    @asynccontextmanager
+    async def acquire(self, project_id: str) -> AsyncIterator[Path]:
+        """Lock and yield the warm build directory for a project"""
+        name = self._dir_name(project_id)
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        if lock.locked():
+            logger.debug(f"Waiting for warm build directory of project {project_id}")
+
+        async with lock:
+            build_dir = self.root_dir / name
+            warm = build_dir.exists()
+            build_dir.mkdir(parents=True, exist_ok=True)
+            self._in_use.add(name)
+            logger.debug(f"Using {'warm' if warm else 'new'} build directory {build_dir}")
+            try:
+                yield build_dir
+            finally:
+                try:
+                    # Still under the lock, so nothing writes to the directory meanwhile
+                    self._sizes[name] = await asyncio.to_thread(_directory_size, build_dir)
+                except FileNotFoundError:
+                    self._sizes.pop(name, None)
+                finally:
+                    self._in_use.discard(name)
+                    self._last_used[name] = time.time()
+                self.evict()
+
+    async def run_eviction(self) -> None:
+        """Evict periodically, so idle directories are reclaimed on a quiet server too"""
+        while True:
+            await asyncio.sleep(self.EVICTION_INTERVAL)
+            self.evict()
+
+    def _remove(self, name: str, reason: str) -> None:
+        # A rename is instant; the tree itself is deleted in a worker thread
+        trash = self._trash_dir / f"{name}-{uuid.uuid4().hex[:8]}"
+        try:
+            (self.root_dir / name).rename(trash)
+        except FileNotFoundError:
+            pass
+        else:
+            asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, trash, True)
+        self._last_used.pop(name, None)
+        self._sizes.pop(name, None)
+        lock = self._locks.get(name)
+        if lock is not None and not lock.locked():
+            del self._locks[name]
+        self.evictions += 1
+        logger.debug(f"Evicted warm build directory {name} ({reason})")
+
+    def evict(self) -> None:
+        """Drop directories idle for too long, then least recently used ones over the disk budget"""
+        now = time.time()
+        idle = [
+            name for name, last_used in self._last_used.items()
+            if name not in self._in_use and now - last_used > self.idle_seconds
+        ]
+        for name in idle:
+            self._remove(name, "idle")
+
+        candidates = sorted(
+            (name for name in self._last_used if name not in self._in_use),
+            key=lambda name: self._last_used[name]
+        )
+        for name in candidates:
+            if sum(self._sizes.values()) <= self.max_bytes:
+                break
+            self._remove(name, "over disk budget")
+
+    def stats(self) -> Dict:
+        return {
+            "directories": len(self._last_used),
+            "in_use": len(self._in_use),
+            "size_bytes": sum(self._sizes.values()),
+            "max_bytes": self.max_bytes,
+            "idle_seconds": self.idle_seconds,
+            "evictions": self.evictions
+        }
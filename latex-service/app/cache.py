@@ -0,0 +1,158 @@
+# app/cache.py
+import os
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict
+
+logger = logging.getLogger("latex-service")
+
+def file_digest(path: Path, chunk_size: int = 65536) -> str:
+    """Return the sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_or_copy(source: Path, target: Path) -> None:
+    """Hard-link source to target, copying when linking isn't possible"""
+    target.unlink(missing_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+class DiskCache:
+    """Content-keyed file cache on disk with a size budget and LRU eviction"""
+    def __init__(self, cache_dir: str, max_bytes: int, suffix: str = ""):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def _load(self) -> None:
+        """Rebuild the in-memory LRU order from files left by a previous run"""
+        found = []
+        for path in self.cache_dir.glob(f"??/*{self.suffix}"):
+            if path.name.startswith('.'):
+                continue
+            stats = path.stat()
+            key = path.name[:len(path.name) - len(self.suffix)] if self.suffix else path.name
+            found.append((stats.st_mtime, key, stats.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+        if found:
+            logger.debug(f"Loaded {len(found)} entries ({self._total_bytes} bytes) from cache {self.cache_dir}")
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                self._path_for(key).unlink()
+            except FileNotFoundError:
+                pass
+            logger.debug(f"Evicted cache entry {key} ({size} bytes) from {self.cache_dir}")
+
+    def get(self, key: str) -> Optional[Path]:
+        """Return the cached file for key, or None on a miss"""
+        if key in self._entries:
+            path = self._path_for(key)
+            if path.exists():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # Persist recency so the LRU order survives restarts
+                os.utime(path)
+                return path
+
+            # File was removed behind our back
+            self._total_bytes -= self._entries.pop(key)
+
+        self.misses += 1
+        return None
+
+    def contains(self, key: str) -> bool:
+        """Check for an entry without touching hit/miss counters or LRU order"""
+        return key in self._entries and self._path_for(key).exists()
+
+    def put(self, key: str, source: Path, move: bool = False) -> Path:
+        """Store a copy of source under key and return the cached path"""
+        size = source.stat().st_size
+        if size > self.max_bytes:
+            logger.debug(f"Not caching {source}: {size} bytes exceeds cache budget")
+            return source
+        target = self._write(key, source, move)
+        self._add(key, size)
+        return target
+
+    async def put_async(self, key: str, source: Path, move: bool = False) -> Path:
+        """put() with the copy or move done in a worker thread
+
+        Only the entry bookkeeping runs on the event loop.
+        """
+        size = source.stat().st_size
+        if size > self.max_bytes:
+            logger.debug(f"Not caching {source}: {size} bytes exceeds cache budget")
+            return source
+        target = await asyncio.to_thread(self._write, key, source, move)
+        self._add(key, size)
+        return target
+
+    def _write(self, key: str, source: Path, move: bool) -> Path:
+        target = self._path_for(key)
+        target.parent.mkdir(exist_ok=True)
+        # Unique per call, since put_async can write the same key from several threads
+        tmp_path = target.parent / f".{key}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+        if move:
+            shutil.move(source, tmp_path)
+        else:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+        return target
+
+    def _add(self, key: str, size: int) -> None:
+        if key in self._entries:
+            self._total_bytes -= self._entries.pop(key)
+        self._entries[key] = size
+        self._total_bytes += size
+        self._evict()
+
+    def discard(self, key: str) -> None:
+        """Remove an entry if present"""
+        if key in self._entries:
+            self._total_bytes -= self._entries.pop(key)
+        try:
+            self._path_for(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+        }
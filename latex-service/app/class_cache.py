@@ -0,0 +1,188 @@
+# app/class_cache.py
+import os
+import stat
+import shutil
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.storage import StorageProvider
+from app.process import run_command
+
+logger = logging.getLogger("latex-service")
+
+@dataclass
+class ClassSet:
+    """A read-only TEXMF tree holding one exact set of class and style files"""
+    digest: str
+    tree: Path
+    files: Dict[str, str]
+
+def _make_writable(path: Path) -> None:
+    for root, dirs, files in os.walk(path):
+        os.chmod(root, 0o755)
+        for name in dirs:
+            os.chmod(os.path.join(root, name), 0o755)
+
+def _make_read_only(path: Path) -> None:
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            os.chmod(os.path.join(root, name), stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.chmod(root, 0o555)
+
+class ClassFileCache:
+    """Content-addressed TEXMF trees for the class and style files of projects
+
+    Each distinct set of files gets its own tree, built and indexed with
+    texhash once, then shared read-only by every compile that uses the
+    same set. Compiles select their tree through TEXMFHOME in the engine's
+    environment, so projects never see each other's classes.
+    """
+    MAX_DIGEST_ENTRIES = 16384
+
+    def __init__(self, cache_dir: str, max_trees: int):
+        self.cache_dir = Path(cache_dir)
+        self.max_trees = max_trees
+        self.builds = 0
+        self.hits = 0
+        self.evictions = 0
+        self._trees: "OrderedDict[str, None]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # (storage path, size, modified) -> content digest, so unchanged files aren't re-read
+        self._digests: "OrderedDict[Tuple, str]" = OrderedDict()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        """Pick up trees left by a previous run, least recently used first"""
+        found = []
+        for path in self.cache_dir.iterdir():
+            if path.name.startswith('.'):
+                # Half-built tree from an interrupted build
+                _make_writable(path)
+                shutil.rmtree(path, ignore_errors=True)
+            elif path.is_dir():
+                found.append((path.stat().st_mtime, path.name))
+        for _, digest in sorted(found):
+            self._trees[digest] = None
+
+    @staticmethod
+    def set_digest(files: Dict[str, str]) -> str:
+        """Digest of a set of files given as {filename: content digest}"""
+        digest = hashlib.sha256()
+        for name in sorted(files):
+            digest.update(f"{name}\0{files[name]}\0".encode())
+        return digest.hexdigest()
+
+    async def prepare(self, storage_provider: StorageProvider, project_id: str) -> Optional[ClassSet]:
+        """Return the tree holding the project's class files, or None when it has none"""
+        entries = await storage_provider.list_class_files(project_id)
+        if not entries:
+            return None
+
+        # Only files whose version changed are read, concurrently
+        unknown = [
+            entry for entry in entries
+            if (entry["path"], entry.get("size"), entry.get("modified")) not in self._digests
+        ]
+        contents: Dict[str, bytes] = dict(zip(
+            (entry["name"] for entry in unknown),
+            await storage_provider.read_files([entry["path"] for entry in unknown])
+        ))
+        files: Dict[str, str] = {}
+        for entry in entries:
+            version = (entry["path"], entry.get("size"), entry.get("modified"))
+            digest = self._digests.get(version)
+            if digest is None:
+                digest = hashlib.sha256(contents[entry["name"]]).hexdigest()
+                self._digests[version] = digest
+                while len(self._digests) > self.MAX_DIGEST_ENTRIES:
+                    self._digests.popitem(last=False)
+            files[entry["name"]] = digest
+
+        set_digest = self.set_digest(files)
+        tree = self.cache_dir / set_digest
+        lock = self._locks.setdefault(set_digest, asyncio.Lock())
+        async with lock:
+            if set_digest in self._trees and tree.exists():
+                self.hits += 1
+                self._trees.move_to_end(set_digest)
+                os.utime(tree)
+            else:
+                await self._build(storage_provider, entries, contents, tree)
+        if not lock.locked():
+            self._locks.pop(set_digest, None)
+        return ClassSet(digest=set_digest, tree=tree, files=files)
+
+    async def _build(
+        self,
+        storage_provider: StorageProvider,
+        entries: List[Dict],
+        contents: Dict[str, bytes],
+        tree: Path
+    ) -> None:
+        """Write a new tree, index it with texhash and publish it atomically"""
+        staging = self.cache_dir / f".{tree.name}.{os.getpid()}"
+        latex_dir = staging / "tex" / "latex"
+        latex_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            missing = [entry for entry in entries if entry["name"] not in contents]
+            contents.update(zip(
+                (entry["name"] for entry in missing),
+                await storage_provider.read_files([entry["path"] for entry in missing])
+            ))
+            for entry in entries:
+                (latex_dir / Path(entry["name"]).name).write_bytes(contents[entry["name"]])
+                logger.debug(f"Wrote class file {entry['name']} to {latex_dir}")
+
+            # Without an ls-R index kpathsea falls back to searching the tree on disk
+            try:
+                returncode, _, stderr = await run_command(["texhash", str(staging)], staging)
+                if returncode != 0:
+                    logger.warning(f"texhash failed for {staging}: {stderr.decode('utf-8', errors='replace')}")
+            except OSError as e:
+                logger.warning(f"Could not run texhash: {str(e)}")
+
+            _make_read_only(staging)
+            if tree.exists():
+                # Left by a previous run; its content is identical by construction
+                _make_writable(staging)
+                shutil.rmtree(staging)
+            else:
+                os.rename(staging, tree)
+        except Exception:
+            _make_writable(staging)
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        self.builds += 1
+        self._trees[tree.name] = None
+        logger.info(f"Built class file tree {tree.name[:12]} with {len(entries)} file(s)")
+        self._evict()
+
+    def _evict(self) -> None:
+        while len(self._trees) > self.max_trees:
+            digest, _ = self._trees.popitem(last=False)
+            if digest in self._locks:
+                # In use by a compile that is preparing it right now
+                self._trees[digest] = None
+                break
+            path = self.cache_dir / digest
+            if path.exists():
+                _make_writable(path)
+                shutil.rmtree(path, ignore_errors=True)
+            self.evictions += 1
+            logger.debug(f"Evicted class file tree {digest[:12]}")
+
+    def stats(self) -> Dict:
+        return {
+            "trees": len(self._trees),
+            "max_trees": self.max_trees,
+            "builds": self.builds,
+            "hits": self.hits,
+            "evictions": self.evictions
+        }
@@ -10,6 +10,11 @@ class Settings:
     ENV = os.getenv("ENV", "development")
     IS_LOCAL = ENV == "development"
 
+    # Logging settings
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if IS_LOCAL else "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text or json
+    LOG_DEBUG_SAMPLE_RATE = int(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1" if IS_LOCAL else "10"))  # Keep 1 in N debug lines per call site
+
     # Supabase settings
     SUPABASE_URL = os.getenv("SUPABASE_URL")
     SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -17,11 +22,81 @@ class Settings:
     
     # Storage settings
     LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", "storage")
+    STORAGE_INDEX_PATH = os.getenv("STORAGE_INDEX_PATH", f"{LOCAL_STORAGE_DIR.rstrip('/')}.index.sqlite3")  # SQLite file listing stored files
     TEMP_DIR = os.getenv("TEMP_DIR", "/tmp/latex")
+    STORAGE_IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", "16"))  # Threads for blocking storage calls
+    STORAGE_BATCH_CONCURRENCY = int(os.getenv("STORAGE_BATCH_CONCURRENCY", "8"))  # Concurrent requests per batch operation
+    SIGNED_URL_CACHE_SIZE = int(os.getenv("SIGNED_URL_CACHE_SIZE", "10000"))  # Signed URLs kept per worker
+    SIGNED_URL_EXPIRY_MARGIN = int(os.getenv("SIGNED_URL_EXPIRY_MARGIN", "300"))  # Seconds before expiry a URL stops being reused
     
     # Compilation settings
     MAX_COMPILATION_TIME = int(os.getenv("MAX_COMPILATION_TIME", "300"))
+    COMPILE_CONCURRENCY = int(os.getenv("COMPILE_CONCURRENCY", str(os.cpu_count() or 1)))
+    COMPILE_QUEUE_SIZE = int(os.getenv("COMPILE_QUEUE_SIZE", "32"))  # Requests allowed to wait for a slot
+    JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "1000"))  # Finished compile jobs kept for status queries
+    COMPILE_COALESCING = os.getenv("COMPILE_COALESCING", "true").lower() == "true"  # Newer requests replace queued or running jobs for the same file
+    LATEX_ENGINE = os.getenv("LATEX_ENGINE", "pdflatex")
+    MAX_LATEX_PASSES = int(os.getenv("MAX_LATEX_PASSES", "5"))
+    PREVIEW_MAX_PASSES = int(os.getenv("PREVIEW_MAX_PASSES", "2"))  # Pass cap for mode "preview" compiles
+    LATEX_OUTPUT_MAX_SIZE = int(os.getenv("LATEX_OUTPUT_MAX_SIZE", "256")) * 1024  # Default 256KB of engine output kept per run
+
+    # Resource limits of each engine and tool process, per compile mode; 0 disables a limit
+    COMPILE_CPU_LIMIT = int(os.getenv("COMPILE_CPU_LIMIT", "120"))  # CPU seconds
+    COMPILE_MEMORY_LIMIT = int(os.getenv("COMPILE_MEMORY_LIMIT", "2048")) * 1024 * 1024  # Default 2GB of address space
+    COMPILE_OPEN_FILES_LIMIT = int(os.getenv("COMPILE_OPEN_FILES_LIMIT", "512"))
+    COMPILE_OUTPUT_SIZE_LIMIT = int(os.getenv("COMPILE_OUTPUT_SIZE_LIMIT", "512")) * 1024 * 1024  # Default 512MB per written file
+    PREVIEW_CPU_LIMIT = int(os.getenv("PREVIEW_CPU_LIMIT", "20"))
+    PREVIEW_MEMORY_LIMIT = int(os.getenv("PREVIEW_MEMORY_LIMIT", "1024")) * 1024 * 1024  # Default 1GB
+    PREVIEW_OPEN_FILES_LIMIT = int(os.getenv("PREVIEW_OPEN_FILES_LIMIT", "512"))
+    PREVIEW_OUTPUT_SIZE_LIMIT = int(os.getenv("PREVIEW_OUTPUT_SIZE_LIMIT", "128")) * 1024 * 1024  # Default 128MB
+    CGROUP_ROOT = os.getenv("CGROUP_ROOT", "")  # Delegated cgroup v2 directory for per-compile memory groups; empty disables
+
+    # Tracing settings
+    TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("logs", "traces.jsonl"))  # One span tree per compile job; empty disables
+    TRACE_FILE_MAX_SIZE = int(os.getenv("TRACE_FILE_MAX_SIZE", "100")) * 1024 * 1024  # Default 100MB, then rotated to .1
+
+    # Raw engine output kept for failed (or explicitly requested) jobs
+    ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", os.path.join(TEMP_DIR, "artifacts"))
+    ARTIFACT_MAX_SIZE = int(os.getenv("ARTIFACT_MAX_SIZE", "1024")) * 1024  # Default 1MB per job
+    ARTIFACT_MAX_JOBS = int(os.getenv("ARTIFACT_MAX_JOBS", "200"))  # Jobs whose output is kept on disk
+
+    # Compile result cache settings
+    COMPILE_CACHE_ENABLED = os.getenv("COMPILE_CACHE_ENABLED", "true").lower() == "true"
+    COMPILE_CACHE_DIR = os.getenv("COMPILE_CACHE_DIR", os.path.join(TEMP_DIR, "cache", "pdf"))
+    COMPILE_CACHE_MAX_SIZE = int(os.getenv("COMPILE_CACHE_MAX_SIZE", "512")) * 1024 * 1024  # Default 512MB
+
+    # Precompiled preamble format cache settings
+    FORMAT_CACHE_ENABLED = os.getenv("FORMAT_CACHE_ENABLED", "true").lower() == "true"
+    FORMAT_CACHE_DIR = os.getenv("FORMAT_CACHE_DIR", os.path.join(TEMP_DIR, "cache", "fmt"))
+    FORMAT_CACHE_MAX_SIZE = int(os.getenv("FORMAT_CACHE_MAX_SIZE", "1024")) * 1024 * 1024  # Default 1GB
+
+    # Warm build directory settings (incremental recompilation)
+    WARM_BUILDS_ENABLED = os.getenv("WARM_BUILDS_ENABLED", "false").lower() == "true"
+    WARM_BUILD_DIR = os.getenv("WARM_BUILD_DIR", os.path.join(TEMP_DIR, "builds"))
+    WARM_BUILD_MAX_SIZE = int(os.getenv("WARM_BUILD_MAX_SIZE", "1024")) * 1024 * 1024  # Default 1GB
+    WARM_BUILD_IDLE_TIME = int(os.getenv("WARM_BUILD_IDLE_TIME", "1800"))  # Seconds before eviction
     
+    # Bibliography cache settings
+    BIB_CACHE_DIR = os.getenv("BIB_CACHE_DIR", os.path.join(TEMP_DIR, "cache", "bbl"))
+    BIB_CACHE_MAX_SIZE = int(os.getenv("BIB_CACHE_MAX_SIZE", "256")) * 1024 * 1024  # Default 256MB
+
+    # Blob store for manifest compiles
+    BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join(TEMP_DIR, "cache", "blobs"))
+    BLOB_STORE_MAX_SIZE = int(os.getenv("BLOB_STORE_MAX_SIZE", "2048")) * 1024 * 1024  # Default 2GB
+    BLOB_MAX_SIZE = int(os.getenv("BLOB_MAX_SIZE", "50")) * 1024 * 1024  # Default 50MB per file
+    MANIFEST_MAX_FILES = int(os.getenv("MANIFEST_MAX_FILES", "5000"))
+
+    # Class file cache settings
+    CLASS_CACHE_DIR = os.getenv("CLASS_CACHE_DIR", os.path.join(TEMP_DIR, "cache", "texmf"))
+    CLASS_CACHE_MAX_TREES = int(os.getenv("CLASS_CACHE_MAX_TREES", "256"))  # Distinct class file sets kept
+
+    # Image fetch cache settings
+    IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(TEMP_DIR, "cache", "images"))
+    IMAGE_CACHE_MAX_SIZE = int(os.getenv("IMAGE_CACHE_MAX_SIZE", "1024")) * 1024 * 1024  # Default 1GB
+    IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", "300"))  # Seconds before a cached image is revalidated
+    IMAGE_FETCH_CONNECTIONS = int(os.getenv("IMAGE_FETCH_CONNECTIONS", "32"))  # Pooled HTTP connections
+    IMAGE_FETCH_TIMEOUT = int(os.getenv("IMAGE_FETCH_TIMEOUT", "60"))  # Seconds per image download
+
     # Image settings
     MAX_IMAGE_SIZE = int(os.getenv("MAX_IMAGE_SIZE", "10")) * 1024 * 1024  # Default 10MB
     ALLOWED_IMAGE_TYPES: List[str] = [
@@ -32,10 +107,26 @@ class Settings:
         "application/pdf"  # For vector graphics
     ]
     IMAGE_STORAGE_PATH = os.getenv("IMAGE_STORAGE_PATH", "images")  # Subfolder for images
+
+    # PDF delivery settings
+    PDF_LINEARIZE = os.getenv("PDF_LINEARIZE", "false").lower() == "true"  # Rewrite PDFs for fast web view before storing them
+    QPDF_COMMAND = os.getenv("QPDF_COMMAND", "qpdf")
+
+    # Page preview settings
+    PREVIEW_CACHE_DIR = os.getenv("PREVIEW_CACHE_DIR", os.path.join(TEMP_DIR, "cache", "previews"))
+    PREVIEW_CACHE_MAX_SIZE = int(os.getenv("PREVIEW_CACHE_MAX_SIZE", "1024")) * 1024 * 1024  # Default 1GB
+    PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))  # Processes rasterizing pages
+    PREVIEW_MAX_DPI = int(os.getenv("PREVIEW_MAX_DPI", "300"))
+    PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "80"))  # WebP quality
     
     # Image processing settings
     OPTIMIZE_IMAGES = os.getenv("OPTIMIZE_IMAGES", "false").lower() == "true"
     MAX_IMAGE_DIMENSION = int(os.getenv("MAX_IMAGE_DIMENSION", "2000"))  # Max width/height
+    IMAGE_TARGET_DPI = int(os.getenv("IMAGE_TARGET_DPI", "300"))  # Resolution at the printed size
+    IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+    IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))  # Processes rendering image derivatives
+    IMAGE_DERIVATIVE_DIR = os.getenv("IMAGE_DERIVATIVE_DIR", os.path.join(TEMP_DIR, "cache", "derivatives"))
+    IMAGE_DERIVATIVE_MAX_SIZE = int(os.getenv("IMAGE_DERIVATIVE_MAX_SIZE", "1024")) * 1024 * 1024  # Default 1GB
     
     @property
     def image_storage_dir(self) -> str:
@@ -0,0 +1,144 @@
+# app/format_cache.py
+import re
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from app.cache import DiskCache, file_digest
+
+logger = logging.getLogger("latex-service")
+
+BEGIN_DOCUMENT = re.compile(r'\\begin\s*\{document\}')
+# Preamble commands whose effect (open write streams, shell escapes) cannot be dumped into a format
+UNDUMPABLE = re.compile(r'\\(makeindex|makeglossaries|openout|write18|immediate|directlua|nofiles)\b')
+
+def split_preamble(tex_content: str) -> Optional[Tuple[str, str]]:
+    """Split TeX source into (preamble, body) at the first uncommented \\begin{document}"""
+    offset = 0
+    for line in tex_content.splitlines(keepends=True):
+        code = re.split(r'(?<!\\)%', line, maxsplit=1)[0]
+        match = BEGIN_DOCUMENT.search(code)
+        if match:
+            split_at = offset + match.start()
+            return tex_content[:split_at], tex_content[split_at:]
+        offset += len(line)
+    return None
+
+class FormatCache:
+    """On-disk cache of TeX formats with a project's preamble preloaded"""
+    MAX_FAILED_ENTRIES = 1024
+    MAX_LOAD_FAILURES = 2
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache = DiskCache(cache_dir, max_bytes, suffix=".fmt")
+        self.builds = 0
+        self.build_failures = 0
+        self.load_failures = 0
+        self._load_strikes: Dict[str, int] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Keys whose format failed to build or to compile, so we don't retry on every compile
+        self._failed: "OrderedDict[str, None]" = OrderedDict()
+
+    @staticmethod
+    def format_key(preamble: str, work_dir: Path, engine: str, class_set_digest: str = "") -> str:
+        """Digest of the preamble, the engine and every class/style file it may load"""
+        digest = hashlib.sha256(f"{engine}\0{class_set_digest}\0{preamble}".encode())
+        for path in sorted(work_dir.glob("*")):
+            if path.suffix in (".cls", ".sty"):
+                digest.update(f"\0{path.name}\0{file_digest(path)}".encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def format_name(key: str) -> str:
+        return f"preamble_{key[:16]}"
+
+    @staticmethod
+    def is_dumpable(preamble: str) -> bool:
+        return not UNDUMPABLE.search(preamble)
+
+    def mark_failed(self, key: str) -> None:
+        self.cache.discard(key)
+        self._failed[key] = None
+        while len(self._failed) > self.MAX_FAILED_ENTRIES:
+            self._failed.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        """Drop a format that failed to load so the next compile rebuilds it
+
+        A key whose rebuilt format keeps failing is given up on.
+        """
+        self.load_failures += 1
+        self.cache.discard(key)
+        strikes = self._load_strikes.pop(key, 0) + 1
+        if strikes >= self.MAX_LOAD_FAILURES:
+            self.mark_failed(key)
+        else:
+            self._load_strikes[key] = strikes
+
+    async def get_or_build(
+        self,
+        key: str,
+        preamble: str,
+        work_dir: Path,
+        build: Callable[[Path, str], Awaitable[bool]]
+    ) -> Optional[Path]:
+        """Return the cached format for key, dumping it with build() on a miss
+
+        Returns None when the format cannot be built; callers then compile
+        without a precompiled preamble.
+        """
+        if key in self._failed:
+            return None
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            fmt_path = await self._get_or_build_locked(key, preamble, work_dir, build)
+        if not lock.locked():
+            self._locks.pop(key, None)
+        return fmt_path
+
+    async def _get_or_build_locked(
+        self,
+        key: str,
+        preamble: str,
+        work_dir: Path,
+        build: Callable[[Path, str], Awaitable[bool]]
+    ) -> Optional[Path]:
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        job_name = self.format_name(key)
+        source = work_dir / f"{job_name}.tex"
+        source.write_text(f"{preamble}\n\\dump\n")
+        logger.debug(f"Dumping preamble format {job_name}")
+        self.builds += 1
+        try:
+            fmt_path = work_dir / f"{job_name}.fmt"
+            if not await build(source, job_name) or not fmt_path.exists():
+                logger.info(f"Preamble format {job_name} could not be built, compiling without it")
+                self.build_failures += 1
+                self.mark_failed(key)
+                return None
+            cached = self.cache.put(key, fmt_path, move=True)
+            if cached == fmt_path:
+                # Larger than the whole cache budget, and deleted below
+                logger.info(f"Preamble format {job_name} exceeds the format cache budget, compiling without it")
+                self.mark_failed(key)
+                return None
+            return cached
+        finally:
+            for ext in (".tex", ".log", ".fmt"):
+                (work_dir / f"{job_name}{ext}").unlink(missing_ok=True)
+
+    def stats(self) -> Dict:
+        return {
+            **self.cache.stats(),
+            "builds": self.builds,
+            "build_failures": self.build_failures,
+            "load_failures": self.load_failures,
+            "known_bad": len(self._failed)
+        }
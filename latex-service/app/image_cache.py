@@ -0,0 +1,172 @@
+# app/image_cache.py
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+import aiofiles
+
+from app.cache import DiskCache, file_digest
+
+logger = logging.getLogger("latex-service")
+
+@dataclass
+class ImageEntry:
+    """What the cache knows about one image source"""
+    digest: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # (mtime, size) of a local source file
+    local_stat: Optional[Tuple[int, int]] = None
+    checked_at: float = 0.0
+
+class ImageCache:
+    """Content-addressed cache of project images shared by every compile
+
+    Sources are identified by a stable key (a storage path or URL). Their
+    content is stored once by digest and revalidated with ETag/Last-Modified
+    once the freshness window has passed.
+    """
+    MAX_SOURCES = 16384
+    CHUNK_SIZE = 65536
+
+    def __init__(self, cache_dir: str, max_bytes: int, ttl: int, connections: int, timeout: int):
+        self.cache_dir = Path(cache_dir)
+        self.blobs = DiskCache(str(self.cache_dir / "blobs"), max_bytes)
+        self.ttl = ttl
+        self.connections = connections
+        self.timeout = timeout
+        self.downloads = 0
+        self.revalidations = 0
+        self.not_modified = 0
+        self.bytes_downloaded = 0
+        self._tmp_dir = self.cache_dir / "tmp"
+        self._tmp_dir.mkdir(parents=True, exist_ok=True)
+        self._sources: "OrderedDict[str, ImageEntry]" = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Return the pooled session, creating it on first use inside the event loop"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    def local_name(source_key: str, ext: str) -> str:
+        """Filename for an image in the work dir, stable across processes and restarts"""
+        return f"img_{hashlib.sha256(source_key.encode()).hexdigest()[:16]}{ext}"
+
+    def _remember(self, source_key: str, entry: ImageEntry) -> None:
+        self._sources[source_key] = entry
+        self._sources.move_to_end(source_key)
+        while len(self._sources) > self.MAX_SOURCES:
+            self._sources.popitem(last=False)
+
+    async def fetch_url(self, source_key: str, url: str) -> Tuple[str, Path]:
+        """Return (digest, cached path) of the image behind url, downloading only when it changed"""
+        lock = self._locks.setdefault(source_key, asyncio.Lock())
+        async with lock:
+            result = await self._resolve_url(source_key, url)
+        if not lock.locked():
+            self._locks.pop(source_key, None)
+        return result
+
+    async def _resolve_url(self, source_key: str, url: str) -> Tuple[str, Path]:
+        entry = self._sources.get(source_key)
+        blob = self.blobs.get(entry.digest) if entry else None
+        if blob is not None and time.time() - entry.checked_at < self.ttl:
+            return entry.digest, blob
+
+        headers = {}
+        if blob is not None:
+            self.revalidations += 1
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        logger.debug(f"Fetching image {source_key}{' (revalidating)' if headers else ''}")
+        async with self._get_session().get(url, headers=headers) as response:
+            if response.status == 304 and blob is not None:
+                self.not_modified += 1
+                entry.checked_at = time.time()
+                self._remember(source_key, entry)
+                return entry.digest, blob
+            if response.status != 200:
+                raise Exception(f"Failed to download image: {url}, status: {response.status}")
+            if response.content_length is not None and response.content_length > self.blobs.max_bytes:
+                raise Exception(f"Image at {url} is larger than the image cache ({self.blobs.max_bytes} bytes)")
+
+            digest, blob = await self._store_stream(response)
+            self._remember(source_key, ImageEntry(
+                digest=digest,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+                checked_at=time.time()
+            ))
+            return digest, blob
+
+    async def _store_stream(self, response: aiohttp.ClientResponse) -> Tuple[str, Path]:
+        """Stream a response body to disk while hashing it, then file it under its digest
+
+        Bodies larger than the whole cache budget are rejected, since they
+        could only be kept outside the LRU.
+        """
+        digest = hashlib.sha256()
+        tmp_path = self._tmp_dir / f"{os.getpid()}_{id(response)}.part"
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(self.CHUNK_SIZE):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    if size > self.blobs.max_bytes:
+                        raise Exception(f"Image at {response.url} is larger than the image cache ({self.blobs.max_bytes} bytes)")
+                    await f.write(chunk)
+            self.downloads += 1
+            self.bytes_downloaded += size
+            key = digest.hexdigest()
+            return key, await self.blobs.put_async(key, tmp_path, move=True)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    async def fetch_local(self, source_key: str, path: Path) -> Tuple[str, Path]:
+        """Return (digest, cached path) of a file from local storage
+
+        The digest is recomputed only when the file's mtime or size changed.
+        """
+        stats = path.stat()
+        local_stat = (stats.st_mtime_ns, stats.st_size)
+        entry = self._sources.get(source_key)
+        blob = self.blobs.get(entry.digest) if entry and entry.local_stat == local_stat else None
+        if blob is None:
+            digest = await asyncio.to_thread(file_digest, path)
+            blob = self.blobs.get(digest) or await self.blobs.put_async(digest, path)
+            entry = ImageEntry(digest=digest, local_stat=local_stat, checked_at=time.time())
+        self._remember(source_key, entry)
+        return entry.digest, blob
+
+    def stats(self) -> Dict:
+        return {
+            **self.blobs.stats(),
+            "sources": len(self._sources),
+            "downloads": self.downloads,
+            "bytes_downloaded": self.bytes_downloaded,
+            "revalidations": self.revalidations,
+            "not_modified": self.not_modified
+        }
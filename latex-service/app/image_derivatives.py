@@ -0,0 +1,230 @@
+# app/image_derivatives.py
+import re
+import json
+import math
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from app.cache import DiskCache
+
+logger = logging.getLogger("latex-service")
+
+# Nominal text block of the page, used to turn relative \includegraphics sizes into inches
+TEXT_WIDTH_IN = 6.5
+TEXT_HEIGHT_IN = 9.0
+LENGTH_UNITS_IN = {
+    "in": 1.0,
+    "cm": 1 / 2.54,
+    "mm": 1 / 25.4,
+    "pt": 1 / 72.27,
+    "bp": 1 / 72.0,
+    "\\textwidth": TEXT_WIDTH_IN,
+    "\\linewidth": TEXT_WIDTH_IN,
+    "\\columnwidth": TEXT_WIDTH_IN,
+    "\\textheight": TEXT_HEIGHT_IN,
+}
+LENGTH_OPTION = re.compile(
+    r'\b(width|height)\s*=\s*([\d.]*)\s*(in|cm|mm|pt|bp|\\textwidth|\\linewidth|\\columnwidth|\\textheight)'
+)
+# Output format per source extension; pdflatex can't read GIF or WebP, so those become PNG
+OUTPUT_FORMATS = {
+    ".jpg": ("JPEG", ".jpg"),
+    ".jpeg": ("JPEG", ".jpg"),
+    ".png": ("PNG", ".png"),
+    ".gif": ("PNG", ".png"),
+    ".webp": ("PNG", ".png"),
+}
+# Target sizes are rounded up to this many pixels so small layout tweaks reuse a derivative
+SIZE_STEP = 64
+
+def print_size(options: str) -> Tuple[Optional[float], Optional[float]]:
+    """Return the (width, height) in inches requested by \\includegraphics options, if any"""
+    size: Dict[str, float] = {}
+    for match in LENGTH_OPTION.finditer(options or ""):
+        factor = float(match.group(2)) if match.group(2) not in ("", ".") else 1.0
+        size[match.group(1)] = factor * LENGTH_UNITS_IN[match.group(3)]
+    return size.get("width"), size.get("height")
+
+def render_derivative(
+    source: str,
+    target: str,
+    output_format: str,
+    max_width: int,
+    max_height: int,
+    quality: int
+) -> Dict:
+    """Downsample, recompress and strip metadata from an image; runs in a worker process"""
+    with Image.open(source) as original:
+        source_format = original.format
+        icc_profile = original.info.get("icc_profile")
+        # Apply EXIF orientation before the EXIF block is dropped
+        img = ImageOps.exif_transpose(original)
+        resized = img.width > max_width or img.height > max_height
+        if resized:
+            img.thumbnail((max_width, max_height), Image.LANCZOS)
+
+        options = {"optimize": True}
+        if icc_profile:
+            options["icc_profile"] = icc_profile
+        if output_format == "JPEG":
+            if img.mode not in ("RGB", "L", "CMYK"):
+                img = img.convert("RGB")
+            options.update(quality=quality, progressive=True)
+        elif img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            img = img.convert("RGBA")
+        img.save(target, output_format, **options)
+        return {
+            "width": img.width,
+            "height": img.height,
+            "resized": resized,
+            "converted": source_format != output_format
+        }
+
+class ImageDerivatives:
+    """Print-ready variants of project images, rendered in a process pool and cached by content"""
+    def __init__(self, cache_dir: str, max_bytes: int, workers: int, dpi: int, max_dimension: int, quality: int):
+        self.cache = DiskCache(cache_dir, max_bytes)
+        self.workers = workers
+        self.dpi = dpi
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.rendered = 0
+        self.failures = 0
+        self.bytes_saved = 0
+        self._tmp_dir = Path(cache_dir) / "tmp"
+        self._tmp_dir.mkdir(parents=True, exist_ok=True)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @staticmethod
+    def supports(ext: str) -> bool:
+        return ext.lower() in OUTPUT_FORMATS
+
+    def target_pixels(self, inches: Optional[float]) -> int:
+        """Pixels needed to print a length at the target DPI, capped at the maximum dimension"""
+        if inches is None:
+            return self.max_dimension
+        pixels = math.ceil(inches * self.dpi / SIZE_STEP) * SIZE_STEP
+        return max(SIZE_STEP, min(pixels, self.max_dimension))
+
+    async def render(
+        self,
+        source: Path,
+        source_digest: str,
+        output_format: str,
+        max_width: int,
+        max_height: int
+    ) -> Path:
+        """Return the cached derivative of source for these parameters, rendering it on a miss
+
+        Falls back to source itself when the image can't be processed.
+        """
+        params = {
+            "format": output_format,
+            "width": max_width,
+            "height": max_height,
+            "quality": self.quality
+        }
+        key = hashlib.sha256(f"{source_digest}\0{json.dumps(params, sort_keys=True)}".encode()).hexdigest()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            path = self.cache.get(key)
+            if path is None:
+                path = await self._render_locked(key, source, params)
+        if not lock.locked():
+            self._locks.pop(key, None)
+        return path
+
+    async def _render_locked(self, key: str, source: Path, params: Dict) -> Path:
+        tmp_path = self._tmp_dir / f"{key}.tmp"
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(),
+                render_derivative,
+                str(source),
+                str(tmp_path),
+                params["format"],
+                params["width"],
+                params["height"],
+                params["quality"]
+            )
+        except Exception as e:
+            self.failures += 1
+            tmp_path.unlink(missing_ok=True)
+            logger.warning(f"Could not render derivative of {source.name}, using the original: {str(e)}")
+            return source
+
+        self.rendered += 1
+        source_size = source.stat().st_size
+        derived_size = tmp_path.stat().st_size
+        if derived_size >= source_size and not result["resized"] and not result["converted"]:
+            # Recompressing didn't help; cache the original so we don't try again
+            tmp_path.unlink()
+            logger.debug(f"Derivative of {source.name} is no smaller, keeping the original")
+            return await self.cache.put_async(key, source)
+
+        self.bytes_saved += max(0, source_size - derived_size)
+        logger.debug(
+            f"Rendered derivative of {source.name}: {result['width']}x{result['height']}, "
+            f"{source_size} -> {derived_size} bytes"
+        )
+        return await self.cache.put_async(key, tmp_path, move=True)
+
+    async def optimize(self, source: Path, target: Path, output_format: str) -> Optional[Dict]:
+        """Write a copy of source capped at the maximum dimension and stripped of metadata
+
+        Returns the render result, or None when the image can't be processed.
+        """
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(),
+                render_derivative,
+                str(source),
+                str(target),
+                output_format,
+                self.max_dimension,
+                self.max_dimension,
+                self.quality
+            )
+        except Exception as e:
+            self.failures += 1
+            target.unlink(missing_ok=True)
+            logger.warning(f"Could not optimize {source.name}: {str(e)}")
+            return None
+        self.rendered += 1
+        return result
+
+    async def for_print(self, source: Path, source_digest: str, ext: str, options: str) -> Tuple[Path, str]:
+        """Pick the derivative for an \\includegraphics reference and return it with its extension"""
+        output_format, output_ext = OUTPUT_FORMATS[ext.lower()]
+        width_in, height_in = print_size(options)
+        max_width = self.target_pixels(width_in)
+        max_height = self.target_pixels(height_in)
+        path = await self.render(source, source_digest, output_format, max_width, max_height)
+        if path == source:
+            return source, ext
+        return path, output_ext
+
+    def stats(self) -> Dict:
+        return {
+            **self.cache.stats(),
+            "rendered": self.rendered,
+            "failures": self.failures,
+            "bytes_saved": self.bytes_saved
+        }
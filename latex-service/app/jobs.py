@@ -0,0 +1,432 @@
+# app/jobs.py
+import time
+import uuid
+import functools
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from app.config import settings
+from app.latex_compiler import CompileMode, LatexCompiler, LatexCompilationError, ResourceLimitError
+from app.blob_store import MissingBlobsError
+from app.scheduler import CompileScheduler, QueueReservation
+from app.storage import StorageProvider
+from app.metrics import COMPILE_PHASE_SECONDS
+from app.tracing import Span, TraceExporter, span, start_trace
+from app.artifacts import ArtifactStore, JobArtifacts
+from app.pdf_delivery import pdf_url
+from app.page_previews import PagePreviews
+
+logger = logging.getLogger("latex-service")
+
+class JobState:
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+    TERMINAL = (SUCCEEDED, FAILED)
+
+class CompileJob:
+    """A compilation request tracked from submission to the stored PDF"""
+    MAX_EVENTS = 256
+
+    def __init__(
+        self,
+        project_id: str,
+        output_filename: str,
+        options: Dict[str, Any],
+        keep_output: bool = False,
+        preview: Optional[Tuple[int, str]] = None
+    ):
+        self.id = uuid.uuid4().hex
+        self.project_id = project_id
+        self.output_filename = output_filename
+        self.options = options
+        # Keep raw engine output even if the job succeeds
+        self.keep_output = keep_output
+        # (dpi, format) of page images to render after compiling
+        self.preview = preview
+        # Main document, held until the job starts compiling
+        self.tex_content: Optional[str] = None
+        # Requests answered by this job, counting those merged into it while it was queued
+        self.requests = 1
+        # Newer job whose outcome this one reports after being cancelled for it
+        self.superseded_by: Optional[str] = None
+        self._followers: List["CompileJob"] = []
+        self.state = JobState.QUEUED
+        self.phase = JobState.QUEUED
+        self.created_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self.result: Optional[Dict] = None
+        self.error: Optional[Dict] = None
+        self.exception: Optional[BaseException] = None
+        # Root span of the job's trace, finished with the job
+        self.trace: Optional[Span] = None
+        self.events: List[Dict] = []
+        self._seq = 0
+        self._subscribers: List[asyncio.Queue] = []
+        self._done = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.state in JobState.TERMINAL
+
+    def emit(self, phase: str, details: Optional[Dict] = None) -> None:
+        """Record a progress event and push it to every subscriber"""
+        self._seq += 1
+        self.phase = phase
+        event = {
+            "seq": self._seq,
+            "job_id": self.id,
+            "state": self.state,
+            "phase": phase,
+            "timestamp": datetime.now().isoformat(),
+            **(details or {})
+        }
+        self.events.append(event)
+        if len(self.events) > self.MAX_EVENTS:
+            del self.events[0]
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    def finish(self, state: str, result: Optional[Dict] = None, error: Optional[Dict] = None) -> None:
+        if self.trace is not None:
+            self.trace.finish()
+        self.state = state
+        self.result = result
+        self.error = error
+        self.finished_at = datetime.now()
+        self.emit(state, {"result": result} if result else {"error": error})
+        self._done.set()
+        for follower in self._followers:
+            follower.superseded_by = self.id
+            follower.exception = self.exception
+            follower.finish(state, result, error)
+        self._followers = []
+
+    def supersede(self, job: "CompileJob") -> None:
+        """Hand this job and everyone waiting on it over to a newer job, whose outcome they receive"""
+        self.superseded_by = job.id
+        job._followers.extend([*self._followers, self])
+        job.requests += self.requests
+        self._followers = []
+        self.emit("superseded", {"by": job.id})
+
+    async def wait(self) -> "CompileJob":
+        await self._done.wait()
+        return self
+
+    def subscribe(self) -> asyncio.Queue:
+        """Return a queue pre-filled with past events that receives live ones
+
+        The job's terminal event is always the last one delivered.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in self.events:
+            queue.put_nowait(event)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "project_id": self.project_id,
+            "output_filename": self.output_filename,
+            "state": self.state,
+            "phase": self.phase,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "last_event": self.events[-1] if self.events else None,
+            "requests": self.requests,
+            "superseded_by": self.superseded_by,
+            "result": self.result,
+            "error": self.error
+        }
+
+class JobManager:
+    """Runs compile jobs in the background and keeps a bounded history of them
+
+    With coalesce set, only the newest request per project, output file and
+    mode is compiled. A request arriving while the previous job is queued
+    replaces that job's inputs in place; one arriving while it compiles
+    cancels it, killing its TeX processes, and the cancelled job reports
+    the newer job's outcome. A job already uploading its PDF is left to
+    finish.
+    """
+    def __init__(
+        self,
+        compiler: LatexCompiler,
+        scheduler: CompileScheduler,
+        storage_provider: StorageProvider,
+        max_jobs: int,
+        traces: Optional[TraceExporter] = None,
+        artifacts: Optional[ArtifactStore] = None,
+        previews: Optional[PagePreviews] = None,
+        coalesce: bool = True
+    ):
+        self.compiler = compiler
+        self.scheduler = scheduler
+        self.storage_provider = storage_provider
+        self.max_jobs = max_jobs
+        self.traces = traces
+        self.artifacts = artifacts
+        self.previews = previews
+        self.coalesce = coalesce
+        self.merged = 0
+        self.superseded = 0
+        self._jobs: "OrderedDict[str, CompileJob]" = OrderedDict()
+        self._latest: Dict[Tuple[str, str], str] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Jobs inside the compiler, where cancelling only throws away work
+        self._compiling: Set[str] = set()
+
+    def get(self, job_id: str) -> Optional[CompileJob]:
+        return self._jobs.get(job_id)
+
+    def latest_for(self, project_id: str, output_filename: str) -> Optional[CompileJob]:
+        job_id = self._latest.get((project_id, output_filename))
+        return self._jobs.get(job_id) if job_id else None
+
+    def submit(
+        self,
+        tex_content: Optional[str],
+        project_id: str,
+        output_filename: str,
+        keep_output: bool = False,
+        preview: Optional[Tuple[int, str]] = None,
+        **options
+    ) -> CompileJob:
+        """Queue a compile job and return it without waiting for it to run
+
+        The returned job may be an earlier, still queued one for the same
+        output that now compiles these inputs instead.
+        """
+        previous = self.latest_for(project_id, output_filename)
+        coalescing = (
+            self.coalesce
+            and previous is not None
+            and not previous.done
+            and previous.options.get("mode") == options.get("mode")
+        )
+        if coalescing and previous.state == JobState.QUEUED:
+            self._merge(previous, tex_content, options, keep_output, preview)
+            return previous
+
+        reservation = self.scheduler.reserve()
+
+        job = CompileJob(project_id, output_filename, options, keep_output, preview)
+        job.tex_content = tex_content
+        if coalescing and previous.id in self._compiling:
+            self._supersede(previous, job)
+        self._jobs[job.id] = job
+        self._latest[(project_id, output_filename)] = job.id
+        self._prune()
+        job.emit(JobState.QUEUED, {"queue_depth": self.scheduler.waiting - 1})
+
+        task = asyncio.create_task(self._execute(job, reservation))
+        self._tasks[job.id] = task
+
+        def forget(_) -> None:
+            self._tasks.pop(job.id, None)
+            # A task cancelled before it started never reached the scheduler
+            reservation.release()
+
+        task.add_done_callback(forget)
+        logger.info(f"Submitted compile job {job.id} for project {project_id}")
+        return job
+
+    def _merge(
+        self,
+        job: CompileJob,
+        tex_content: Optional[str],
+        options: Dict[str, Any],
+        keep_output: bool,
+        preview: Optional[Tuple[int, str]]
+    ) -> None:
+        """Replace the inputs of a job that hasn't started, keeping its place in the queue"""
+        job.tex_content = tex_content
+        job.options = options
+        job.keep_output = keep_output
+        job.preview = preview
+        job.requests += 1
+        self.merged += 1
+        job.emit(JobState.QUEUED, {"queue_depth": self.scheduler.waiting, "requests": job.requests})
+        logger.info(f"Merged a newer request for project {job.project_id} into queued compile job {job.id}")
+
+    def _supersede(self, previous: CompileJob, job: CompileJob) -> None:
+        """Cancel a compile made obsolete by job; its waiters receive job's outcome instead"""
+        previous.supersede(job)
+        self.superseded += 1
+        task = self._tasks.get(previous.id)
+        if task is not None:
+            task.cancel()
+        logger.info(f"Cancelling compile job {previous.id}, superseded by {job.id}")
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond the history limit"""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            job = self._jobs[job_id]
+            if job.done:
+                del self._jobs[job_id]
+                key = (job.project_id, job.output_filename)
+                if self._latest.get(key) == job_id:
+                    del self._latest[key]
+
+    async def _execute(self, job: CompileJob, reservation: QueueReservation) -> None:
+        artifacts: Optional[JobArtifacts] = None
+
+        def progress(phase: str, details: Dict) -> None:
+            job.emit(phase, details)
+
+        async def run() -> Any:
+            nonlocal artifacts
+            job.state = JobState.RUNNING
+            job.emit(JobState.RUNNING)
+            # Inputs are read only now, as newer requests may have replaced them while queued
+            tex_content, job.tex_content = job.tex_content, None
+            artifacts = self.artifacts.create(job.keep_output) if self.artifacts is not None else None
+            self._compiling.add(job.id)
+            try:
+                return await self.compiler.compile(
+                    tex_content,
+                    job.project_id,
+                    progress=progress,
+                    artifacts=artifacts,
+                    **job.options
+                )
+            finally:
+                self._compiling.discard(job.id)
+
+        with start_trace("compile_job", job_id=job.id, project_id=job.project_id) as trace:
+            job.trace = trace
+            try:
+                started = time.monotonic()
+                result, queue_info = await self.scheduler.run(run, reservation)
+                job.emit("upload")
+                file_path, url = await self._publish(job, result)
+                pages = await self._render_previews(job, result) if job.preview else None
+                logger.info(f"Compile job {job.id} succeeded in {time.monotonic() - started:.2f}s")
+                kept = await self._keep_artifacts(job, artifacts) if job.keep_output else []
+                job.finish(JobState.SUCCEEDED, result={
+                    "status": "success",
+                    "file_path": file_path,
+                    "url": url,
+                    "pdf_url": pdf_url(job.project_id, job.output_filename),
+                    "storage_type": "local" if settings.IS_LOCAL else "supabase",
+                    "mode": job.options.get("mode", CompileMode.FINAL),
+                    "cached": result.cached,
+                    "passes": result.passes,
+                    "tools": result.tools,
+                    "tools_cached": result.tools_cached,
+                    "artifacts": kept,
+                    "pages": pages,
+                    "queue": queue_info,
+                    "compiled_at": datetime.now().isoformat()
+                })
+            except asyncio.CancelledError as e:
+                if job.superseded_by is not None:
+                    # Finishes along with the job that replaced it
+                    logger.info(f"Compile job {job.id} was cancelled in favour of {job.superseded_by}")
+                    return
+                job.exception = e
+                job.finish(JobState.FAILED, error={"message": "Compile job was cancelled", "type": "CancelledError"})
+                raise
+            except Exception as e:
+                job.exception = e
+                error = {"message": str(e), "type": type(e).__name__}
+                if isinstance(e, LatexCompilationError):
+                    error["log"] = e.log_content
+                if isinstance(e, ResourceLimitError):
+                    error["limit"] = e.limit
+                elif isinstance(e, MissingBlobsError):
+                    error["missing"] = e.missing
+                error["artifacts"] = await self._keep_artifacts(job, artifacts)
+                logger.error(f"Compile job {job.id} failed: {str(e)}")
+                job.finish(JobState.FAILED, error=error)
+            finally:
+                self._export_trace(job)
+
+    async def _render_previews(self, job: CompileJob, result) -> Optional[List[Dict]]:
+        """Page hashes and image URLs of the compiled PDF, rendering the pages that changed"""
+        if self.previews is None:
+            return None
+        dpi, image_format = job.preview
+        job.emit("preview", {"dpi": dpi, "format": image_format})
+        with span("preview"), COMPILE_PHASE_SECONDS.time(phase="preview"):
+            return await self.previews.render(result.pdf_path, dpi, image_format)
+
+    async def _keep_artifacts(self, job: CompileJob, artifacts: Optional[JobArtifacts]) -> List[str]:
+        """Write the job's raw output to the artifact store and return the artifact names"""
+        if artifacts is None:
+            return []
+        try:
+            return await self.artifacts.save(job.id, artifacts)
+        except OSError as e:
+            logger.warning(f"Could not keep output of job {job.id}: {str(e)}")
+            return []
+
+    def _export_trace(self, job: CompileJob) -> None:
+        """Append the job's trace to the trace file without blocking the event loop"""
+        if self.traces is None or job.trace is None:
+            return
+        asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                self.traces.export,
+                job.trace,
+                job_id=job.id,
+                project_id=job.project_id,
+                state="superseded" if job.superseded_by is not None and not job.done else job.state
+            )
+        )
+
+    async def _publish(self, job: CompileJob, result) -> Tuple[str, str]:
+        """Save the compiled PDF to storage unless storage already holds this exact result"""
+        project_id = job.project_id
+        output_filename = job.output_filename
+        if (
+            result.cached
+            and self.compiler.is_published(project_id, output_filename, result.cache_key)
+            and await self.storage_provider.check_pdf_exists(project_id, output_filename)
+        ):
+            logger.debug(f"Cached PDF already stored as {output_filename}, skipping upload")
+            url = await self.storage_provider.get_pdf_url(project_id, output_filename)
+            return f"{project_id}/{output_filename}", url
+
+        logger.debug(f"Compilation successful, saving PDF to storage: {output_filename}")
+        with span("storage_save"), COMPILE_PHASE_SECONDS.time(phase="storage_save"):
+            file_path, url = await self.storage_provider.save_pdf(
+                result.pdf_path,
+                project_id,
+                output_filename
+            )
+        self.compiler.mark_published(project_id, output_filename, result.cache_key)
+        return file_path, url
+
+    def stats(self) -> Dict:
+        states: Dict[str, int] = {}
+        for job in self._jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        return {
+            "tracked": len(self._jobs),
+            "active": len(self._tasks),
+            "states": states,
+            "merged": self.merged,
+            "superseded": self.superseded
+        }
+
+    async def shutdown(self) -> None:
+        """Cancel jobs still running so their TeX processes are killed"""
+        for task in list(self._tasks.values()):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
@@ -1,23 +1,69 @@
 # app/latex_compiler.py
 import os
 import re
-import subprocess
+import json
+import hashlib
+import uuid
 import tempfile
+import time
 from pathlib import Path
+from urllib.parse import urlparse
 import shutil
-from typing import Optional, List, Dict, Tuple
-import asyncio
+from typing import Optional, List, Dict, Iterator, Tuple, Callable, Any
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from datetime import datetime
 import logging
-import aiohttp
 import aiofiles
-from fastapi import HTTPException
 
-from app.storage import StorageProvider
+from app.storage import StorageProvider, gather_limited
 from app.config import settings
+from app.cache import DiskCache, file_digest, link_or_copy
+from app.format_cache import FormatCache, split_preamble
+from app.build_dirs import WarmBuildDirectories
+from app.image_cache import ImageCache
+from app.image_derivatives import ImageDerivatives
+from app.class_cache import ClassFileCache, ClassSet
+from app.blob_store import BlobStore, MissingBlobsError
+from app.pass_scheduler import BIBLIOGRAPHY_COMMAND, PassScheduler
+from app.process import run_command, stream_command
+from app.tex_output import TexOutputMonitor
+from app.metrics import COMPILE_PHASE_SECONDS, COMPILE_SECONDS, PDFLATEX_PASS_SECONDS, RESOURCE_LIMIT_HITS
+from app.tracing import span
+from app.artifacts import JobArtifacts
+from app.resource_limits import JobLimits, Limit, ResourceLimiter, ResourceLimits
 
 logger = logging.getLogger("latex-service")
 
+# Receives (phase, details) as compilation advances
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
+# Engines that can run a pass without writing any output
+DRAFT_MODE_ENGINES = {"pdflatex", "lualatex"}
+# Commands that feed back through the .aux, so a first pass without one only collects data
+CROSS_REFERENCE_COMMAND = re.compile(
+    r'\\(label|(page|eq|auto|name|c|C|v)?ref|[a-zA-Z]*cite[a-zA-Z]*|tableofcontents|listof[a-z]+)\b'
+)
+# width=/height= of an \includegraphics option list
+IMAGE_SIZE_OPTION = re.compile(r'\b(width|height)\s*=\s*([^,\]]+)')
+
+class CompileMode:
+    FINAL = "final"
+    PREVIEW = "preview"
+
+    ALL = (FINAL, PREVIEW)
+
+def _report(progress: Optional[ProgressCallback], phase: str, **details) -> None:
+    if progress is not None:
+        progress(phase, details)
+
+@contextmanager
+def compile_phase(name: str, **attributes) -> Iterator[None]:
+    """Time a compile phase as a trace span and in the phase histogram"""
+    with span(name, **attributes), COMPILE_PHASE_SECONDS.time(phase=name):
+        yield
+
 class LatexCompilationError(Exception):
     """Custom exception for LaTeX compilation errors"""
     def __init__(self, message: str, log_content: str):
@@ -25,101 +71,249 @@ class LatexCompilationError(Exception):
         self.log_content = log_content
         super().__init__(self.message)
 
+class ResourceLimitError(LatexCompilationError):
+    """A compile process was stopped by one of its resource limits"""
+    limit = "resource"
+    description = "resource"
+
+class CpuTimeLimitError(ResourceLimitError):
+    limit = Limit.CPU_TIME
+    description = "CPU time"
+
+class MemoryLimitError(ResourceLimitError):
+    limit = Limit.MEMORY
+    description = "memory"
+
+class OpenFilesLimitError(ResourceLimitError):
+    limit = Limit.OPEN_FILES
+    description = "open files"
+
+class OutputSizeLimitError(ResourceLimitError):
+    limit = Limit.OUTPUT_SIZE
+    description = "output file size"
+
+RESOURCE_LIMIT_ERRORS = {
+    error.limit: error for error in (CpuTimeLimitError, MemoryLimitError, OpenFilesLimitError, OutputSizeLimitError)
+}
+
+@dataclass
+class CompilationResult:
+    """Outcome of a successful compilation"""
+    pdf_path: Path
+    cache_key: str
+    cached: bool = False
+    passes: int = 0
+    tools: List[str] = field(default_factory=list)
+    tools_cached: List[str] = field(default_factory=list)
+
 class LatexCompiler:
+    ENGINE_FLAGS = ["-interaction=nonstopmode", "-file-line-error"]
+    MAX_PUBLISHED_ENTRIES = 1024
+    INPUTS_MANIFEST = ".inputs.json"
+
     def __init__(self, storage_provider: StorageProvider, temp_dir: str = "/tmp/latex"):
         self.storage_provider = storage_provider
         self.temp_dir = Path(temp_dir)
-        self.texmf_dir = Path("/texmf/tex/latex")  # Local TEXMF directory
         os.makedirs(temp_dir, exist_ok=True)
-        os.makedirs(self.texmf_dir, exist_ok=True)
 
-    async def _prepare_class_files(self, work_dir: Path, project_id: str) -> None:
-        """Copy required class files to the working directory"""
+        # Compiled PDFs keyed by a digest of every compilation input
+        self.compile_cache = DiskCache(
+            settings.COMPILE_CACHE_DIR,
+            settings.COMPILE_CACHE_MAX_SIZE,
+            suffix=".pdf"
+        ) if settings.COMPILE_CACHE_ENABLED else None
+        # Formats with each distinct preamble preloaded
+        self.format_cache = FormatCache(
+            settings.FORMAT_CACHE_DIR,
+            settings.FORMAT_CACHE_MAX_SIZE
+        ) if settings.FORMAT_CACHE_ENABLED else None
+        # Read-only TEXMF trees, one per distinct set of project class files
+        self.class_cache = ClassFileCache(settings.CLASS_CACHE_DIR, settings.CLASS_CACHE_MAX_TREES)
+        # Project images shared by every compile, fetched over one pooled session
+        self.image_cache = ImageCache(
+            settings.IMAGE_CACHE_DIR,
+            settings.IMAGE_CACHE_MAX_SIZE,
+            settings.IMAGE_CACHE_TTL,
+            settings.IMAGE_FETCH_CONNECTIONS,
+            settings.IMAGE_FETCH_TIMEOUT
+        )
+        # Downsampled image variants; compiles use them when OPTIMIZE_IMAGES is set
+        self.image_derivatives = ImageDerivatives(
+            settings.IMAGE_DERIVATIVE_DIR,
+            settings.IMAGE_DERIVATIVE_MAX_SIZE,
+            settings.IMAGE_WORKERS,
+            settings.IMAGE_TARGET_DPI,
+            settings.MAX_IMAGE_DIMENSION,
+            settings.IMAGE_JPEG_QUALITY
+        )
+        # Bibliographies (.bbl) keyed by the citation set and databases they were built from
+        self.bib_cache = DiskCache(settings.BIB_CACHE_DIR, settings.BIB_CACHE_MAX_SIZE, suffix=".bbl")
+        # Project files uploaded by hash for manifest compiles
+        self.blob_store = BlobStore(
+            settings.BLOB_STORE_DIR,
+            settings.BLOB_STORE_MAX_SIZE,
+            settings.BLOB_MAX_SIZE
+        )
+        # Per-project build directories reused by incremental compiles
+        self.build_dirs = WarmBuildDirectories(
+            settings.WARM_BUILD_DIR,
+            settings.WARM_BUILD_MAX_SIZE,
+            settings.WARM_BUILD_IDLE_TIME
+        )
+        # Per-mode CPU, memory, open file and output size budgets of engine and tool processes
+        self.resource_limiter = ResourceLimiter(
+            {
+                CompileMode.FINAL: ResourceLimits(
+                    settings.COMPILE_CPU_LIMIT,
+                    settings.COMPILE_MEMORY_LIMIT,
+                    settings.COMPILE_OPEN_FILES_LIMIT,
+                    settings.COMPILE_OUTPUT_SIZE_LIMIT
+                ),
+                CompileMode.PREVIEW: ResourceLimits(
+                    settings.PREVIEW_CPU_LIMIT,
+                    settings.PREVIEW_MEMORY_LIMIT,
+                    settings.PREVIEW_OPEN_FILES_LIMIT,
+                    settings.PREVIEW_OUTPUT_SIZE_LIMIT
+                )
+            },
+            settings.CGROUP_ROOT
+        )
+        # Cache key of the PDF last saved to storage per (project_id, filename)
+        self._published: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+
+    def is_published(self, project_id: str, filename: str, cache_key: str) -> bool:
+        """Check whether storage already holds the PDF for cache_key under filename"""
+        return self._published.get((project_id, filename)) == cache_key
+
+    def mark_published(self, project_id: str, filename: str, cache_key: str) -> None:
+        """Record which compilation result was last saved under filename"""
+        self._published[(project_id, filename)] = cache_key
+        self._published.move_to_end((project_id, filename))
+        while len(self._published) > self.MAX_PUBLISHED_ENTRIES:
+            self._published.popitem(last=False)
+
+    def _engine_settings(self, mode: str = CompileMode.FINAL) -> Dict:
+        engine = {
+            "engine": settings.LATEX_ENGINE,
+            "flags": self.ENGINE_FLAGS,
+            "max_passes": settings.MAX_LATEX_PASSES
+        }
+        if mode == CompileMode.PREVIEW:
+            # Placeholder images and capped passes: never served for a final compile
+            engine.update(mode=mode, max_passes=self._max_passes(mode))
+        return engine
+
+    @staticmethod
+    def _max_passes(mode: str) -> int:
+        if mode == CompileMode.PREVIEW:
+            return min(settings.MAX_LATEX_PASSES, settings.PREVIEW_MAX_PASSES)
+        return settings.MAX_LATEX_PASSES
+
+    def _compute_cache_key(
+        self,
+        work_dir: Path,
+        inputs: List[Path],
+        class_set: Optional[ClassSet] = None,
+        known_digests: Optional[Dict[Path, str]] = None,
+        mode: str = CompileMode.FINAL
+    ) -> str:
+        """Stable digest of the engine settings, the class files and the contents of all input files
+
+        known_digests supplies content digests already at hand, such as those of manifest files.
+        """
+        known_digests = known_digests or {}
+        digest = hashlib.sha256()
+        digest.update(json.dumps(self._engine_settings(mode), sort_keys=True).encode())
+        digest.update(f"\0classes\0{class_set.digest if class_set else ''}".encode())
+        for path in sorted(set(inputs)):
+            digest.update(b"\0" + str(path.relative_to(work_dir)).encode() + b"\0")
+            digest.update((known_digests.get(path) or file_digest(path)).encode())
+        return digest.hexdigest()
+
+    async def _prepare_class_files(self, project_id: str) -> Optional[ClassSet]:
+        """Return the read-only TEXMF tree holding the project's class files, if it has any"""
         logger.debug("Preparing class files")
         try:
-            # Get list of class files
-            cls_response = await self.storage_provider.list_images(project_id)  # This should list class files too
-            class_files = [f for f in cls_response if f.name.endswith('.cls')]
-
-            for cls_file in class_files:
-                # Get the class file content
-                response = await fetch(f"/api/cls/{cls_file.name}")
-                if response.ok:
-                    content = await response.text()
-                    
-                    # Write to both working directory and texmf directory
-                    cls_paths = [
-                        work_dir / cls_file.name,
-                        self.texmf_dir / cls_file.name
-                    ]
-                    
-                    for cls_path in cls_paths:
-                        async with aiofiles.open(cls_path, 'w') as f:
-                            await f.write(content)
-                            logger.debug(f"Wrote class file to {cls_path}")
-
-            # Run texhash to update the database
-            process = await asyncio.create_subprocess_exec(
-                "texhash",
-                str(self.texmf_dir),
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            await process.communicate()
-            logger.debug("Updated TeX database")
-
+            class_set = await self.class_cache.prepare(self.storage_provider, project_id)
+            if class_set is not None:
+                logger.debug(f"Using class file tree {class_set.digest[:12]} ({', '.join(sorted(class_set.files))})")
+            return class_set
         except Exception as e:
             logger.error(f"Error preparing class files: {str(e)}")
             raise
 
-    async def _download_image(self, url: str, target_path: Path) -> None:
-        """Download image from URL to target path"""
+    @staticmethod
+    def _engine_env(class_set: Optional[ClassSet]) -> Dict[str, str]:
+        """Environment for TeX subprocesses of one compile"""
+        # Unwrapped lines keep error messages and page markers on one line
+        env = {**os.environ, "max_print_line": "10000"}
+        if class_set is not None:
+            env["TEXMFHOME"] = str(class_set.tree)
+        return env
+
+    async def _fetch_image(self, image_path: str, urls: Dict[str, str]) -> Tuple[str, Path]:
+        """Fetch an image through the shared image cache and return (digest, cached path)
+
+        urls holds storage URLs signed in bulk for this document.
+        """
         try:
-            logger.debug(f"Downloading image from {url} to {target_path}")
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        raise Exception(f"Failed to download image: {url}, status: {response.status}")
-                    
-                    async with aiofiles.open(target_path, 'wb') as f:
-                        await f.write(await response.read())
-            logger.debug(f"Successfully downloaded image to {target_path}")
+            logger.debug(f"Fetching image {image_path}")
+            with span("image_fetch", path=image_path):
+                if image_path.startswith(('http://', 'https://')):
+                    return await self.image_cache.fetch_url(image_path, image_path)
+
+                local_path = self.storage_provider.resolve_local_path(image_path)
+                if local_path is not None:
+                    return await self.image_cache.fetch_local(image_path, local_path)
+
+                # Signed URLs change on every call, so the cache is keyed by storage path
+                image_url = urls.get(image_path)
+                if image_url is None:
+                    logger.debug(f"Getting URL for storage path: {image_path}")
+                    image_url = await self.storage_provider.get_image_url(image_path)
+                return await self.image_cache.fetch_url(image_path, image_url)
         except Exception as e:
-            logger.error(f"Error downloading image {url}: {str(e)}")
+            logger.error(f"Error fetching image {image_path}: {str(e)}")
             raise
 
-    async def _process_images(self, tex_content: str, work_dir: Path, project_id: str) -> str:
-        """Process images in TeX content and return updated content"""
+    async def _process_images(
+        self,
+        tex_content: str,
+        work_dir: Path,
+        project_id: str,
+        progress: Optional[ProgressCallback] = None
+    ) -> Tuple[str, List[Path]]:
+        """Process images in TeX content and return updated content with the downloaded files"""
         logger.debug("Processing images in LaTeX content")
+        downloaded = []
         
         # Regular expression to find image inclusions
-        image_pattern = r'\\includegraphics(?:\[.*?\])?\{(.*?)\}'
+        image_pattern = r'\\includegraphics(\[.*?\])?\{(.*?)\}'
         
         async def process_match(match) -> str:
-            image_path = match.group(1)
+            options = match.group(1) or ""
+            image_path = match.group(2)
             logger.debug(f"Processing image reference: {image_path}")
             
             try:
                 # If it's a URL or storage path, download the image
                 if image_path.startswith(('http://', 'https://', 'storage/', project_id)):
-                    # Get the URL for the image
-                    if image_path.startswith(('storage/', project_id)):
-                        logger.debug(f"Getting URL for storage path: {image_path}")
-                        image_url = await self.storage_provider.get_image_url(image_path)
-                    else:
-                        image_url = image_path
-                    
-                    # Generate local filename
-                    ext = os.path.splitext(image_path)[1] or '.png'
-                    local_filename = f"img_{hash(image_path)}{ext}"
+                    # Generate a local filename that is stable across compiles and workers
+                    ext = os.path.splitext(urlparse(image_path).path)[1] or '.png'
+                    digest, image_file = await self._fetch_image(image_path, urls)
+                    if settings.OPTIMIZE_IMAGES and ImageDerivatives.supports(ext):
+                        # Downsampled to the size it is printed at
+                        image_file, ext = await self.image_derivatives.for_print(image_file, digest, ext, options)
+
+                    local_filename = ImageCache.local_name(image_path, ext)
                     local_path = work_dir / local_filename
-                    
-                    # Download the image
-                    await self._download_image(image_url, local_path)
+                    link_or_copy(image_file, local_path)
+                    downloaded.append(local_path)
+                    _report(progress, "image_fetch", done=len(downloaded), total=len(positions))
                     logger.debug(f"Image downloaded and saved as {local_filename}")
                     
                     # Return the local path for LaTeX
-                    return f"\\includegraphics{{{local_filename}}}"
+                    return f"\\includegraphics{options}{{{local_filename}}}"
                 
                 logger.debug(f"Using original image path: {image_path}")
                 return match.group(0)
@@ -130,13 +324,22 @@ class LatexCompiler:
         # Process all image references
         positions = []
         for match in re.finditer(image_pattern, tex_content):
-            positions.append((match.start(), match.end(), match.group(1)))
+            positions.append((match.start(), match.end(), match.group(2)))
 
         # Process images concurrently
         if positions:
             logger.debug(f"Found {len(positions)} images to process")
-            new_strings = await asyncio.gather(
-                *(process_match(match) for match in re.finditer(image_pattern, tex_content))
+            _report(progress, "image_fetch", done=0, total=len(positions))
+            # Sign URLs for all storage references up front, in as few requests as the provider allows
+            remote = sorted({
+                path for _, _, path in positions
+                if path.startswith(('storage/', project_id))
+                and self.storage_provider.resolve_local_path(path) is None
+            })
+            urls = await self.storage_provider.get_image_urls(remote) if remote else {}
+            new_strings = await gather_limited(
+                (process_match(match) for match in re.finditer(image_pattern, tex_content)),
+                settings.STORAGE_BATCH_CONCURRENCY
             )
             
             # Replace all matches with processed strings
@@ -147,7 +350,27 @@ class LatexCompiler:
             tex_content = ''.join(result)
             logger.debug("Finished processing all images")
 
-        return tex_content
+        return tex_content, downloaded
+
+    @staticmethod
+    def _placeholder_images(tex_content: str) -> str:
+        """Replace every \\includegraphics with an empty frame of the size it asks for
+
+        Images without a width or height get a 4:3 box half the line wide, so
+        nothing is fetched or read while a draft is being previewed.
+        """
+        def placeholder(match) -> str:
+            size = {key: value.strip() for key, value in IMAGE_SIZE_OPTION.findall(match.group(1) or "")}
+            width = size.get("width")
+            height = size.get("height")
+            if width is None:
+                width = f"1.333\\dimexpr {height}\\relax" if height else "0.5\\linewidth"
+            if height is None:
+                height = f"0.75\\dimexpr {width}\\relax"
+            # A negative \fboxsep draws the frame inside the box, keeping it at width
+            return f"{{\\fboxsep=-\\fboxrule\\fbox{{\\rule{{0pt}}{{{height}}}\\rule{{{width}}}{{0pt}}}}}}"
+
+        return re.sub(r'\\includegraphics(\[.*?\])?\{(.*?)\}', placeholder, tex_content)
 
     async def _parse_latex_log(self, log_path: Path) -> str:
         """Parse LaTeX log file and extract relevant error information"""
@@ -155,110 +378,454 @@ class LatexCompiler:
             return "No log file found"
 
         try:
-            async with aiofiles.open(log_path, 'r', encoding='utf-8', errors='replace') as f:
-                content = await f.read()
+            with compile_phase("log_parse"):
+                async with aiofiles.open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+                    content = await f.read()
 
-            # Extract error messages
-            error_pattern = r'!(.*?)l\.\d+'
-            errors = re.findall(error_pattern, content, re.DOTALL)
-            
-            # Extract warnings
-            warning_pattern = r'Warning:(.*?)$'
-            warnings = re.findall(warning_pattern, content, re.MULTILINE)
+                # Extract error messages
+                error_pattern = r'!(.*?)l\.\d+'
+                errors = re.findall(error_pattern, content, re.DOTALL)
+                
+                # Extract warnings
+                warning_pattern = r'Warning:(.*?)$'
+                warnings = re.findall(warning_pattern, content, re.MULTILINE)
 
-            parsed_log = "=== LaTeX Compilation Log ===\n"
-            
-            if errors:
-                parsed_log += "\nErrors:\n"
-                for error in errors:
-                    parsed_log += f"- {error.strip()}\n"
-            
-            if warnings:
-                parsed_log += "\nWarnings:\n"
-                for warning in warnings:
-                    parsed_log += f"- {warning.strip()}\n"
+                parsed_log = "=== LaTeX Compilation Log ===\n"
+                
+                if errors:
+                    parsed_log += "\nErrors:\n"
+                    for error in errors:
+                        parsed_log += f"- {error.strip()}\n"
+                
+                if warnings:
+                    parsed_log += "\nWarnings:\n"
+                    for warning in warnings:
+                        parsed_log += f"- {warning.strip()}\n"
 
             return parsed_log
         except Exception as e:
             logger.error(f"Error parsing LaTeX log: {str(e)}")
             return "Error parsing log file"
 
-    async def _run_pdflatex(self, tex_file: Path, work_dir: Path) -> Tuple[bool, str]:
-        """Run pdflatex and capture output"""
+    async def _run_pdflatex(
+        self,
+        tex_file: Path,
+        work_dir: Path,
+        extra_args: Optional[List[str]] = None,
+        progress: Optional[ProgressCallback] = None,
+        fail_fast: bool = False,
+        env: Optional[Dict[str, str]] = None,
+        artifacts: Optional[JobArtifacts] = None,
+        limits: Optional[JobLimits] = None
+    ) -> Tuple[bool, str]:
+        """Run pdflatex, reporting shipped pages and errors to progress as they appear
+
+        The engine's own output goes to artifacts rather than the process log:
+        for every run when artifacts.keep is set, otherwise only for failed ones.
+        Raises a ResourceLimitError when the engine was stopped by limits.
+        """
         try:
             logger.debug(f"Running pdflatex on {tex_file.name}")
-            process = await asyncio.create_subprocess_exec(
-                "pdflatex",
-                "-interaction=nonstopmode",
-                "-file-line-error",
-                tex_file.name,
-                cwd=str(work_dir),
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+            monitor = TexOutputMonitor(progress, fail_fast)
+            command = [settings.LATEX_ENGINE, *self.ENGINE_FLAGS, *(extra_args or []), tex_file.name]
+            returncode, output, stopped = await stream_command(
+                limits.command(command) if limits is not None else command,
+                work_dir,
+                monitor.feed,
+                settings.LATEX_OUTPUT_MAX_SIZE,
+                env=env
             )
-
-            stdout, stderr = await process.communicate()
-            
-            # Log the raw output
-            logger.debug("pdflatex stdout:")
-            logger.debug(stdout.decode('utf-8', errors='replace'))
-            if stderr:
-                logger.debug("pdflatex stderr:")
-                logger.debug(stderr.decode('utf-8', errors='replace'))
+            logger.debug(f"pdflatex produced {output.total_bytes} bytes of output and shipped {monitor.pages} page(s)")
 
             # Parse the log file
             log_file = work_dir / f"{tex_file.stem}.log"
             log_content = await self._parse_latex_log(log_file)
-            
-            if process.returncode != 0:
+
+            if artifacts is not None and (stopped or returncode != 0 or artifacts.keep):
+                artifacts.add("pdflatex.out", output.text())
+                await artifacts.add_file("pdflatex.log", log_file)
+
+            limit = limits.exceeded(returncode) if limits is not None and not stopped else None
+            if limit is not None:
+                raise self._limit_error(limit, "pdflatex", log_content)
+
+            if stopped:
+                error = monitor.first_error
+                location = f"{error['file']}:{error['line']}: " if error['line'] else ""
+                logger.info(f"Stopped pdflatex at first error: {location}{error['message']}")
+                return False, f"Stopped at first error: {location}{error['message']}\n\n{log_content}"
+
+            if returncode != 0:
                 logger.error("pdflatex compilation failed")
-                logger.error(log_content)
                 return False, log_content
             
             return True, log_content
 
+        except ResourceLimitError:
+            raise
         except Exception as e:
             error_msg = f"Error running pdflatex: {str(e)}"
             logger.error(error_msg)
             return False, error_msg
 
-    async def compile(self, tex_content: str, project_id: str, timeout: Optional[int] = None) -> Path:
-        """Compile LaTeX content with images and return path to PDF"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        work_dir = Path(self.temp_dir) / f"compile_{timestamp}"
-        work_dir.mkdir(parents=True, exist_ok=True)
-
+    async def _build_format(
+        self,
+        source: Path,
+        job_name: str,
+        work_dir: Path,
+        env: Dict[str, str],
+        limits: Optional[JobLimits] = None
+    ) -> bool:
+        """Dump a format file with the preamble in source preloaded"""
+        base_format = Path(settings.LATEX_ENGINE).name
+        try:
+            return await self._run_tool(
+                [
+                    settings.LATEX_ENGINE,
+                    "-ini",
+                    "-interaction=nonstopmode",
+                    f"-jobname={job_name}",
+                    f"&{base_format}",
+                    source.name
+                ],
+                work_dir,
+                env,
+                limits=limits
+            )
+        except ResourceLimitError as e:
+            # The passes run into the same limit and report it; they just go without a format
+            logger.info(f"Dumping format {job_name} exceeded its {e.description} limit")
+            return False
+
+    async def _prepare_format(
+        self,
+        tex_content: str,
+        tex_file: Path,
+        work_dir: Path,
+        class_set: Optional[ClassSet],
+        env: Dict[str, str],
+        limits: Optional[JobLimits] = None
+    ) -> Optional[str]:
+        """Swap the preamble for a precompiled format and return its cache key, if one can be used"""
+        split = split_preamble(tex_content)
+        if split is None or not FormatCache.is_dumpable(split[0]):
+            return None
+
+        preamble, body = split
+        fmt_key = FormatCache.format_key(
+            preamble, work_dir, settings.LATEX_ENGINE, class_set.digest if class_set else ""
+        )
+
+        async def build(source: Path, job_name: str) -> bool:
+            return await self._build_format(source, job_name, work_dir, env, limits)
+
+        cached_fmt = await self.format_cache.get_or_build(fmt_key, preamble, work_dir, build)
+        if cached_fmt is None:
+            return None
+
+        fmt_name = FormatCache.format_name(fmt_key)
+        for stale_fmt in work_dir.glob("preamble_*.fmt"):
+            if stale_fmt.stem != fmt_name:
+                stale_fmt.unlink()
+        link_or_copy(cached_fmt, work_dir / f"{fmt_name}.fmt")
+        # Blank lines stand in for the preamble so diagnostics keep their line numbers
+        async with aiofiles.open(tex_file, 'w') as f:
+            await f.write("\n" * preamble.count("\n") + body)
+        logger.debug(f"Compiling against precompiled preamble format {fmt_name}")
+        return fmt_key
+
+    async def _run_tool(
+        self,
+        command: List[str],
+        work_dir: Path,
+        env: Optional[Dict[str, str]] = None,
+        artifacts: Optional[JobArtifacts] = None,
+        limits: Optional[JobLimits] = None
+    ) -> bool:
+        """Run an auxiliary tool such as bibtex or makeindex in the working directory
+
+        Its output goes to artifacts, not the process log. Raises a
+        ResourceLimitError when the tool was stopped by limits.
+        """
+        tool = Path(command[0]).name
+        try:
+            logger.debug(f"Running {' '.join(command)}")
+            returncode, stdout, stderr = await run_command(
+                limits.command(command) if limits is not None else command, work_dir, env
+            )
+            if artifacts is not None and (returncode != 0 or artifacts.keep):
+                artifacts.add(f"{tool}.out", stdout + stderr)
+            # The engine prints whatever the document tells it to, so only other tools' errors are trusted
+            errors = stderr.decode('utf-8', errors='replace') if command[0] != settings.LATEX_ENGINE else ""
+            limit = limits.exceeded(returncode, errors) if limits is not None else None
+            if limit is not None:
+                output = (stdout + stderr).decode('utf-8', errors='replace')
+                raise self._limit_error(limit, tool, output.strip()[-2000:])
+            if returncode != 0:
+                logger.warning(f"{command[0]} exited with code {returncode}")
+                return False
+            return True
+        except ResourceLimitError:
+            raise
+        except Exception as e:
+            logger.warning(f"Error running {command[0]}: {str(e)}")
+            return False
+
+    def _limit_error(self, limit: str, program: str, log_content: str) -> ResourceLimitError:
+        """Count a resource limit hit and build the error that reports it"""
+        self.resource_limiter.record(limit)
+        RESOURCE_LIMIT_HITS.inc(limit=limit)
+        error = RESOURCE_LIMIT_ERRORS[limit]
+        logger.warning(f"{program} exceeded its {error.description} limit")
+        return error(f"{program} exceeded its {error.description} limit", log_content)
+
+    def _remove_stale_inputs(self, work_dir: Path, inputs: List[Path]) -> None:
+        """Delete inputs of the previous compile in a warm directory that are no longer referenced"""
+        manifest = work_dir / self.INPUTS_MANIFEST
+        current = sorted({str(path.relative_to(work_dir)) for path in inputs})
+        if manifest.exists():
+            try:
+                previous = json.loads(manifest.read_text())
+            except ValueError:
+                previous = []
+            for rel_path in set(previous) - set(current):
+                (work_dir / rel_path).unlink(missing_ok=True)
+                logger.debug(f"Removed stale input {rel_path} from warm build directory")
+        manifest.write_text(json.dumps(current))
+
+    async def compile(
+        self,
+        tex_content: Optional[str],
+        project_id: str,
+        timeout: Optional[int] = None,
+        incremental: bool = False,
+        progress: Optional[ProgressCallback] = None,
+        fail_fast: bool = False,
+        files: Optional[Dict[str, str]] = None,
+        main_file: Optional[str] = None,
+        artifacts: Optional[JobArtifacts] = None,
+        mode: str = CompileMode.FINAL
+    ) -> CompilationResult:
+        """Compile LaTeX content with images and return the compilation result
+
+        With incremental set, the project's warm build directory is reused so
+        auxiliary files from the previous compile carry over. progress, when
+        given, is called as each phase of the compilation starts and as TeX
+        ships pages or reports errors. fail_fast stops at the first error.
+        files is a validated {path: sha256} manifest whose blobs are linked
+        into the build directory; the main document is read from main_file
+        when tex_content is None. Raw engine and tool output is collected in
+        artifacts. mode "preview" trades fidelity for latency: images become
+        placeholder boxes, a cold first pass runs in draft mode, passes are
+        capped at PREVIEW_MAX_PASSES and TeX halts at the first error.
+        """
+        project = (files or {}, main_file)
         logger.info(f"Starting LaTeX compilation for project {project_id}")
+        started = time.perf_counter()
+        outcome = "failure"
+
+        with span(
+            "compile", project_id=project_id, incremental=incremental, files=len(project[0]), mode=mode
+        ) as compile_span:
+            try:
+                with self.resource_limiter.job(mode) as limits:
+                    result = await self._compile(
+                        tex_content, project_id, incremental, progress, fail_fast, project, artifacts, mode, limits
+                    )
+                outcome = "cached" if result.cached else "success"
+                if compile_span is not None:
+                    compile_span.set(cached=result.cached, passes=result.passes)
+                return result
+            finally:
+                COMPILE_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+
+    async def _compile(
+        self,
+        tex_content: Optional[str],
+        project_id: str,
+        incremental: bool,
+        progress: Optional[ProgressCallback],
+        fail_fast: bool,
+        project: Tuple[Dict[str, str], Optional[str]],
+        artifacts: Optional[JobArtifacts],
+        mode: str,
+        limits: JobLimits
+    ) -> CompilationResult:
+        if incremental:
+            # Previews keep their own auxiliary files, so they never overwrite a final build's
+            build_key = project_id if mode == CompileMode.FINAL else f"{project_id}.{mode}"
+            async with self.build_dirs.acquire(build_key) as work_dir:
+                logger.debug(f"Working directory: {work_dir} (incremental)")
+                return await self._compile_in_dir(
+                    tex_content, project_id, work_dir, True, progress, fail_fast, project, artifacts, mode, limits
+                )
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        work_dir = Path(tempfile.mkdtemp(prefix=f"compile_{timestamp}_", dir=self.temp_dir))
         logger.debug(f"Working directory: {work_dir}")
 
+        try:
+            return await self._compile_in_dir(
+                tex_content, project_id, work_dir, False, progress, fail_fast, project, artifacts, mode, limits
+            )
+        finally:
+            # Clean up temporary directory
+            try:
+                shutil.rmtree(work_dir)
+                logger.debug(f"Cleaned up working directory: {work_dir}")
+            except Exception as e:
+                logger.warning(f"Error cleaning up working directory: {str(e)}")
+
+    async def _compile_in_dir(
+        self,
+        tex_content: str,
+        project_id: str,
+        work_dir: Path,
+        warm: bool,
+        progress: Optional[ProgressCallback],
+        fail_fast: bool = False,
+        project: Tuple[Dict[str, str], Optional[str]] = ({}, None),
+        artifacts: Optional[JobArtifacts] = None,
+        mode: str = CompileMode.FINAL,
+        limits: Optional[JobLimits] = None
+    ) -> CompilationResult:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        tex_file = work_dir / "document.tex"
+        scheduler = None
+
         try:
             # Prepare class files before compilation
-            await self._prepare_class_files(work_dir, project_id)
+            _report(progress, "class_prep")
+            with compile_phase("class_prep"):
+                class_set = await self._prepare_class_files(project_id)
+            env = self._engine_env(class_set)
+            inputs: List[Path] = []
+            known_digests: Dict[Path, str] = {}
+
+            files, main_file = project
+            if files:
+                _report(progress, "materialize", files=len(files))
+                missing = self.blob_store.missing(files.values())
+                if missing:
+                    raise MissingBlobsError(missing)
+                if tex_content is None:
+                    tex_content = self.blob_store.read_text(files[main_file])
+                # The main document is written as document.tex below, so it isn't linked
+                with compile_phase("materialize", files=len(files)):
+                    known_digests = self.blob_store.materialize(
+                        {path: digest for path, digest in files.items() if path != main_file},
+                        work_dir
+                    )
+                inputs.extend(known_digests)
+                logger.debug(f"Linked {len(known_digests)} project file(s) into {work_dir}")
 
             # Process images in the content
             logger.debug("Processing images in content")
-            tex_content = await self._process_images(tex_content, work_dir, project_id)
+            with compile_phase("image_processing"):
+                if mode == CompileMode.PREVIEW:
+                    tex_content, images = self._placeholder_images(tex_content), []
+                else:
+                    tex_content, images = await self._process_images(tex_content, work_dir, project_id, progress)
+            inputs.extend(images)
 
             # Write TEX content to file
-            tex_file = work_dir / "document.tex"
             async with aiofiles.open(tex_file, 'w') as f:
                 await f.write(tex_content)
             logger.debug(f"LaTeX content written to {tex_file}")
+            inputs.append(tex_file)
+
+            if warm:
+                self._remove_stale_inputs(work_dir, inputs)
+
+            output_path = Path(self.temp_dir) / f"output_{timestamp}_{uuid.uuid4().hex[:8]}.pdf"
+            cache_key = self._compute_cache_key(work_dir, inputs, class_set, known_digests, mode)
+            if self.compile_cache is not None:
+                cached_pdf = self.compile_cache.get(cache_key)
+                if cached_pdf is not None:
+                    shutil.copyfile(cached_pdf, output_path)
+                    logger.info(f"Compile cache hit for project {project_id} ({cache_key[:12]}), skipping pdflatex")
+                    _report(progress, "cache_hit", cache_key=cache_key)
+                    return CompilationResult(pdf_path=output_path, cache_key=cache_key, cached=True)
+
+            fmt_key = None
+            if self.format_cache is not None:
+                _report(progress, "format")
+                with compile_phase("format"):
+                    fmt_key = await self._prepare_format(tex_content, tex_file, work_dir, class_set, env, limits)
+
+            max_passes = self._max_passes(mode)
+            preview = mode == CompileMode.PREVIEW
+
+            async def run_pass(compilation_pass: int, draft: bool) -> None:
+                with span("pass", number=compilation_pass, draft=draft), \
+                        PDFLATEX_PASS_SECONDS.time(number=compilation_pass):
+                    await engine_pass(compilation_pass, draft)
+
+            async def engine_pass(compilation_pass: int, draft: bool) -> None:
+                nonlocal fmt_key
+                logger.debug(f"Starting compilation pass {compilation_pass}/{max_passes}{' (draft)' if draft else ''}")
+                _report(progress, "pass", number=compilation_pass, max_passes=max_passes, draft=draft)
+                log_file = work_dir / f"{tex_file.stem}.log"
+                # Previews stop at the first error; a draft pass only updates the auxiliary files
+                mode_args = (["-halt-on-error"] if preview else []) + (["-draftmode"] if draft else [])
+                if fmt_key is None:
+                    success, log_content = await self._run_pdflatex(
+                        tex_file, work_dir, mode_args, progress, fail_fast, env, artifacts, limits
+                    )
+                else:
+                    log_file.unlink(missing_ok=True)
+                    fmt_name = FormatCache.format_name(fmt_key)
+                    success, log_content = await self._run_pdflatex(
+                        tex_file, work_dir, [*mode_args, f"-fmt={fmt_name}"], progress, fail_fast, env, artifacts, limits
+                    )
+                    if not success:
+                        # A format that loads can still be stale or incompatible, so only the full source can tell
+                        loaded = log_file.exists()
+                        logger.warning(
+                            f"Pass with precompiled format {fmt_name} failed"
+                            f"{'' if loaded else ' to load'}, retrying with the full source"
+                        )
+                        stale_key, fmt_key = fmt_key, None
+                        async with aiofiles.open(tex_file, 'w') as f:
+                            await f.write(tex_content)
+                        success, log_content = await self._run_pdflatex(
+                            tex_file, work_dir, mode_args, progress, fail_fast, env, artifacts, limits
+                        )
+                        if success or not loaded:
+                            self.format_cache.invalidate(stale_key)
 
-            # Set TEXMFHOME environment variable
-            os.environ['TEXMFHOME'] = str(self.texmf_dir.parent)
-
-            # Run pdflatex with proper environment
-            for compilation_pass in range(2):
-                logger.debug(f"Starting compilation pass {compilation_pass + 1}/2")
-                
-                success, log_content = await self._run_pdflatex(tex_file, work_dir)
                 if not success:
                     raise LatexCompilationError(
                         "LaTeX compilation failed",
                         log_content
                     )
 
+            async def run_tool(command: List[str]) -> bool:
+                _report(progress, "tool", name=command[0])
+                with compile_phase(f"tool_{command[0]}"):
+                    return await self._run_tool(command, work_dir, env, artifacts, limits)
+
+            # bibtex/biber are only considered for documents that declare a bibliography
+            bibliography = bool(BIBLIOGRAPHY_COMMAND.search(tex_content)) or any(
+                path.endswith(".bib") for path in files
+            )
+
+            # Run pdflatex until cross-references converge
+            scheduler = PassScheduler(
+                work_dir,
+                tex_file.stem,
+                run_pass,
+                run_tool,
+                max_passes,
+                bibliography=bibliography,
+                bbl_cache=self.bib_cache,
+                # Only worth it when the first pass is certain to be rerun for its cross-references
+                draft=preview
+                and Path(settings.LATEX_ENGINE).name in DRAFT_MODE_ENGINES
+                and bool(CROSS_REFERENCE_COMMAND.search(tex_content))
+            )
+            passes = await scheduler.run()
+
             pdf_path = work_dir / "document.pdf"
             if not pdf_path.exists():
                 raise LatexCompilationError(
@@ -266,24 +833,28 @@ class LatexCompiler:
                     "No PDF output file found after compilation"
                 )
 
+            if self.compile_cache is not None:
+                self.compile_cache.put(cache_key, pdf_path)
+
             # Move to final location
-            output_path = Path(self.temp_dir) / f"output_{timestamp}.pdf"
             shutil.move(pdf_path, output_path)
-            logger.info(f"Compilation successful, PDF saved to {output_path}")
+            logger.info(f"Compilation successful after {passes} pass(es), PDF saved to {output_path}")
             
-            return output_path
+            return CompilationResult(
+                pdf_path=output_path,
+                cache_key=cache_key,
+                passes=passes,
+                tools=scheduler.tools_run,
+                tools_cached=scheduler.tools_cached
+            )
 
         except Exception as e:
             logger.error(f"Compilation error: {str(e)}")
+            if warm and scheduler is not None:
+                # Don't let a half-written .aux from a failed run poison the next compile
+                scheduler.reset()
             raise
-        finally:
-            # Clean up temporary directory
-            try:
-                shutil.rmtree(work_dir)
-                logger.debug(f"Cleaned up working directory: {work_dir}")
-            except Exception as e:
-                logger.warning(f"Error cleaning up working directory: {str(e)}")
-                
+
     @staticmethod
     async def cleanup_old_files(max_age_hours: int = 24):
         """Clean up old temporary files"""
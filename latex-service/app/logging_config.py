@@ -1,28 +1,86 @@
 # app/logging_config.py
+import json
+import queue
 import logging
+import logging.handlers
 import sys
 from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records unformatted so formatting happens on the listener thread"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DebugSampler(logging.Filter):
+    """Passes one in every rate DEBUG records from each call site, and every record above DEBUG"""
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._counts: Dict[Tuple[str, int], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate == 1 or record.levelno > logging.DEBUG:
+            return True
+        site = (record.pathname, record.lineno)
+        count = self._counts.get(site, 0)
+        self._counts[site] = count + 1
+        return count % self.rate == 0
+
+def setup_logging(level: str = "DEBUG", json_format: bool = False, debug_sample_rate: int = 1):
+    global _listener
 
-def setup_logging():
     # Create logs directory if it doesn't exist
     log_dir = Path("logs")
     log_dir.mkdir(exist_ok=True)
 
-    # Configure logging
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            # Console handler with DEBUG level
-            logging.StreamHandler(sys.stdout),
-            # File handler with ERROR level
-            logging.FileHandler(log_dir / "error.log"),
-        ]
+    formatter = JsonFormatter() if json_format else logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
+    # Console handler at the configured level
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(formatter)
+    # File handler with ERROR level
+    error_file = logging.FileHandler(log_dir / "error.log")
+    error_file.setLevel(logging.ERROR)
+    error_file.setFormatter(formatter)
+
+    # Callers only enqueue; a listener thread formats and writes
+    records: queue.Queue = queue.Queue(-1)
+    queue_handler = DeferredQueueHandler(records)
+    queue_handler.addFilter(DebugSampler(debug_sample_rate))
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(records, console, error_file, respect_handler_level=True)
+    _listener.start()
+
+    logging.basicConfig(level=level.upper(), handlers=[queue_handler], force=True)
 
     # Set uvicorn access logger level
     logging.getLogger("uvicorn.access").setLevel(logging.INFO)
-    
+
     # Create logger for our application
     logger = logging.getLogger("latex-service")
-    return logger
\ No newline at end of file
+    return logger
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
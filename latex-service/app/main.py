@@ -4,6 +4,7 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import traceback
+import asyncio
 import os
 from typing import Union
 import sys
@@ -11,11 +12,18 @@ import sys
 from app.config import settings
 from app.api.routes import router
 from app.storage import LocalStorageProvider, SupabaseStorageProvider
-from app.logging_config import setup_logging
+from app.latex_compiler import LatexCompiler
+from app.scheduler import CompileScheduler
+from app.jobs import JobManager
+from app.tracing import TraceExporter
+from app.logging_config import setup_logging, stop_logging
+from app.artifacts import ArtifactStore
+from app.pdf_delivery import PdfLinearizer
+from app.page_previews import PagePreviews
 from supabase import create_client
 
 # Setup logging
-logger = setup_logging()
+logger = setup_logging(settings.LOG_LEVEL, settings.LOG_FORMAT == "json", settings.LOG_DEBUG_SAMPLE_RATE)
 
 app = FastAPI(title="LaTeX Compilation Service")
 
@@ -59,14 +67,22 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             "detail": exc.detail,
             "type": "HTTPException",
             "path": request.url.path
-        }
+        },
+        headers=exc.headers
     )
 
 # Initialize storage provider with error handling
 try:
+    linearizer = PdfLinearizer(settings.QPDF_COMMAND) if settings.PDF_LINEARIZE else None
     if settings.IS_LOCAL:
         logger.info("Initializing local storage provider")
-        storage_provider = LocalStorageProvider(settings.LOCAL_STORAGE_DIR)
+        storage_provider = LocalStorageProvider(
+            settings.LOCAL_STORAGE_DIR,
+            settings.STORAGE_INDEX_PATH,
+            settings.STORAGE_IO_WORKERS,
+            settings.STORAGE_BATCH_CONCURRENCY,
+            linearizer=linearizer
+        )
         # Mount local storage directory for direct file access
         app.mount("/storage", StaticFiles(directory=settings.LOCAL_STORAGE_DIR), name="storage")
     else:
@@ -75,10 +91,41 @@ try:
             settings.SUPABASE_URL,
             settings.SUPABASE_KEY
         )
-        storage_provider = SupabaseStorageProvider(supabase, settings.PDF_BUCKET_NAME)
+        storage_provider = SupabaseStorageProvider(
+            supabase,
+            settings.PDF_BUCKET_NAME,
+            settings.STORAGE_IO_WORKERS,
+            settings.STORAGE_BATCH_CONCURRENCY,
+            settings.SIGNED_URL_CACHE_SIZE,
+            settings.SIGNED_URL_EXPIRY_MARGIN,
+            linearizer=linearizer
+        )
 
     # Add storage provider to app state
     app.state.storage_provider = storage_provider
+    # Shared compiler so caches survive across requests
+    app.state.latex_compiler = LatexCompiler(storage_provider, settings.TEMP_DIR)
+    app.state.compile_scheduler = CompileScheduler(
+        settings.COMPILE_CONCURRENCY,
+        settings.COMPILE_QUEUE_SIZE,
+        settings.MAX_COMPILATION_TIME
+    )
+    app.state.job_manager = JobManager(
+        app.state.latex_compiler,
+        app.state.compile_scheduler,
+        storage_provider,
+        settings.JOB_HISTORY_SIZE,
+        TraceExporter(settings.TRACE_FILE, settings.TRACE_FILE_MAX_SIZE),
+        ArtifactStore(settings.ARTIFACT_DIR, settings.ARTIFACT_MAX_SIZE, settings.ARTIFACT_MAX_JOBS),
+        PagePreviews(
+            settings.PREVIEW_CACHE_DIR,
+            settings.PREVIEW_CACHE_MAX_SIZE,
+            settings.PREVIEW_WORKERS,
+            settings.PREVIEW_MAX_DPI,
+            settings.PREVIEW_QUALITY
+        ),
+        coalesce=settings.COMPILE_COALESCING
+    )
 except Exception as e:
     logger.error(f"Failed to initialize storage provider: {str(e)}\n{''.join(traceback.format_tb(e.__traceback__))}")
     raise
@@ -101,11 +148,21 @@ async def startup_event():
     os.makedirs(settings.TEMP_DIR, exist_ok=True)
     logger.info("Required directories created/verified")
 
+    if settings.WARM_BUILDS_ENABLED:
+        app.state.build_dir_eviction = asyncio.create_task(app.state.latex_compiler.build_dirs.run_eviction())
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Shutdown event handler"""
     logger.info("Shutting down LaTeX Compilation Service")
-    # Add any cleanup code here if needed
+    if getattr(app.state, "build_dir_eviction", None) is not None:
+        app.state.build_dir_eviction.cancel()
+    await app.state.job_manager.shutdown()
+    await app.state.latex_compiler.image_cache.close()
+    app.state.latex_compiler.image_derivatives.close()
+    app.state.job_manager.previews.close()
+    app.state.storage_provider.close()
+    stop_logging()
 
 if __name__ == "__main__":
     import uvicorn
@@ -114,5 +171,5 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
-        log_level="debug"
+        log_level=settings.LOG_LEVEL.lower()
     )
\ No newline at end of file
@@ -0,0 +1,250 @@
+# app/metrics.py
+import math
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds; spans sub-millisecond storage calls up to the longest compiles
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    """A metric family in the Prometheus text format, with one child per label set"""
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **labels: str):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        if self.label_names:
+            raise ValueError(f"{self.name} has labels {self.label_names}; use labels()")
+        return self.labels()
+
+    def _samples(self) -> Iterator[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples())
+        return "\n".join(lines)
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        child = self.labels(**labels) if labels else self._default()
+        child.value += amount
+
+    def _samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, child in sorted(self._children.items()):
+            yield self.name, _format_labels(self.label_names, key), child.value
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        child = self.labels(**labels) if labels else self._default()
+        child.value = value
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float, **labels: str) -> None:
+        child = self.labels(**labels) if labels else self._default()
+        child.sum += value
+        child.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                child.counts[index] += 1
+                break
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of the block, whether it finishes or raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> Iterator[Tuple[str, str, float]]:
+        for key, child in sorted(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, child.counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.label_names, key, ("le", _format_value(bound))), cumulative
+            yield f"{self.name}_bucket", _format_labels(self.label_names, key, ("le", "+Inf")), child.count
+            yield f"{self.name}_sum", _format_labels(self.label_names, key), child.sum
+            yield f"{self.name}_count", _format_labels(self.label_names, key), child.count
+
+class Registry:
+    """Process-wide set of metrics rendered together in the Prometheus text format"""
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, extra: Iterable[Metric] = ()) -> str:
+        """Render every registered metric plus extra ones collected at scrape time"""
+        return "\n".join(metric.render() for metric in [*self._metrics, *extra]) + "\n"
+
+REGISTRY = Registry()
+
+COMPILE_SECONDS = REGISTRY.register(Histogram(
+    "latex_compile_seconds",
+    "Duration of LatexCompiler.compile by outcome (success, cached, failure)",
+    ["outcome"]
+))
+COMPILE_PHASE_SECONDS = REGISTRY.register(Histogram(
+    "latex_compile_phase_seconds",
+    "Duration of each phase of a compile",
+    ["phase"]
+))
+PDFLATEX_PASS_SECONDS = REGISTRY.register(Histogram(
+    "latex_pdflatex_pass_seconds",
+    "Duration of each TeX engine pass by pass number",
+    ["number"]
+))
+STORAGE_CALL_SECONDS = REGISTRY.register(Histogram(
+    "latex_storage_call_seconds",
+    "Duration of blocking storage backend calls",
+    ["provider", "operation"]
+))
+UPLOAD_SECONDS = REGISTRY.register(Histogram(
+    "latex_upload_seconds",
+    "Duration of receiving and storing an upload",
+    ["kind"]
+))
+RESOURCE_LIMIT_HITS = REGISTRY.register(Counter(
+    "latex_resource_limit_hits_total",
+    "Engine and tool processes stopped by a resource limit",
+    ["limit"]
+))
+UPLOAD_BYTES = REGISTRY.register(Counter(
+    "latex_upload_bytes_total",
+    "Bytes received in accepted uploads",
+    ["kind"]
+))
+
+def _cache_lookups(stats: Optional[Dict]) -> Optional[Tuple[int, int]]:
+    """(hits, misses) from a component's stats(), or None if it has no lookup counters"""
+    if not stats or "hits" not in stats:
+        return None
+    # The class file cache counts a miss as a tree build
+    return stats["hits"], stats["misses"] if "misses" in stats else stats.get("builds", 0)
+
+def runtime_metrics(state) -> List[Metric]:
+    """Gauges and counters read from the pipeline components on app.state at scrape time"""
+    compiler = state.latex_compiler
+    scheduler = state.compile_scheduler
+
+    in_flight = Gauge("latex_compiles_in_flight", "Compiles currently holding a scheduler slot")
+    in_flight.set(scheduler.running)
+    queue_depth = Gauge("latex_compile_queue_depth", "Compiles waiting for a scheduler slot")
+    queue_depth.set(scheduler.waiting)
+    rejected = Counter("latex_compile_rejected_total", "Compiles refused because the queue was full")
+    rejected.inc(scheduler.rejected)
+    timeouts = Counter("latex_compile_timeouts_total", "Compiles killed for exceeding their time limit")
+    timeouts.inc(scheduler.timeouts)
+    job_stats = state.job_manager.stats()
+    jobs = Gauge("latex_compile_jobs", "Tracked compile jobs by state", ["state"])
+    for job_state, count in job_stats["states"].items():
+        jobs.set(count, state=job_state)
+    coalesced = Counter(
+        "latex_compile_jobs_coalesced_total",
+        "Compile requests folded into a newer one: merged while queued or superseded while compiling",
+        ["outcome"]
+    )
+    coalesced.inc(job_stats["merged"], outcome="merged")
+    coalesced.inc(job_stats["superseded"], outcome="superseded")
+
+    storage_stats = state.storage_provider.stats() or {}
+    caches = [
+        ("compile", compiler.compile_cache.stats() if compiler.compile_cache else None),
+        ("format", compiler.format_cache.stats() if compiler.format_cache else None),
+        ("image", compiler.image_cache.stats()),
+        ("image_derivatives", compiler.image_derivatives.stats()),
+        ("class", compiler.class_cache.stats()),
+        ("bibliography", compiler.bib_cache.stats()),
+        ("blob", compiler.blob_store.stats()),
+        ("preview", state.job_manager.previews.stats() if state.job_manager.previews else None),
+        ("signed_url", storage_stats.get("signed_urls"))
+    ]
+    hits = Counter("latex_cache_hits_total", "Cache lookups served from the cache", ["cache"])
+    misses = Counter("latex_cache_misses_total", "Cache lookups that had to do the work", ["cache"])
+    ratio = Gauge("latex_cache_hit_ratio", "Share of cache lookups served from the cache", ["cache"])
+    size = Gauge("latex_cache_size_bytes", "Bytes held on disk by each cache", ["cache"])
+    for name, stats in caches:
+        if stats and "size_bytes" in stats:
+            size.set(stats["size_bytes"], cache=name)
+        lookups = _cache_lookups(stats)
+        if lookups is None:
+            continue
+        hit_count, miss_count = lookups
+        hits.inc(hit_count, cache=name)
+        misses.inc(miss_count, cache=name)
+        total = hit_count + miss_count
+        ratio.set(hit_count / total if total else 0.0, cache=name)
+
+    return [in_flight, queue_depth, rejected, timeouts, jobs, coalesced, hits, misses, ratio, size]
@@ -0,0 +1,240 @@
+# app/page_previews.py
+import re
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pypdfium2
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+from app.cache import DiskCache, file_digest
+
+logger = logging.getLogger("latex-service")
+
+# Preview format -> (Pillow format, URL extension, media type)
+PREVIEW_FORMATS = {
+    "png": ("PNG", ".png", "image/png"),
+    "webp": ("WEBP", ".webp", "image/webp"),
+}
+# Page attributes that change how a page renders, besides its content and resources
+PAGE_GEOMETRY = ("/MediaBox", "/CropBox", "/Rotate", "/UserUnit", "/Group")
+# Keys that point back up the page tree or don't change what a page looks like
+IGNORED_KEYS = {"/Parent", "/Annots", "/StructParents", "/Length", "/Metadata", "/PieceInfo", "/LastModified", "/Thumb"}
+# "ABCDEF+CMR10": the tag of a subset font changes whenever any page uses a new glyph
+SUBSET_TAG = re.compile(r'^[A-Z]{6}\+')
+MAX_OBJECT_DEPTH = 32
+
+def _inherited(page: DictionaryObject, key: str):
+    node = page
+    while node is not None:
+        if key in node:
+            return node.raw_get(key)
+        node = node.get("/Parent")
+    return None
+
+def _update(digest, obj, seen: Dict[Tuple[int, int], int], depth: int = 0) -> None:
+    """Feed a PDF object and everything it references into digest
+
+    Indirect objects are hashed by content rather than object number, which
+    shifts whenever another page changes. Fonts are hashed by name and
+    encoding only: their embedded programs are subsets of every glyph in
+    the document, so hashing them would invalidate every page at once.
+    """
+    if isinstance(obj, IndirectObject):
+        ref = (obj.idnum, obj.generation)
+        if ref in seen:
+            digest.update(f"@{seen[ref]}".encode())
+            return
+        seen[ref] = len(seen)
+        obj = obj.get_object()
+    if depth > MAX_OBJECT_DEPTH:
+        digest.update(b"...")
+        return
+
+    if isinstance(obj, DictionaryObject):
+        if obj.get("/Type") == "/Font":
+            digest.update(f"font:{obj.get('/Subtype')}:{SUBSET_TAG.sub('', str(obj.get('/BaseFont', '')))}".encode())
+            _update(digest, obj.raw_get("/Encoding") if "/Encoding" in obj else None, seen, depth + 1)
+            return
+        digest.update(b"<<")
+        for key in sorted(obj):
+            if key in IGNORED_KEYS:
+                continue
+            digest.update(key.encode())
+            _update(digest, obj.raw_get(key), seen, depth + 1)
+        digest.update(b">>")
+        if isinstance(obj, StreamObject):
+            digest.update(obj.get_data())
+    elif isinstance(obj, ArrayObject):
+        digest.update(b"[")
+        for item in obj:
+            _update(digest, item, seen, depth + 1)
+        digest.update(b"]")
+    else:
+        digest.update(repr(obj).encode())
+
+def hash_pages(pdf_path: str) -> List[str]:
+    """Hash every page's content streams, resources and geometry; runs in a worker process"""
+    hashes = []
+    for page in PdfReader(pdf_path).pages:
+        digest = hashlib.sha256()
+        seen: Dict[Tuple[int, int], int] = {}
+        for key in PAGE_GEOMETRY:
+            digest.update(key.encode())
+            _update(digest, _inherited(page, key), seen)
+        digest.update(b"/Contents")
+        _update(digest, page.raw_get("/Contents") if "/Contents" in page else None, seen)
+        digest.update(b"/Resources")
+        _update(digest, _inherited(page, "/Resources"), seen)
+        hashes.append(digest.hexdigest())
+    return hashes
+
+def render_pages(pdf_path: str, targets: List[Tuple[int, str]], dpi: int, image_format: str, quality: int) -> None:
+    """Rasterize pages, given as (zero-based index, target path), of one PDF; runs in a worker process"""
+    pil_format = PREVIEW_FORMATS[image_format][0]
+    options = {"quality": quality} if pil_format == "WEBP" else {}
+    pdf = pypdfium2.PdfDocument(pdf_path)
+    try:
+        for index, target in targets:
+            page = pdf[index]
+            try:
+                image = page.render(scale=dpi / 72).to_pil()
+            finally:
+                page.close()
+            image.save(target, pil_format, **options)
+    finally:
+        pdf.close()
+
+class PagePreviews:
+    """Page images of compiled PDFs, cached by page content and rendered in a process pool
+
+    Each page is keyed by a hash of its content streams and the resources
+    they draw, so after a recompile only the pages whose content changed
+    are rasterized again.
+    """
+    MAX_DOCUMENTS = 256  # Page hash lists kept per worker, by PDF digest
+
+    def __init__(self, cache_dir: str, max_bytes: int, workers: int, max_dpi: int, quality: int):
+        self.cache = DiskCache(cache_dir, max_bytes)
+        self.workers = workers
+        self.max_dpi = max_dpi
+        self.quality = quality
+        self.rendered = 0
+        self.failures = 0
+        self._tmp_dir = Path(cache_dir) / "tmp"
+        self._tmp_dir.mkdir(parents=True, exist_ok=True)
+        self._documents: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def render_key(self, page_hash: str, dpi: int, image_format: str) -> str:
+        return hashlib.sha256(f"{page_hash}\0{dpi}\0{image_format}\0{self.quality}".encode()).hexdigest()
+
+    async def page_hashes(self, pdf_path: Path, pdf_digest: Optional[str] = None) -> List[str]:
+        """Content hash of each page, parsed once per distinct PDF"""
+        loop = asyncio.get_running_loop()
+        if pdf_digest is None:
+            pdf_digest = await loop.run_in_executor(None, file_digest, pdf_path)
+        hashes = self._documents.get(pdf_digest)
+        if hashes is None:
+            hashes = await loop.run_in_executor(self._get_executor(), hash_pages, str(pdf_path))
+            self._documents[pdf_digest] = hashes
+            if len(self._documents) > self.MAX_DOCUMENTS:
+                self._documents.popitem(last=False)
+        else:
+            self._documents.move_to_end(pdf_digest)
+        return hashes
+
+    async def render(
+        self,
+        pdf_path: Path,
+        dpi: int,
+        image_format: str,
+        pdf_digest: Optional[str] = None
+    ) -> Optional[List[Dict]]:
+        """List a PDF's pages with their hashes and image URLs, rendering only pages not in the cache
+
+        Returns None when the PDF can't be read. A page whose render failed
+        is listed with a null url.
+        """
+        try:
+            hashes = await self.page_hashes(pdf_path, pdf_digest)
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Could not read pages of {pdf_path.name}: {str(e)}")
+            return None
+
+        extension = PREVIEW_FORMATS[image_format][1]
+        pages = []
+        missing: List[Tuple[int, str]] = []
+        for index, page_hash in enumerate(hashes):
+            key = self.render_key(page_hash, dpi, image_format)
+            if self.cache.get(key) is None:
+                missing.append((index, key))
+            pages.append({"page": index + 1, "hash": page_hash, "url": f"/previews/{key}{extension}"})
+
+        for index in await self._render_missing(pdf_path, missing, dpi, image_format):
+            pages[index]["url"] = None
+        logger.debug(f"Previews of {pdf_path.name}: {len(missing)} of {len(pages)} page(s) rendered")
+        return pages
+
+    async def _render_missing(
+        self,
+        pdf_path: Path,
+        missing: List[Tuple[int, str]],
+        dpi: int,
+        image_format: str
+    ) -> List[int]:
+        """Render pages across the pool and cache them, returning the indexes that failed"""
+        if not missing:
+            return []
+        # Interleave pages across workers so runs of heavy pages are shared out
+        batches = [missing[start::self.workers] for start in range(min(self.workers, len(missing)))]
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(
+                self._get_executor(),
+                render_pages,
+                str(pdf_path),
+                [(index, str(self._tmp_dir / key)) for index, key in batch],
+                dpi,
+                image_format,
+                self.quality
+            )
+            for batch in batches
+        ), return_exceptions=True)
+
+        failed = []
+        for batch, result in zip(batches, results):
+            for index, key in batch:
+                tmp_path = self._tmp_dir / key
+                if isinstance(result, BaseException) or not tmp_path.exists():
+                    tmp_path.unlink(missing_ok=True)
+                    failed.append(index)
+                    continue
+                self.cache.put(key, tmp_path, move=True)
+                self.rendered += 1
+            if isinstance(result, BaseException):
+                self.failures += 1
+                logger.warning(f"Could not render pages of {pdf_path.name}: {str(result)}")
+        return failed
+
+    def path(self, key: str) -> Optional[Path]:
+        return self.cache.get(key)
+
+    def stats(self) -> Dict:
+        return {**self.cache.stats(), "rendered": self.rendered, "failures": self.failures}
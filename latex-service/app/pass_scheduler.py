@@ -0,0 +1,257 @@
+# app/pass_scheduler.py
+import re
+import json
+import shutil
+import hashlib
+import logging
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.cache import DiskCache
+
+logger = logging.getLogger("latex-service")
+
+# Files written by one pass and read back by the next
+AUX_EXTENSIONS = [".aux", ".toc", ".lof", ".lot", ".out", ".nav", ".snm"]
+
+# .aux lines that every run writes regardless of document content
+AUX_BOILERPLATE = re.compile(
+    r'^(\\relax\s*$'
+    r'|\\gdef\s*\\@abspage@last\{\d+\}'
+    r'|\\providecommand'
+    r'|\\HyperFirstAtBeginDocument'
+    r'|\\global\\let\\old(contentsline|newlabel)'
+    r'|\\gdef\\(contentsline|newlabel)#'
+    r'|\\AtEndDocument\{\\ifx\\hyper@anchor'
+    r'|\\let\\(contentsline|newlabel)\\old'
+    r'|\\ifx\\hyper@anchor'
+    r'|\\fi\}?\s*$)'
+)
+AUX_INPUT = re.compile(r'^\\@input\{(.+?)\}')
+CITATION_LINE = re.compile(r'^\\(citation|bibdata|bibstyle)\{(.*)\}')
+BCF_DATASOURCE = re.compile(r'<bcf:datasource[^>]*>(.*?)</bcf:datasource>')
+# Commands that make a document need bibtex or biber
+BIBLIOGRAPHY_COMMAND = re.compile(r'\\(bibliography|addbibresource)\s*(\[[^\]]*\])?\s*\{')
+RERUN_HINT = re.compile(r'Rerun to get|Please rerun LaTeX|Rerun LaTeX|Label\(s\) may have changed')
+
+class PassScheduler:
+    """Runs TeX passes until the auxiliary outputs converge
+
+    bibtex, biber and makeindex run between passes only when their inputs
+    changed since they last ran in this build directory. With a bbl_cache,
+    the .bbl of a citation set and its databases is reused by any build
+    directory, so a cold compile of unchanged references runs no tool.
+    With draft set, a first pass that is bound to be rerun because the build
+    has no auxiliary files yet runs without writing a PDF.
+    """
+    TOOL_STATE_FILE = ".tool_inputs.json"
+    # Tools whose only output is the .bbl, which makes them cacheable
+    BBL_TOOLS = ("bibtex", "biber")
+
+    def __init__(
+        self,
+        work_dir: Path,
+        stem: str,
+        run_pass: Callable[[int, bool], Awaitable[None]],
+        run_tool: Callable[[List[str]], Awaitable[bool]],
+        max_passes: int,
+        bibliography: bool = True,
+        bbl_cache: Optional[DiskCache] = None,
+        draft: bool = False
+    ):
+        self.work_dir = work_dir
+        self.stem = stem
+        self.run_pass = run_pass
+        self.run_tool = run_tool
+        self.max_passes = max_passes
+        self.bibliography = bibliography
+        self.bbl_cache = bbl_cache
+        self.draft = draft
+        self.passes = 0
+        self.tools_run: List[str] = []
+        self.tools_cached: List[str] = []
+        self._state_path = work_dir / self.TOOL_STATE_FILE
+        self._tool_state = self._load_tool_state()
+
+    def _load_tool_state(self) -> Dict[str, str]:
+        try:
+            return json.loads(self._state_path.read_text())
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _significant_aux(self, path: Path) -> bytes:
+        """Return the .aux content with run-invariant boilerplate removed"""
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            lines = [line for line in f if not AUX_BOILERPLATE.match(line)]
+        return ''.join(lines).encode()
+
+    def snapshot(self) -> Dict[str, str]:
+        """Digest the non-empty auxiliary files that feed back into the next pass"""
+        snapshot = {}
+        for path in self._aux_files():
+            content = self._significant_aux(path) if path.suffix == ".aux" else path.read_bytes()
+            if content.strip():
+                snapshot[path.name] = hashlib.sha256(content).hexdigest()
+        return snapshot
+
+    def _aux_files(self) -> List[Path]:
+        files = [self.work_dir / f"{self.stem}{ext}" for ext in AUX_EXTENSIONS]
+        files.extend(self._nested_aux_files())
+        return [path for path in files if path.exists()]
+
+    def _nested_aux_files(self) -> List[Path]:
+        """Follow \\@input references to the .aux files of \\include'd chapters"""
+        nested = []
+        pending = [self.work_dir / f"{self.stem}.aux"]
+        while pending:
+            path = pending.pop()
+            if not path.exists():
+                continue
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    match = AUX_INPUT.match(line)
+                    if match:
+                        child = self.work_dir / match.group(1)
+                        if child not in nested:
+                            nested.append(child)
+                            pending.append(child)
+        return nested
+
+    def _needs_rerun(self) -> bool:
+        """Check the log for packages asking for another pass"""
+        log_path = self.work_dir / f"{self.stem}.log"
+        if not log_path.exists():
+            return False
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+            return any(RERUN_HINT.search(line) for line in f)
+
+    def _bibtex_inputs(self) -> Optional[str]:
+        """Digest of the citation set and bibliography databases, or None when bibtex isn't needed"""
+        if not self.bibliography:
+            return None
+        citations = []
+        for path in [self.work_dir / f"{self.stem}.aux", *self._nested_aux_files()]:
+            if not path.exists():
+                continue
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                citations.extend(line.strip() for line in f if CITATION_LINE.match(line))
+
+        databases = [
+            entry.strip()
+            for line in citations if line.startswith('\\bibdata')
+            for entry in CITATION_LINE.match(line).group(2).split(',')
+        ]
+        if not databases:
+            return None
+
+        digest = hashlib.sha256('\n'.join(citations).encode())
+        for name in databases:
+            bib_path = self.work_dir / (name if name.endswith('.bib') else f"{name}.bib")
+            if bib_path.exists():
+                digest.update(bib_path.read_bytes())
+        return digest.hexdigest()
+
+    def _biber_inputs(self) -> Optional[str]:
+        """Digest of biblatex's control file and its data sources, or None when biber isn't needed"""
+        bcf_path = self.work_dir / f"{self.stem}.bcf"
+        if not self.bibliography or not bcf_path.exists():
+            return None
+        # The control file lists the cited keys and every option that affects the .bbl
+        content = bcf_path.read_bytes()
+        digest = hashlib.sha256(content)
+        for name in BCF_DATASOURCE.findall(content.decode('utf-8', errors='replace')):
+            source = self.work_dir / name
+            if source.is_file():
+                digest.update(b"\0" + name.encode() + b"\0" + source.read_bytes())
+        return digest.hexdigest()
+
+    def _restore_bbl(self, name: str, digest: str) -> bool:
+        """Copy the cached .bbl for these inputs into place, if there is one"""
+        if self.bbl_cache is None or name not in self.BBL_TOOLS:
+            return False
+        cached = self.bbl_cache.get(self._bbl_key(name, digest))
+        if cached is None:
+            return False
+        # Copied rather than linked since the tool may rewrite it in place later
+        shutil.copyfile(cached, self.work_dir / f"{self.stem}.bbl")
+        return True
+
+    def _store_bbl(self, name: str, digest: str) -> None:
+        bbl_path = self.work_dir / f"{self.stem}.bbl"
+        if self.bbl_cache is not None and name in self.BBL_TOOLS and bbl_path.exists():
+            self.bbl_cache.put(self._bbl_key(name, digest), bbl_path)
+
+    @staticmethod
+    def _bbl_key(name: str, digest: str) -> str:
+        return hashlib.sha256(f"{name}\0{digest}".encode()).hexdigest()
+
+    def _makeindex_inputs(self) -> Optional[str]:
+        idx_path = self.work_dir / f"{self.stem}.idx"
+        if not idx_path.exists():
+            return None
+        return hashlib.sha256(idx_path.read_bytes()).hexdigest()
+
+    async def _run_tools(self) -> bool:
+        """Run the auxiliary tools whose inputs changed and report whether any ran"""
+        ran = False
+        tools = [
+            ("biber", self._biber_inputs, ["biber", self.stem]),
+            ("bibtex", self._bibtex_inputs, ["bibtex", self.stem]),
+            ("makeindex", self._makeindex_inputs, ["makeindex", f"{self.stem}.idx"]),
+        ]
+        for name, inputs, command in tools:
+            digest = inputs()
+            if digest is None or self._tool_state.get(name) == digest:
+                continue
+
+            if self._restore_bbl(name, digest):
+                logger.debug(f"Inputs of {name} changed, reusing the cached .bbl for them")
+                self._tool_state[name] = digest
+                self.tools_cached.append(name)
+                ran = True
+                continue
+
+            logger.debug(f"Inputs of {name} changed, running it")
+            if await self.run_tool(command):
+                self._tool_state[name] = digest
+                self._store_bbl(name, digest)
+            else:
+                # Retry on the next compile instead of trusting partial output
+                self._tool_state.pop(name, None)
+            self.tools_run.append(name)
+            ran = True
+
+        if ran:
+            self._state_path.write_text(json.dumps(self._tool_state))
+        return ran
+
+    async def run(self) -> int:
+        """Run passes until convergence or the pass limit and return the number of passes"""
+        while self.passes < self.max_passes:
+            before = self.snapshot()
+            draft = self.draft and self.passes == 0 and not before and self.max_passes > 1
+            self.passes += 1
+            await self.run_pass(self.passes, draft)
+
+            ran_tools = await self._run_tools()
+            after = self.snapshot()
+            if not ran_tools and after == before and not self._needs_rerun():
+                if draft:
+                    # Nothing fed back after all, but the draft pass wrote no PDF
+                    logger.debug("Auxiliary files unchanged by the draft pass, running the final pass")
+                    continue
+                logger.debug(f"Auxiliary files converged after {self.passes} pass(es)")
+                return self.passes
+
+            if after != before:
+                changed = sorted(set(after.items()) ^ set(before.items()))
+                logger.debug(f"Auxiliary files changed in pass {self.passes}: {sorted({name for name, _ in changed})}")
+
+        logger.warning(f"Auxiliary files did not converge within {self.max_passes} passes")
+        return self.passes
+
+    def reset(self) -> None:
+        """Remove auxiliary state so a failed run cannot poison the next compile"""
+        for path in self._aux_files():
+            path.unlink(missing_ok=True)
+        self._state_path.unlink(missing_ok=True)
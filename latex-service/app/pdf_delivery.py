@@ -0,0 +1,159 @@
+# app/pdf_delivery.py
+import os
+import re
+import shutil
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import aiofiles
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+from app.metrics import COMPILE_PHASE_SECONDS
+from app.process import run_command
+from app.tracing import span
+
+logger = logging.getLogger("latex-service")
+
+READ_CHUNK_SIZE = 256 * 1024
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def pdf_url(project_id: str, filename: str) -> str:
+    """URL of the delivery endpoint for a compiled PDF"""
+    return f"/pdf/{project_id}/{filename}"
+
+def file_etag(path: Path) -> str:
+    """Strong ETag from the SHA-256 of a file's content; blocking"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return f'"{digest.hexdigest()}"'
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """First and last byte of a single "bytes=" range, or None to send the whole file
+
+    Multiple ranges and malformed headers are answered with the whole file,
+    which RFC 9110 allows; a range starting past the end raises
+    RangeNotSatisfiable.
+    """
+    match = BYTE_RANGE.match(header.strip())
+    if not match or match.group(0) == "bytes=-":
+        return None
+    start, end = match.groups()
+    if not start:
+        # Suffix range: the last n bytes
+        length = int(end)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    first = int(start)
+    last = min(int(end), size - 1) if end else size - 1
+    if first >= size or first > last:
+        raise RangeNotSatisfiable()
+    return first, last
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as If-None-Match requires
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+async def _read_range(path: Path, first: int, length: int) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, 'rb') as f:
+        await f.seek(first)
+        while length > 0:
+            chunk = await f.read(min(READ_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+def pdf_response(request: Request, path: Path, size: int, etag: str, filename: str) -> Response:
+    """Serve a stored PDF with its ETag, answering conditional and byte-range requests"""
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # The same URL changes with every compile, so clients revalidate before reusing it
+        "Cache-Control": "no-cache",
+        "Content-Disposition": f'inline; filename="{filename}"'
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    # A range is only valid against the version the client already holds part of
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    status_code = 200
+    first, last = byte_range or (0, size - 1)
+    if byte_range is not None:
+        status_code = 206
+        headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    length = last - first + 1
+    headers["Content-Length"] = str(length)
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type="application/pdf")
+    return StreamingResponse(
+        _read_range(path, first, length),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/pdf"
+    )
+
+class PdfLinearizer:
+    """Rewrites compiled PDFs with qpdf --linearize ("fast web view")
+
+    A linearized PDF starts with the objects of its first page and a hint
+    table, so a viewer fetching byte ranges can render page one before the
+    rest of the file has arrived.
+    """
+    TIMEOUT = 120  # Seconds
+
+    def __init__(self, command: str = "qpdf"):
+        self.qpdf = shutil.which(command)
+        if self.qpdf is None:
+            logger.warning(f"PDF linearization is enabled but {command} was not found, PDFs are stored as compiled")
+        self.linearized = 0
+        self.failed = 0
+
+    async def linearize(self, pdf_path: Path) -> bool:
+        """Linearize pdf_path in place, leaving it as it was if qpdf fails"""
+        if self.qpdf is None:
+            return False
+        output = pdf_path.with_name(f"{pdf_path.name}.linearized")
+        with span("linearize"), COMPILE_PHASE_SECONDS.time(phase="linearize"):
+            try:
+                returncode, _, stderr = await run_command(
+                    [self.qpdf, "--linearize", str(pdf_path), str(output)],
+                    pdf_path.parent,
+                    timeout=self.TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                returncode, stderr = None, b"timed out"
+            # qpdf exits with 3 when it wrote the file but had warnings
+            if returncode in (0, 3) and output.exists():
+                os.replace(output, pdf_path)
+                self.linearized += 1
+                return True
+        output.unlink(missing_ok=True)
+        self.failed += 1
+        logger.warning(f"Could not linearize {pdf_path.name}: {stderr.decode('utf-8', errors='replace').strip()}")
+        return False
+
+    def stats(self) -> Dict:
+        return {"enabled": self.qpdf is not None, "linearized": self.linearized, "failed": self.failed}
@@ -0,0 +1,127 @@
+# app/process.py
+import os
+import signal
+import asyncio
+import logging
+from pathlib import Path
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("latex-service")
+
+READ_CHUNK_SIZE = 65536
+
+def kill_process_group(process: asyncio.subprocess.Process) -> None:
+    """Kill a subprocess started in its own session together with everything it spawned"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+async def run_command(
+    args: List[str],
+    cwd: Path,
+    env: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None
+) -> Tuple[int, bytes, bytes]:
+    """Run a command in its own process group and return (returncode, stdout, stderr)
+
+    On timeout or cancellation the whole process group is killed and reaped
+    before the exception propagates.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        cwd=str(cwd),
+        env=env,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        logger.warning(f"Killing process group of {args[0]} (pid {process.pid})")
+        kill_process_group(process)
+        await process.wait()
+        raise
+    return process.returncode, stdout, stderr
+
+class OutputTail:
+    """Keeps the most recent lines of a process's output within a byte budget"""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.total_bytes = 0
+        self.truncated = False
+        self._lines: Deque[str] = deque()
+
+    def append(self, line: str) -> None:
+        self.total_bytes += len(line)
+        self._lines.append(line)
+        self.size += len(line)
+        while self.size > self.max_bytes and len(self._lines) > 1:
+            self.size -= len(self._lines.popleft())
+            self.truncated = True
+
+    def text(self) -> str:
+        prefix = "[... earlier output truncated ...]\n" if self.truncated else ""
+        return prefix + "\n".join(self._lines)
+
+async def stream_command(
+    args: List[str],
+    cwd: Path,
+    on_line: Callable[[str], bool],
+    max_output_bytes: int,
+    env: Optional[Dict[str, str]] = None
+) -> Tuple[int, OutputTail, bool]:
+    """Run a command and hand each line of its combined output to on_line as it arrives
+
+    Only the last max_output_bytes of output are kept. When on_line returns
+    True the process group is killed and the result reports an early stop.
+    Returns (returncode, output tail, stopped_early).
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        cwd=str(cwd),
+        env=env,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True
+    )
+    tail = OutputTail(max_output_bytes)
+    stopped = False
+    pending = b""
+    try:
+        while not stopped:
+            chunk = await process.stdout.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            # Bound a single unterminated line so it can't grow without limit
+            if len(pending) > max_output_bytes:
+                lines.append(pending)
+                pending = b""
+            for raw_line in lines:
+                line = raw_line.decode('utf-8', errors='replace').rstrip("\r")
+                tail.append(line)
+                if on_line(line):
+                    stopped = True
+                    break
+
+        if pending and not stopped:
+            line = pending.decode('utf-8', errors='replace')
+            tail.append(line)
+            on_line(line)
+
+        if stopped:
+            logger.debug(f"Stopping {args[0]} early (pid {process.pid})")
+            kill_process_group(process)
+        await process.wait()
+    except BaseException:
+        # Cancellation, or a failure in on_line or while reading; don't leave the engine running unowned
+        logger.warning(f"Killing process group of {args[0]} (pid {process.pid})")
+        kill_process_group(process)
+        await process.wait()
+        raise
+    return process.returncode, tail, stopped
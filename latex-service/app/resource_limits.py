@@ -0,0 +1,195 @@
+# app/resource_limits.py
+import os
+import re
+import shutil
+import signal
+import logging
+import resource
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger("latex-service")
+
+# Moves the shell into the cgroup named by $0 ("0" means the writing process), then execs the command
+CGROUP_EXEC = 'echo 0 > "$0" && exec "$@"'
+# Seconds between the SIGXCPU of the soft CPU limit and the SIGKILL of the hard one
+CPU_GRACE_SECONDS = 1
+
+class Limit:
+    CPU_TIME = "cpu_time"
+    MEMORY = "memory"
+    OPEN_FILES = "open_files"
+    OUTPUT_SIZE = "output_size"
+
+# strerror() of ENOMEM, EMFILE and EFBIG ending a line of a tool's stderr, e.g. "makeindex: x.idx: Too many open files"
+ERRNO_LIMITS = [
+    (re.compile(r': Cannot allocate memory$', re.MULTILINE), Limit.MEMORY),
+    (re.compile(r': Too many open files$', re.MULTILINE), Limit.OPEN_FILES),
+    (re.compile(r': File too large$', re.MULTILINE), Limit.OUTPUT_SIZE),
+]
+
+@dataclass(frozen=True)
+class ResourceLimits:
+    """Budget of each engine and tool process a compile starts; 0 leaves a resource unlimited"""
+    cpu_seconds: int = 0
+    memory_bytes: int = 0
+    open_files: int = 0
+    output_bytes: int = 0
+
+    def prlimit_args(self) -> List[str]:
+        """prlimit(1) options, never above the service's own hard limits"""
+        wanted = [
+            ("cpu", resource.RLIMIT_CPU, self.cpu_seconds, CPU_GRACE_SECONDS),
+            ("as", resource.RLIMIT_AS, self.memory_bytes, 0),
+            ("nofile", resource.RLIMIT_NOFILE, self.open_files, 0),
+            ("fsize", resource.RLIMIT_FSIZE, self.output_bytes, 0),
+        ]
+        args = []
+        for option, kind, value, grace in wanted:
+            if not value:
+                continue
+            _, ceiling = resource.getrlimit(kind)
+            if ceiling != resource.RLIM_INFINITY:
+                value = min(value, ceiling)
+                grace = min(grace, ceiling - value)
+            args.append(f"--{option}={value}:{value + grace}")
+        return args
+
+class JobLimits:
+    """The limits of one compile: rlimits on each process, and a cgroup shared by all of them if there is one
+
+    Limits are applied by the programs a command is wrapped in, so no
+    Python code runs in the child between fork and exec.
+    """
+    def __init__(self, limits: ResourceLimits, prlimit: Optional[str] = None, cgroup: Optional[Path] = None):
+        self.limits = limits
+        self.cgroup = cgroup
+        self._prefix: List[str] = []
+        if cgroup is not None:
+            self._prefix += ["sh", "-c", CGROUP_EXEC, str(cgroup / "cgroup.procs")]
+        prlimit_args = limits.prlimit_args()
+        if prlimit is not None and prlimit_args:
+            self._prefix += [prlimit, *prlimit_args, "--"]
+        self._oom_kills = 0
+
+    def command(self, args: List[str]) -> List[str]:
+        """args wrapped to run inside the job's cgroup and under its rlimits"""
+        return [*self._prefix, *args]
+
+    def _oom_killed(self) -> bool:
+        if self.cgroup is None:
+            return False
+        try:
+            events = dict(line.split() for line in (self.cgroup / "memory.events").read_text().splitlines())
+        except (OSError, ValueError):
+            return False
+        kills = int(events.get("oom_kill", 0))
+        killed, self._oom_kills = kills > self._oom_kills, kills
+        return killed
+
+    def exceeded(self, returncode: Optional[int], errors: str = "") -> Optional[str]:
+        """The limit that ended a process exiting with returncode, if any
+
+        Only the kernel's verdicts count: the CPU and file size signals, and
+        OOM kills in the job's cgroup. errors is the stderr of a tool that
+        doesn't echo document content, checked for the strerror() text of
+        failed allocations, opens and writes. The engine's output is never
+        passed here, since a document can print anything.
+        """
+        if not returncode:
+            return None
+        if returncode == -signal.SIGXCPU:
+            return Limit.CPU_TIME
+        if returncode == -signal.SIGXFSZ:
+            return Limit.OUTPUT_SIZE
+        if returncode == -signal.SIGKILL and self._oom_killed():
+            return Limit.MEMORY
+        for pattern, limit in ERRNO_LIMITS:
+            if pattern.search(errors):
+                return limit
+        return None
+
+class ResourceLimiter:
+    """Per-mode resource budgets for compiles
+
+    Every engine and tool process runs under rlimits for CPU seconds,
+    address space, open files and file size. When cgroup_root names a
+    cgroup v2 directory delegated to the service, each compile also gets a
+    child group whose memory.max caps all of its processes together, and
+    whose OOM kills are reported as memory limit hits.
+    """
+    def __init__(self, budgets: Dict[str, ResourceLimits], cgroup_root: str = ""):
+        self.budgets = budgets
+        self.prlimit = shutil.which("prlimit")
+        if self.prlimit is None:
+            logger.warning("prlimit was not found, compile processes run without rlimits")
+        self.cgroup_root = self._prepare_cgroups(Path(cgroup_root)) if cgroup_root else None
+        self.hits: Dict[str, int] = {}
+        self._seq = 0
+
+    @staticmethod
+    def _prepare_cgroups(root: Path) -> Optional[Path]:
+        try:
+            if "memory" not in (root / "cgroup.controllers").read_text().split():
+                raise OSError("the memory controller is not available")
+            if "memory" not in (root / "cgroup.subtree_control").read_text().split():
+                (root / "cgroup.subtree_control").write_text("+memory")
+        except OSError as e:
+            logger.warning(f"Not using cgroups under {root} ({str(e)}), compiles are limited by rlimits only")
+            return None
+        logger.info(f"Compiles run in per-job cgroups under {root}")
+        return root
+
+    @contextmanager
+    def job(self, mode: str) -> Iterator[JobLimits]:
+        """Limits for one compile in mode, inside a fresh cgroup that is removed afterwards"""
+        limits = self.budgets.get(mode, ResourceLimits())
+        cgroup = self._create_cgroup(limits)
+        try:
+            yield JobLimits(limits, self.prlimit, cgroup)
+        finally:
+            if cgroup is not None:
+                self._remove_cgroup(cgroup)
+
+    def _create_cgroup(self, limits: ResourceLimits) -> Optional[Path]:
+        if self.cgroup_root is None or not limits.memory_bytes:
+            return None
+        self._seq += 1
+        cgroup = self.cgroup_root / f"compile-{os.getpid()}-{self._seq}"
+        try:
+            cgroup.mkdir()
+            (cgroup / "memory.max").write_text(str(limits.memory_bytes))
+            swap = cgroup / "memory.swap.max"
+            if swap.exists():
+                swap.write_text("0")
+        except OSError as e:
+            logger.warning(f"Could not create cgroup {cgroup.name}: {str(e)}")
+            self._remove_cgroup(cgroup)
+            return None
+        return cgroup
+
+    @staticmethod
+    def _remove_cgroup(cgroup: Path) -> None:
+        try:
+            # Every process has been reaped by now; this only catches strays
+            kill = cgroup / "cgroup.kill"
+            if kill.exists():
+                kill.write_text("1")
+            cgroup.rmdir()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove cgroup {cgroup.name}: {str(e)}")
+
+    def record(self, limit: str) -> None:
+        self.hits[limit] = self.hits.get(limit, 0) + 1
+
+    def stats(self) -> Dict:
+        return {
+            "rlimits": self.prlimit is not None,
+            "cgroups": self.cgroup_root is not None,
+            "budgets": {mode: asdict(limits) for mode, limits in self.budgets.items()},
+            "hits": dict(self.hits)
+        }
@@ -0,0 +1,129 @@
+# app/scheduler.py
+import math
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from app.tracing import span
+
+logger = logging.getLogger("latex-service")
+
+T = TypeVar("T")
+
+class QueueFullError(Exception):
+    """Raised when no compile slot is free and the wait queue is full"""
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__(f"Compile queue is full, retry after {retry_after}s")
+
+class CompilationTimeoutError(Exception):
+    """Raised when a compile exceeds its wall-clock budget"""
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        super().__init__(f"Compilation exceeded {timeout:g} seconds")
+
+class QueueReservation:
+    """A place in the wait queue, held from admission until the compile gets a slot or gives up"""
+    def __init__(self, scheduler: "CompileScheduler"):
+        self.scheduler = scheduler
+        self.active = True
+
+    def release(self) -> None:
+        if self.active:
+            self.active = False
+            self.scheduler.waiting -= 1
+
+class CompileScheduler:
+    """Bounded compile worker pool with admission control and wall-clock timeouts"""
+    def __init__(self, concurrency: int, max_queue: int, timeout: float):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._total_wait = 0.0
+        # Moving average of compile duration, used to estimate Retry-After
+        self._avg_duration = 1.0
+
+    def _retry_after(self) -> int:
+        backlog = (self.waiting + 1) / self.concurrency
+        return max(1, math.ceil(backlog * self._avg_duration))
+
+    def check_admission(self) -> None:
+        """Raise QueueFullError when no slot is free and the wait queue is full"""
+        # Reservations count as waiting even before their compile reaches the semaphore
+        if self.running + self.waiting >= self.concurrency + self.max_queue:
+            self.rejected += 1
+            retry_after = self._retry_after()
+            logger.warning(f"Rejecting compile: {self.running} running, {self.waiting} queued (retry after {retry_after}s)")
+            raise QueueFullError(retry_after)
+
+    def reserve(self) -> QueueReservation:
+        """Admit a compile and hold its place in the wait queue, raising QueueFullError if it is full
+
+        Checking and reserving in one synchronous step means a burst of
+        submissions can't all pass admission before any of them is queued.
+        """
+        self.check_admission()
+        self.waiting += 1
+        return QueueReservation(self)
+
+    async def run(
+        self,
+        compile_fn: Callable[[], Awaitable[T]],
+        reservation: Optional[QueueReservation] = None
+    ) -> Tuple[T, Dict]:
+        """Run compile_fn once a slot is free and return its result with queue info
+
+        Without a reservation from reserve(), one is taken here.
+        """
+        if reservation is None:
+            reservation = self.reserve()
+
+        queue_depth = self.waiting - 1
+        enqueued_at = time.monotonic()
+        try:
+            with span("queue", depth=queue_depth):
+                await self._semaphore.acquire()
+        finally:
+            reservation.release()
+
+        wait_time = time.monotonic() - enqueued_at
+        self._total_wait += wait_time
+        self.running += 1
+        started_at = time.monotonic()
+        try:
+            result = await asyncio.wait_for(compile_fn(), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.error(f"Compilation exceeded {self.timeout}s and was killed")
+            raise CompilationTimeoutError(self.timeout)
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            self.completed += 1
+            duration = time.monotonic() - started_at
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+        return result, {
+            "queue_depth": queue_depth,
+            "wait_ms": round(wait_time * 1000, 1)
+        }
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "queue_depth": self.waiting,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "avg_wait_ms": round(self._total_wait / self.completed * 1000, 1) if self.completed else 0.0,
+            "avg_duration_ms": round(self._avg_duration * 1000, 1)
+        }
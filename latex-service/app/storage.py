@@ -1,25 +1,78 @@
 import os
+import sys
+import time
 import shutil
+import functools
 from pathlib import Path
+import asyncio
 import aiofiles
-from typing import List, Tuple, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Iterable, List, Tuple, Dict, Optional, TypeVar
 from datetime import datetime
-from fastapi import UploadFile
 from abc import ABC, abstractmethod
 from supabase import Client
 import logging
 
+from app.uploads import SpooledUpload
+from app.storage_index import StorageIndex
+from app.url_cache import SignedUrlCache
+from app.metrics import STORAGE_CALL_SECONDS
+from app.tracing import span
+from app.pdf_delivery import PdfLinearizer, file_etag
+
 logger = logging.getLogger("latex-service")
 
+# Files TeX looks up by name rather than by path, served to compiles from a TEXMF tree
+CLASS_FILE_EXTENSIONS = (".cls", ".sty", ".bst")
+
+T = TypeVar("T")
+
+async def gather_limited(aws: Iterable[Awaitable[T]], limit: int) -> List[T]:
+    """Await all of aws with at most limit running at once, returning results in order"""
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws))
+
 class StorageProvider(ABC):
+    """Base class for storage backends
+
+    Blocking work (filesystem calls, SQLite, the synchronous Supabase client)
+    runs on a bounded thread pool owned by the provider so it never stalls
+    the event loop, and batch operations run at most batch_concurrency
+    requests at a time.
+    """
+    # Label for the provider's metrics
+    NAME = "storage"
+
+    def __init__(self, io_workers: int = 16, batch_concurrency: int = 8, linearizer: Optional[PdfLinearizer] = None):
+        self.batch_concurrency = batch_concurrency
+        self.linearizer = linearizer
+        self._executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="storage-io")
+
+    async def _run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run a blocking call on the provider's thread pool, timing it by provider and operation"""
+        operation = func.__name__.lstrip("_")
+        timer = STORAGE_CALL_SECONDS.time(provider=self.NAME, operation=operation)
+        with span(f"storage.{operation}", provider=self.NAME), timer:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, functools.partial(func, *args, **kwargs)
+            )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
     @abstractmethod
-    async def list_images(self, project_id: str) -> List[Dict]:
-        """List all files for a project"""
+    async def list_images(self, project_id: str, skip: int = 0, limit: int = 50, after: Optional[str] = None) -> List[Dict]:
+        """List files for a project ordered by path, starting after the path given as after"""
         pass
 
     @abstractmethod
-    async def save_image(self, file: UploadFile, project_id: str) -> Tuple[str, str]:
-        """Save an image and return (file_path, url)"""
+    async def save_image(self, upload: SpooledUpload, project_id: str, filename: str = None) -> Tuple[str, str]:
+        """Save a spooled image upload and return (file_path, url)"""
         pass
 
     @abstractmethod
@@ -52,55 +105,133 @@ class StorageProvider(ABC):
         """Count total images for a project"""
         pass
 
+    @abstractmethod
+    async def list_class_files(self, project_id: str) -> List[Dict]:
+        """List a project's class and style files as dicts with name, path, size and modified"""
+        pass
+
+    @abstractmethod
+    async def read_file(self, file_path: str) -> bytes:
+        """Read the contents of a stored file"""
+        pass
+
+    def resolve_local_path(self, file_path: str) -> Optional[Path]:
+        """Return the on-disk path of a stored file, or None when it isn't stored locally"""
+        return None
+
+    async def get_pdf_file(self, project_id: str, filename: str) -> Optional[Tuple[Path, int, str]]:
+        """Return (path, size, etag) of a PDF stored on local disk, or None when the backend serves it itself"""
+        return None
+
+    async def _prepare_pdf(self, pdf_path: Path) -> None:
+        """Post-process a compiled PDF before it is stored"""
+        if self.linearizer is not None:
+            await self.linearizer.linearize(pdf_path)
+
+    async def get_usage(self, project_id: str) -> Optional[Dict]:
+        """Return {"files", "bytes"} stored for a project when the provider tracks it cheaply"""
+        return None
+
+    async def get_image_urls(self, file_paths: List[str]) -> Dict[str, str]:
+        """Get URLs for several existing images"""
+        urls = await gather_limited((self.get_image_url(path) for path in file_paths), self.batch_concurrency)
+        return dict(zip(file_paths, urls))
+
+    def stats(self) -> Optional[Dict]:
+        """Provider-specific runtime statistics, if any"""
+        return None
+
+    async def read_files(self, file_paths: List[str]) -> List[bytes]:
+        """Read several stored files concurrently, in the order given"""
+        return await gather_limited((self.read_file(path) for path in file_paths), self.batch_concurrency)
+
+    async def delete_images(self, project_id: str, image_paths: List[str]) -> Dict[str, bool]:
+        """Delete several images concurrently and return whether each one existed"""
+        results = await gather_limited(
+            (self.delete_image(project_id, path) for path in image_paths), self.batch_concurrency
+        )
+        return dict(zip(image_paths, results))
+
 class LocalStorageProvider(StorageProvider):
-    def __init__(self, base_dir: str = "storage"):
+    NAME = "local"
+
+    def __init__(
+        self,
+        base_dir: str = "storage",
+        index_path: Optional[str] = None,
+        io_workers: int = 16,
+        batch_concurrency: int = 8,
+        linearizer: Optional[PdfLinearizer] = None
+    ):
+        super().__init__(io_workers, batch_concurrency, linearizer)
         self.base_dir = Path(base_dir)
         self.base_dir.mkdir(parents=True, exist_ok=True)
+        # Kept beside the storage directory so it isn't served under /storage
+        self.index = StorageIndex(index_path or f"{str(self.base_dir).rstrip('/')}.index.sqlite3")
+        if self.index.created:
+            self.index.rebuild(self.base_dir)
+        # Stored path -> (mtime_ns, size, etag) of each PDF hashed so far
+        self._pdf_etags: Dict[str, Tuple[int, int, str]] = {}
     
-    def _get_project_dir(self, project_id: str) -> Path:
-        project_dir = self.base_dir / project_id
-        project_dir.mkdir(parents=True, exist_ok=True)
-        return project_dir
+    def _index_file(self, project_id: str, path: Path) -> None:
+        stats = path.stat()
+        self.index.upsert(str(path.relative_to(self.base_dir)), project_id, stats.st_size, stats.st_mtime)
 
-    async def list_images(self, project_id: str, skip: int = 0, limit: int = 50) -> List[Dict]:
-        """List all files for a project"""
+    async def list_images(self, project_id: str, skip: int = 0, limit: int = 50, after: Optional[str] = None) -> List[Dict]:
+        """List files for a project from the storage index"""
         try:
-            project_dir = self._get_project_dir(project_id)
-            
-            files = []
-            for path in project_dir.rglob("*"):
-                if path.is_file():
-                    rel_path = path.relative_to(self.base_dir)
-                    stats = path.stat()
-                    files.append({
-                        "name": path.name,
-                        "path": str(rel_path),
-                        "size": stats.st_size,
-                        "modified": datetime.fromtimestamp(stats.st_mtime).isoformat(),
-                        "url": f"/storage/{rel_path}"
-                    })
-
-            return files[skip:skip + limit]
+            rows = await self._run(self.index.list_files, project_id, limit, after=after, offset=skip)
+            return [
+                {
+                    "name": row["name"],
+                    "path": row["path"],
+                    "size": row["size"],
+                    "modified": datetime.fromtimestamp(row["modified"]).isoformat(),
+                    "url": f"/storage/{row['path']}"
+                }
+                for row in rows
+            ]
         except Exception as e:
             logger.error(f"Error listing files for project {project_id}: {str(e)}")
             return []
 
-    async def save_image(self, file: UploadFile, project_id: str, filename: str = None, optimize: bool = False) -> Tuple[str, str]:
+    def _store_file(self, project_id: str, source: Path, target: Path, move: bool) -> None:
+        """Move or copy a file into the project directory and index it; runs on the I/O pool"""
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if move:
+            shutil.move(source, target)
+        else:
+            # Copy beside the target and rename, so readers never see a half-written file
+            partial = target.with_name(f".{target.name}.partial")
+            shutil.copy2(source, partial)
+            os.replace(partial, target)
+        self._index_file(project_id, target)
+
+    def _pdf_file(self, rel_path: str) -> Optional[Tuple[Path, int, str]]:
+        path = self.resolve_local_path(rel_path)
+        if path is None:
+            return None
+        stats = path.stat()
+        known = self._pdf_etags.get(rel_path)
+        if known is not None and known[:2] == (stats.st_mtime_ns, stats.st_size):
+            return path, stats.st_size, known[2]
+        etag = file_etag(path)
+        self._pdf_etags[rel_path] = (stats.st_mtime_ns, stats.st_size, etag)
+        return path, stats.st_size, etag
+
+    async def save_image(self, upload: SpooledUpload, project_id: str, filename: str = None) -> Tuple[str, str]:
         try:
-            project_dir = self._get_project_dir(project_id)
-            images_dir = project_dir / "images"
-            images_dir.mkdir(exist_ok=True)
+            images_dir = self.base_dir / project_id / "images"
 
             if not filename:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                ext = os.path.splitext(file.filename)[1]
+                ext = os.path.splitext(upload.filename)[1]
                 filename = f"img_{timestamp}{ext}"
 
             file_path = images_dir / filename
 
-            async with aiofiles.open(file_path, 'wb') as f:
-                while chunk := await file.read(8192):
-                    await f.write(chunk)
+            # The upload was already validated and written to disk, so just move it into place
+            await self._run(self._store_file, project_id, upload.path, file_path, True)
 
             rel_path = file_path.relative_to(self.base_dir)
             url = f"/storage/{rel_path}"
@@ -113,12 +244,13 @@ class LocalStorageProvider(StorageProvider):
 
     async def save_pdf(self, pdf_path: Path, project_id: str, filename: str) -> Tuple[str, str]:
         try:
-            project_dir = self._get_project_dir(project_id)
-            target_path = project_dir / filename
-
-            shutil.copy2(pdf_path, target_path)
+            target_path = self.base_dir / project_id / filename
+            await self._prepare_pdf(pdf_path)
+            await self._run(self._store_file, project_id, pdf_path, target_path, False)
 
             rel_path = target_path.relative_to(self.base_dir)
+            # Hash while the file is likely still in the page cache
+            await self._run(self._pdf_file, str(rel_path))
             url = f"/storage/{rel_path}"
 
             return str(rel_path), url
@@ -130,82 +262,262 @@ class LocalStorageProvider(StorageProvider):
     async def get_image_url(self, file_path: str) -> str:
         return f"/storage/{file_path}"
 
+    async def list_class_files(self, project_id: str) -> List[Dict]:
+        files = []
+        after = None
+        while True:
+            rows = await self._run(
+                self.index.list_files, project_id, 500, after=after, suffixes=CLASS_FILE_EXTENSIONS
+            )
+            files.extend(rows)
+            if len(rows) < 500:
+                return files
+            after = rows[-1]["path"]
+
+    async def read_file(self, file_path: str) -> bytes:
+        timer = STORAGE_CALL_SECONDS.time(provider=self.NAME, operation="read_file")
+        with span("storage.read_file", provider=self.NAME), timer:
+            async with aiofiles.open(self.base_dir / file_path, 'rb') as f:
+                return await f.read()
+
+    def resolve_local_path(self, file_path: str) -> Optional[Path]:
+        rel_path = file_path[len("storage/"):] if file_path.startswith("storage/") else file_path
+        path = (self.base_dir / rel_path).resolve()
+        if not path.is_relative_to(self.base_dir.resolve()) or not path.is_file():
+            return None
+        return path
+
     async def check_pdf_exists(self, project_id: str, filename: str) -> bool:
-        project_dir = self._get_project_dir(project_id)
-        pdf_path = project_dir / filename
-        return pdf_path.exists()
+        return await self._run((self.base_dir / project_id / filename).exists)
+
+    async def get_pdf_file(self, project_id: str, filename: str) -> Optional[Tuple[Path, int, str]]:
+        return await self._run(self._pdf_file, f"{project_id}/{filename}")
 
     async def get_pdf_url(self, project_id: str, filename: str) -> str:
         return f"/storage/{project_id}/{filename}"
 
+    def _delete_file(self, image_path: str) -> bool:
+        indexed = self.index.remove(image_path)
+        file_path = self.base_dir / image_path
+        if file_path.exists():
+            file_path.unlink()
+            return True
+        return indexed
+
     async def delete_image(self, project_id: str, image_path: str) -> bool:
         try:
-            file_path = self.base_dir / image_path
-            if file_path.exists():
-                file_path.unlink()
-                return True
-            return False
+            return await self._run(self._delete_file, image_path)
         except Exception as e:
             logger.error(f"Error deleting image: {str(e)}")
             return False
 
     async def count_images(self, project_id: str) -> int:
         try:
-            project_dir = self._get_project_dir(project_id)
-            return len(list(project_dir.rglob("*")))
+            return (await self._run(self.index.totals, project_id))[0]
         except Exception as e:
             logger.error(f"Error counting images: {str(e)}")
             return 0
 
+    async def get_usage(self, project_id: str) -> Optional[Dict]:
+        files, size = await self._run(self.index.totals, project_id)
+        return {"files": files, "bytes": size}
+
 class SupabaseStorageProvider(StorageProvider):
-    def __init__(self, supabase_client: Client, bucket_name: str = "pdfs"):
+    """Supabase bucket storage
+
+    supabase-py is synchronous, so every call runs on the provider's thread
+    pool; its httpx client is shared by those threads and pools connections.
+    Signed URLs are cached per bucket path until shortly before they expire.
+    """
+    PDF_URL_EXPIRY = 60 * 60  # 1 hour
+    IMAGE_URL_EXPIRY = 60 * 60 * 24 * 7  # 7 days
+    LIST_PAGE_SIZE = 1000  # Largest page the storage API returns
+    REMOVE_BATCH_SIZE = 1000  # Paths per delete request
+    NAME = "supabase"
+
+    def __init__(
+        self,
+        supabase_client: Client,
+        bucket_name: str = "pdfs",
+        io_workers: int = 16,
+        batch_concurrency: int = 8,
+        url_cache_size: int = 10000,
+        url_expiry_margin: int = 300,
+        linearizer: Optional[PdfLinearizer] = None
+    ):
+        super().__init__(io_workers, batch_concurrency, linearizer)
+        self.urls = SignedUrlCache(url_cache_size, url_expiry_margin)
         self.supabase = supabase_client
         self.bucket_name = bucket_name
+        # Created once up front; the client builds its storage client lazily and not thread-safely
+        self.bucket = supabase_client.storage.from_(bucket_name)
+
+    def _upload_file(self, bucket_path: str, path: Path, content_type: str) -> None:
+        # httpx streams an open file in chunks, so large files are never held in memory
+        with path.open('rb') as f:
+            self.bucket.upload(bucket_path, f, {"x-upsert": "true", "content-type": content_type})
+
+    async def _signed_url(self, bucket_path: str, expires_in: int) -> str:
+        url = self.urls.get(bucket_path)
+        if url is None:
+            started = time.perf_counter()
+            result = await self._run(self.bucket.create_signed_url, bucket_path, expires_in)
+            self.urls.record_request(time.perf_counter() - started)
+            url = result["signedURL"]
+            self.urls.put(bucket_path, url, expires_in)
+        return url
+
+    async def _signed_urls(self, bucket_paths: List[str], expires_in: int) -> Dict[str, Optional[str]]:
+        """Sign several paths, with one request for all those not cached"""
+        urls, missing = self.urls.split(bucket_paths)
+        if missing:
+            started = time.perf_counter()
+            results = await self._run(self.bucket.create_signed_urls, missing, expires_in)
+            self.urls.record_request(time.perf_counter() - started)
+            for item in results:
+                if item.get("path") and item.get("signedURL"):
+                    urls[item["path"]] = item["signedURL"]
+                    self.urls.put(item["path"], item["signedURL"], expires_in)
+        return urls
+
+    def _list_page(self, prefix: str, limit: int, offset: int, search: str = "") -> List[Dict]:
+        return self.bucket.list(prefix, {
+            "limit": limit,
+            "offset": offset,
+            "search": search,
+            "sortBy": {"column": "name", "order": "asc"}
+        })
+
+    async def _list_files(self, prefix: str, limit: int, offset: int = 0, after: Optional[str] = None) -> List[Dict]:
+        """Files (not folders) directly under prefix ordered by name, starting at offset or after a path"""
+        files: List[Dict] = []
+        page_size = self.LIST_PAGE_SIZE if after is not None else min(limit, self.LIST_PAGE_SIZE)
+        if after is not None:
+            # The list API only pages by offset, so skip forward to the cursor
+            offset = 0
+        while len(files) < limit:
+            page = await self._run(self._list_page, prefix, page_size, offset)
+            for entry in page:
+                # Folders are listed without an id
+                path = f"{prefix}/{entry['name']}"
+                if entry.get("id") and (after is None or path > after):
+                    files.append({**entry, "path": path})
+            if len(page) < page_size:
+                break
+            offset += len(page)
+        return files[:limit]
+
+    async def list_images(self, project_id: str, skip: int = 0, limit: int = 50, after: Optional[str] = None) -> List[Dict]:
+        try:
+            entries = await self._list_files(f"{project_id}/images", limit, offset=skip, after=after)
+            urls = await self._signed_urls([entry["path"] for entry in entries], self.IMAGE_URL_EXPIRY)
+            return [
+                {
+                    "name": entry["name"],
+                    "path": entry["path"],
+                    "size": (entry.get("metadata") or {}).get("size"),
+                    "modified": entry.get("updated_at"),
+                    "url": urls.get(entry["path"])
+                }
+                for entry in entries
+            ]
+        except Exception as e:
+            logger.error(f"Error listing files for project {project_id}: {str(e)}")
+            return []
 
     async def save_pdf(self, pdf_path: Path, project_id: str, filename: str) -> Tuple[str, str]:
         bucket_path = f"{project_id}/{filename}"
-        
-        with pdf_path.open('rb') as pdf_file:
-            self.supabase.storage.from_(self.bucket_name).upload(
-                bucket_path,
-                pdf_file,
-                {"upsert": True}
-            )
-        
-        url = self.supabase.storage.from_(self.bucket_name).create_signed_url(
-            bucket_path,
-            60 * 60  # 1 hour expiry
-        )
-        
+        await self._prepare_pdf(pdf_path)
+        await self._run(self._upload_file, bucket_path, pdf_path, "application/pdf")
+        self.urls.invalidate(bucket_path)
+        url = await self._signed_url(bucket_path, self.PDF_URL_EXPIRY)
         return bucket_path, url
 
-    async def save_image(self, image: UploadFile, project_id: str) -> Tuple[str, str]:
+    async def save_image(self, upload: SpooledUpload, project_id: str, filename: str = None) -> Tuple[str, str]:
         # Generate unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        _, ext = os.path.splitext(image.filename)
-        filename = f"img_{timestamp}{ext}"
+        if not filename:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            _, ext = os.path.splitext(upload.filename)
+            filename = f"img_{timestamp}{ext}"
         
         bucket_path = f"{project_id}/images/{filename}"
         
-        # Read the file content
-        content = await image.read()
-        
-        # Upload to Supabase
-        self.supabase.storage.from_(self.bucket_name).upload(
-            bucket_path,
-            content,
-            {"upsert": True}
-        )
-        
-        url = self.supabase.storage.from_(self.bucket_name).create_signed_url(
-            bucket_path,
-            60 * 60 * 24 * 7  # 7 days expiry for images
-        )
-        
+        # Upload to Supabase straight from the spooled file
+        await self._run(self._upload_file, bucket_path, upload.path, upload.content_type)
+        self.urls.invalidate(bucket_path)
+        url = await self._signed_url(bucket_path, self.IMAGE_URL_EXPIRY)
         return bucket_path, url
 
     async def get_image_url(self, file_path: str) -> str:
-        return self.supabase.storage.from_(self.bucket_name).create_signed_url(
-            file_path,
-            60 * 60 * 24 * 7  # 7 days expiry for images
-        )
\ No newline at end of file
+        return await self._signed_url(file_path, self.IMAGE_URL_EXPIRY)
+
+    async def get_image_urls(self, file_paths: List[str]) -> Dict[str, str]:
+        urls = await self._signed_urls(file_paths, self.IMAGE_URL_EXPIRY)
+        missing = [path for path in file_paths if path not in urls]
+        if missing:
+            raise Exception(f"Could not sign URLs for: {', '.join(missing)}")
+        return urls
+
+    async def check_pdf_exists(self, project_id: str, filename: str) -> bool:
+        entries = await self._run(self._list_page, project_id, self.LIST_PAGE_SIZE, 0, filename)
+        # search is a prefix match, so look for the exact name
+        return any(entry.get("name") == filename and entry.get("id") for entry in entries)
+
+    async def get_pdf_url(self, project_id: str, filename: str) -> str:
+        return await self._signed_url(f"{project_id}/{filename}", self.PDF_URL_EXPIRY)
+
+    async def delete_image(self, project_id: str, image_path: str) -> bool:
+        return (await self.delete_images(project_id, [image_path])).get(image_path, False)
+
+    async def delete_images(self, project_id: str, image_paths: List[str]) -> Dict[str, bool]:
+        """Delete images with one request per REMOVE_BATCH_SIZE paths, sending the batches concurrently"""
+        batches = [
+            image_paths[i:i + self.REMOVE_BATCH_SIZE]
+            for i in range(0, len(image_paths), self.REMOVE_BATCH_SIZE)
+        ]
+        for path in image_paths:
+            self.urls.invalidate(path)
+        try:
+            results = await gather_limited(
+                (self._run(self.bucket.remove, batch) for batch in batches), self.batch_concurrency
+            )
+        except Exception as e:
+            logger.error(f"Error deleting images: {str(e)}")
+            return {path: False for path in image_paths}
+        # Only objects that existed are returned
+        deleted = {item.get("name") for removed in results for item in removed}
+        return {path: path in deleted for path in image_paths}
+
+    async def count_images(self, project_id: str) -> int:
+        try:
+            prefix = f"{project_id}/images"
+            count = 0
+            offset = 0
+            while True:
+                page = await self._run(self._list_page, prefix, self.LIST_PAGE_SIZE, offset)
+                count += sum(1 for entry in page if entry.get("id"))
+                if len(page) < self.LIST_PAGE_SIZE:
+                    return count
+                offset += len(page)
+        except Exception as e:
+            logger.error(f"Error counting images: {str(e)}")
+            return 0
+
+    async def list_class_files(self, project_id: str) -> List[Dict]:
+        entries = await self._list_files(project_id, sys.maxsize)
+        return [
+            {
+                "name": entry["name"],
+                "path": entry["path"],
+                "size": (entry.get("metadata") or {}).get("size"),
+                "modified": entry.get("updated_at")
+            }
+            for entry in entries
+            if os.path.splitext(entry["name"])[1] in CLASS_FILE_EXTENSIONS
+        ]
+
+    async def read_file(self, file_path: str) -> bytes:
+        return await self._run(self.bucket.download, file_path)
+
+    def stats(self) -> Optional[Dict]:
+        return {"signed_urls": self.urls.stats()}
@@ -0,0 +1,171 @@
+# app/storage_index.py
+import os
+import sys
+import sqlite3
+import logging
+import argparse
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger("latex-service")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    project_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    modified REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_by_project ON files (project_id, path);
+
+-- Per-project totals kept current by triggers so counts never scan files
+CREATE TABLE IF NOT EXISTS projects (
+    project_id TEXT PRIMARY KEY,
+    file_count INTEGER NOT NULL DEFAULT 0,
+    total_bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE TRIGGER IF NOT EXISTS files_insert AFTER INSERT ON files BEGIN
+    INSERT OR IGNORE INTO projects (project_id) VALUES (NEW.project_id);
+    UPDATE projects SET file_count = file_count + 1, total_bytes = total_bytes + NEW.size
+        WHERE project_id = NEW.project_id;
+END;
+CREATE TRIGGER IF NOT EXISTS files_delete AFTER DELETE ON files BEGIN
+    UPDATE projects SET file_count = file_count - 1, total_bytes = total_bytes - OLD.size
+        WHERE project_id = OLD.project_id;
+END;
+CREATE TRIGGER IF NOT EXISTS files_update AFTER UPDATE OF size ON files BEGIN
+    UPDATE projects SET total_bytes = total_bytes - OLD.size + NEW.size
+        WHERE project_id = NEW.project_id;
+END;
+"""
+
+class StorageIndex:
+    """SQLite index of the files in a local storage directory
+
+    Writers keep it current as files are saved and deleted; rebuild()
+    reconciles it with whatever is actually on disk.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.created = not self.db_path.exists()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def upsert(self, path: str, project_id: str, size: int, modified: float) -> None:
+        with self._lock:
+            self._upsert(path, project_id, size, modified)
+
+    def _upsert(self, path: str, project_id: str, size: int, modified: float) -> None:
+        self._conn.execute(
+            "INSERT INTO files (path, project_id, name, size, modified) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET size = excluded.size, modified = excluded.modified",
+            (path, project_id, os.path.basename(path), size, modified)
+        )
+
+    def remove(self, path: str) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM files WHERE path = ?", (path,)).rowcount > 0
+
+    def list_files(
+        self,
+        project_id: str,
+        limit: int,
+        after: Optional[str] = None,
+        offset: int = 0,
+        suffixes: Optional[Iterable[str]] = None
+    ) -> List[Dict]:
+        """Files of a project ordered by path, starting after the given path (keyset) or offset"""
+        query = "SELECT path, name, size, modified FROM files WHERE project_id = ?"
+        params: List = [project_id]
+        if after is not None:
+            query += " AND path > ?"
+            params.append(after)
+        if suffixes:
+            suffixes = list(suffixes)
+            query += " AND (" + " OR ".join("name LIKE ?" for _ in suffixes) + ")"
+            params.extend(f"%{suffix}" for suffix in suffixes)
+        query += " ORDER BY path LIMIT ?"
+        params.append(limit)
+        if offset and after is None:
+            query += " OFFSET ?"
+            params.append(offset)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, params)]
+
+    def totals(self, project_id: str) -> Tuple[int, int]:
+        """Return (file count, total bytes) for a project"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_count, total_bytes FROM projects WHERE project_id = ?", (project_id,)
+            ).fetchone()
+        return (row["file_count"], row["total_bytes"]) if row else (0, 0)
+
+    def rebuild(self, base_dir: Path) -> Dict[str, int]:
+        """Reconcile the index with the files under base_dir and return what changed"""
+        base_dir = Path(base_dir)
+        changes = {"added": 0, "updated": 0, "removed": 0}
+        seen = set()
+        with self._lock:
+            indexed = {
+                row["path"]: (row["size"], row["modified"])
+                for row in self._conn.execute("SELECT path, size, modified FROM files")
+            }
+            self._conn.execute("BEGIN")
+            try:
+                for project_dir in sorted(base_dir.iterdir()) if base_dir.exists() else []:
+                    if not project_dir.is_dir() or project_dir.name.startswith('.'):
+                        continue
+                    for root, _, files in os.walk(project_dir):
+                        for name in files:
+                            full_path = Path(root) / name
+                            rel_path = str(full_path.relative_to(base_dir))
+                            stats = full_path.stat()
+                            seen.add(rel_path)
+                            current = indexed.get(rel_path)
+                            if current == (stats.st_size, stats.st_mtime):
+                                continue
+                            self._upsert(rel_path, project_dir.name, stats.st_size, stats.st_mtime)
+                            changes["updated" if current else "added"] += 1
+
+                for rel_path in set(indexed) - seen:
+                    self._conn.execute("DELETE FROM files WHERE path = ?", (rel_path,))
+                    changes["removed"] += 1
+                self._conn.execute("DELETE FROM projects WHERE file_count <= 0")
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.info(f"Reconciled storage index with {base_dir}: {changes}")
+        return changes
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from app.config import settings
+
+    parser = argparse.ArgumentParser(prog="python -m app.storage_index", description="Maintain the local storage index")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: reconcile the index with the storage directory")
+    parser.add_argument("--storage-dir", default=settings.LOCAL_STORAGE_DIR)
+    parser.add_argument("--index", default=settings.STORAGE_INDEX_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    index = StorageIndex(args.index)
+    try:
+        changes = index.rebuild(Path(args.storage_dir))
+    finally:
+        index.close()
+    print(f"added {changes['added']}, updated {changes['updated']}, removed {changes['removed']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+# app/tex_output.py
+import re
+from typing import Dict, List, Optional, Callable, Any
+
+# "[12" as TeX starts shipping out page 12, followed by "]", whitespace, {map files} or <fonts/images>
+PAGE_SHIPPED = re.compile(r'(?<![\w\\])\[(\d+)(?=[\]\s{<]|$)')
+# Errors as printed with -file-line-error, e.g. "./document.tex:12: Undefined control sequence."
+# TeX prints the path it opened, so "text:12: text" a document writes with \typeout is not taken for one
+FILE_LINE_ERROR = re.compile(
+    r'^(\.{0,2}/[^:]*|[^:\s]+\.(?:tex|sty|cls|bib|bbl|bst|def|cfg|clo|fd|ltx|dtx|ins|aux|toc|ind|idx))'
+    r':(\d+): (.+)$'
+)
+# Errors TeX reports without a location, e.g. "! Emergency stop."
+BANG_ERROR = re.compile(r'^! (.+)$')
+
+class TexOutputMonitor:
+    """Watches engine output line by line and reports shipped pages and errors as they appear"""
+    MAX_ERRORS = 20
+
+    def __init__(self, on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None, fail_fast: bool = False):
+        self.on_event = on_event
+        self.fail_fast = fail_fast
+        self.pages = 0
+        self.errors: List[Dict[str, Any]] = []
+
+    def _emit(self, phase: str, **details) -> None:
+        if self.on_event is not None:
+            self.on_event(phase, details)
+
+    def _record_error(self, message: str, file: Optional[str] = None, line: Optional[int] = None) -> None:
+        if len(self.errors) >= self.MAX_ERRORS:
+            return
+        error = {"severity": "error", "message": message, "file": file, "line": line}
+        self.errors.append(error)
+        self._emit("diagnostic", **error)
+
+    def feed(self, text: str) -> bool:
+        """Process one line of output, returning True when the run should stop"""
+        match = FILE_LINE_ERROR.match(text)
+        if match:
+            self._record_error(match.group(3), match.group(1), int(match.group(2)))
+            return self.fail_fast
+
+        match = BANG_ERROR.match(text)
+        if match:
+            self._record_error(match.group(1))
+            return self.fail_fast
+
+        for match in PAGE_SHIPPED.finditer(text):
+            page = int(match.group(1))
+            # Pages ship in order; anything else is bracketed text, not a page marker
+            if page == self.pages + 1:
+                self.pages = page
+                self._emit("page", number=page)
+        return False
+
+    @property
+    def first_error(self) -> Optional[Dict[str, Any]]:
+        return self.errors[0] if self.errors else None
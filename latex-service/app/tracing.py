@@ -0,0 +1,117 @@
+# app/tracing.py
+import os
+import re
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger("latex-service")
+
+class Span:
+    """A timed operation with attributes and the spans nested inside it"""
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.children: List["Span"] = []
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def finish(self) -> None:
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self, origin: Optional[float] = None) -> Dict:
+        """Nested dict with start offsets in ms from origin (this span's start by default)"""
+        origin = self.start if origin is None else origin
+        span = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round((self.duration or 0.0) * 1000, 2)
+        }
+        if self.attributes:
+            span["attributes"] = self.attributes
+        if self.children:
+            span["children"] = [child.to_dict(origin) for child in self.children]
+        return span
+
+    def server_timing(self, depth: int = 2) -> str:
+        """Server-Timing header value for the spans up to depth levels below this one"""
+        entries = [f"total;dur={(self.duration or 0.0) * 1000:.1f}"]
+
+        def walk(span: Span, level: int) -> None:
+            for child in span.children:
+                label = child.name
+                if "number" in child.attributes:
+                    label = f"{label}_{child.attributes['number']}"
+                entries.append(f"{re.sub(r'[^A-Za-z0-9_.-]', '_', label)};dur={(child.duration or 0.0) * 1000:.1f}")
+                if level < depth:
+                    walk(child, level + 1)
+
+        walk(self, 1)
+        return ", ".join(entries)
+
+_current: ContextVar[Optional[Span]] = ContextVar("latex_span", default=None)
+
+@contextmanager
+def start_trace(name: str, **attributes: Any) -> Iterator[Span]:
+    """Make a new root span current for the block; spans opened inside nest under it"""
+    root = Span(name, attributes)
+    token = _current.set(root)
+    try:
+        yield root
+    finally:
+        root.finish()
+        _current.reset(token)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Record a child of the current span; a no-op outside of a trace"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, attributes)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set(error=type(e).__name__)
+        raise
+    finally:
+        child.finish()
+        _current.reset(token)
+
+class TraceExporter:
+    """Appends finished traces to a JSONL file, rotating it to .1 past max_bytes"""
+    def __init__(self, path: str, max_bytes: int):
+        self.path = Path(path) if path else None
+        self.max_bytes = max_bytes
+        self.exported = 0
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def export(self, root: Span, **fields: Any) -> None:
+        """Write one trace line; blocking, so callers run it off the event loop"""
+        if self.path is None:
+            return
+        line = json.dumps({**fields, "timestamp": root.start, **root.to_dict()}, default=str)
+        try:
+            with self._lock:
+                if self.path.exists() and self.path.stat().st_size + len(line) > self.max_bytes:
+                    os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                self.exported += 1
+        except OSError as e:
+            logger.warning(f"Could not write trace to {self.path}: {str(e)}")
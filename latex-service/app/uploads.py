@@ -0,0 +1,160 @@
+# app/uploads.py
+import uuid
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aiofiles
+from fastapi import UploadFile
+from PIL import Image
+
+from app.cache import file_digest
+from app.image_derivatives import ImageDerivatives
+
+logger = logging.getLogger("latex-service")
+
+CHUNK_SIZE = 65536
+# Enough leading bytes to tell every allowed type apart
+SNIFF_BYTES = 16
+# Formats an upload can be optimized into without changing its type; animated GIFs are left alone
+OPTIMIZABLE_TYPES = {
+    "image/jpeg": "JPEG",
+    "image/png": "PNG",
+    "image/webp": "WEBP"
+}
+
+class UploadValidationError(Exception):
+    """Raised when an upload is rejected while it is being read"""
+
+@dataclass
+class SpooledUpload:
+    """An upload written to disk together with what was learned while reading it"""
+    path: Path
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+    dimensions: Optional[Dict[str, int]] = None
+
+    def discard(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+def sniff_content_type(header: bytes) -> Optional[str]:
+    """Identify a file type from its leading magic bytes"""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    if header.startswith(b"%PDF-"):
+        return "application/pdf"
+    return None
+
+def read_dimensions(path: Path) -> Optional[Dict[str, int]]:
+    """Read image dimensions from the file header without decoding pixel data"""
+    try:
+        with Image.open(path) as img:
+            return {"width": img.width, "height": img.height}
+    except Exception as e:
+        logger.warning(f"Could not get image dimensions: {e}")
+        return None
+
+async def spool_upload(
+    file: UploadFile,
+    spool_dir: Path,
+    max_size: int,
+    allowed_types: List[str]
+) -> SpooledUpload:
+    """Stream an upload to disk in one pass, enforcing the size limit and type as it is read
+
+    The sha256 is computed on the way in and dimensions are read from the
+    image header in a worker thread, so memory use doesn't depend on the
+    size of the file.
+    """
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    path = spool_dir / f"upload_{uuid.uuid4().hex}"
+    digest = hashlib.sha256()
+    size = 0
+    header = b""
+    content_type = None
+    try:
+        async with aiofiles.open(path, 'wb') as f:
+            while chunk := await file.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    logger.warning(f"Upload {file.filename} exceeds {max_size} bytes, rejecting")
+                    raise UploadValidationError(
+                        f"File too large. Maximum size: {max_size / (1024 * 1024)}MB"
+                    )
+
+                if content_type is None:
+                    header += chunk[:SNIFF_BYTES - len(header)]
+                    if len(header) >= SNIFF_BYTES:
+                        content_type = _check_type(header, file, allowed_types)
+
+                digest.update(chunk)
+                await f.write(chunk)
+
+        if content_type is None:
+            # Upload shorter than the sniffing window
+            content_type = _check_type(header, file, allowed_types)
+
+        upload = SpooledUpload(
+            path=path,
+            filename=file.filename or "upload",
+            content_type=content_type,
+            size=size,
+            sha256=digest.hexdigest()
+        )
+        if content_type != "application/pdf":
+            upload.dimensions = await asyncio.to_thread(read_dimensions, path)
+        logger.debug(f"Spooled upload {upload.filename}: {size} bytes, {content_type}, sha256 {upload.sha256[:12]}")
+        return upload
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+
+def _check_type(header: bytes, file: UploadFile, allowed_types: List[str]) -> str:
+    content_type = sniff_content_type(header)
+    if content_type is None or content_type not in allowed_types:
+        logger.warning(f"Invalid file type for {file.filename}: declared {file.content_type}, sniffed {content_type}")
+        raise UploadValidationError(
+            f"Unsupported file type. Allowed types: {', '.join(allowed_types)}"
+        )
+    if content_type != file.content_type:
+        logger.debug(f"Upload {file.filename} declared as {file.content_type} but contains {content_type}")
+    return content_type
+
+async def optimize_upload(upload: SpooledUpload, derivatives: ImageDerivatives) -> SpooledUpload:
+    """Replace a spooled image with a downsampled, recompressed copy without metadata
+
+    The copy is stored even when it isn't smaller, so location and camera
+    metadata never reach storage. The original is kept only when the image
+    can't be decoded.
+    """
+    output_format = OPTIMIZABLE_TYPES.get(upload.content_type)
+    if output_format is None:
+        return upload
+
+    target = upload.path.with_name(f"{upload.path.name}_optimized")
+    result = await derivatives.optimize(upload.path, target, output_format)
+    if result is None:
+        return upload
+
+    size = target.stat().st_size
+    logger.debug(f"Optimized {upload.filename}: {upload.size} -> {size} bytes, {result['width']}x{result['height']}")
+    upload.discard()
+    return SpooledUpload(
+        path=target,
+        filename=upload.filename,
+        content_type=upload.content_type,
+        size=size,
+        sha256=await asyncio.to_thread(file_digest, target),
+        dimensions={"width": result["width"], "height": result["height"]}
+    )
@@ -0,0 +1,310 @@
+# benchmarks/compile_bench.py
+"""End-to-end benchmark of LatexCompiler.compile and the storage save that follows it
+
+Synthetic documents (N pages, M \\includegraphics references, K style files)
+are compiled against LocalStorageProvider, with half of the images served by
+a local HTTP server and half read from local storage. Each concurrency level
+reports p50/p95/p99 latency per phase and throughput as JSON.
+
+Run from the latex-service directory:
+
+    python -m benchmarks.compile_bench --pages 20 --images 10 --classes 3 --concurrency 1,4,8
+    python -m benchmarks.compile_bench --engine pdflatex --output results.json
+    python -m benchmarks.compile_bench --baseline results.json --tolerance 0.15
+
+The default stub engine writes a fake PDF without typesetting, isolating the
+service's own overhead; --engine pdflatex measures real compiles. With
+--baseline the run exits with status 1 when p95 latency or throughput at any
+concurrency level regressed by more than the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+import platform
+import itertools
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from benchmarks.documents import make_document, make_image, write_styles
+from benchmarks.image_server import ImageServer
+
+STUB_ENGINE = Path(__file__).resolve().parent / "stub_engine.py"
+ASSETS_PROJECT = "bench-assets"
+# Progress events that start a new phase of a compile
+PHASE_EVENTS = {"class_prep", "materialize", "image_fetch", "cache_hit", "format", "pass", "tool"}
+
+logger = logging.getLogger("latex-bench")
+
+def percentile(values: List[float], q: float) -> float:
+    """Linearly interpolated percentile of sorted values, q in [0, 100]"""
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def summarize(samples: List[float]) -> Dict:
+    values = sorted(samples)
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0
+    }
+
+class PhaseTimer:
+    """Turns the compiler's progress events into per-phase durations for one compile"""
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self._phase: Optional[str] = None
+        self._started = time.perf_counter()
+
+    def progress(self, phase: str, details: Dict) -> None:
+        if phase not in PHASE_EVENTS or (phase == "image_fetch" and details.get("done")):
+            return
+        if phase == "pass":
+            label = f"pass_{details['number']}"
+        elif phase == "tool":
+            label = f"tool_{details['name']}"
+        else:
+            label = phase
+        self.finish()
+        self._phase = label
+        self._started = time.perf_counter()
+
+    def finish(self) -> None:
+        if self._phase is not None:
+            elapsed = time.perf_counter() - self._started
+            self.durations[self._phase] = self.durations.get(self._phase, 0.0) + elapsed
+            if self._phase.startswith("pass_"):
+                self.durations["passes"] = self.durations.get("passes", 0.0) + elapsed
+            self._phase = None
+
+def configure(root: Path, engine: str, caches: bool) -> None:
+    """Point every directory setting at root and select the engine, before the compiler is built"""
+    from app.config import settings
+
+    original_temp = settings.TEMP_DIR.rstrip("/")
+    temp_dir = root / "tmp"
+    for name in dir(settings):
+        value = getattr(settings, name)
+        if name.isupper() and name.endswith("_DIR") and isinstance(value, str) and value.startswith(original_temp):
+            setattr(settings, name, str(temp_dir / os.path.relpath(value, original_temp)))
+    settings.TEMP_DIR = str(temp_dir)
+    settings.LOCAL_STORAGE_DIR = str(root / "storage")
+    settings.STORAGE_INDEX_PATH = str(root / "storage.index.sqlite3")
+    settings.LATEX_ENGINE = str(STUB_ENGINE) if engine == "stub" else engine
+    settings.COMPILE_CACHE_ENABLED = caches
+    settings.FORMAT_CACHE_ENABLED = caches
+    temp_dir.mkdir(parents=True, exist_ok=True)
+
+async def run_level(
+    compiler,
+    storage,
+    concurrency: int,
+    count: int,
+    document_for,
+    incremental: bool,
+    mode: str = "final"
+) -> Dict:
+    """Run count compiles with concurrency workers and summarize their timings"""
+    samples: Dict[str, List[float]] = {}
+    errors: List[str] = []
+    indexes = itertools.count()
+
+    def record(phase: str, seconds: float) -> None:
+        samples.setdefault(phase, []).append(seconds)
+
+    async def worker(number: int) -> None:
+        # One project per worker, so warm build directories are never contended
+        project_id = f"bench-{number}"
+        while (index := next(indexes)) < count:
+            timer = PhaseTimer()
+            started = time.perf_counter()
+            try:
+                result = await compiler.compile(
+                    document_for(), project_id, incremental=incremental, progress=timer.progress, mode=mode
+                )
+                timer.finish()
+                compiled = time.perf_counter()
+                await storage.save_pdf(result.pdf_path, project_id, f"bench-{index % 8}.pdf")
+                record("storage_save", time.perf_counter() - compiled)
+                result.pdf_path.unlink(missing_ok=True)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {getattr(e, 'log_content', None) or e}"[:500])
+                continue
+            record("compile", compiled - started)
+            record("total", time.perf_counter() - started)
+            for phase, seconds in timer.durations.items():
+                record(phase, seconds)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(number) for number in range(concurrency)))
+    wall = time.perf_counter() - started
+    completed = count - len(errors)
+    return {
+        "concurrency": concurrency,
+        "compiles": count,
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_seconds": round(wall, 3),
+        "throughput_per_second": round(completed / wall, 3) if wall else 0.0,
+        "phases": {phase: summarize(values) for phase, values in sorted(samples.items())}
+    }
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Describe every concurrency level whose p95 or throughput is worse than baseline by more than tolerance"""
+    regressions = []
+    previous = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    for level in results["levels"]:
+        before = previous.get(level["concurrency"])
+        if before is None or "total" not in level["phases"] or "total" not in before["phases"]:
+            continue
+        p95, old_p95 = level["phases"]["total"]["p95_ms"], before["phases"]["total"]["p95_ms"]
+        if old_p95 and p95 > old_p95 * (1 + tolerance):
+            regressions.append(f"concurrency {level['concurrency']}: p95 {old_p95:.1f}ms -> {p95:.1f}ms")
+        rate, old_rate = level["throughput_per_second"], before["throughput_per_second"]
+        if old_rate and rate < old_rate * (1 - tolerance):
+            regressions.append(f"concurrency {level['concurrency']}: throughput {old_rate:.2f}/s -> {rate:.2f}/s")
+    return regressions
+
+async def run(args: argparse.Namespace, root: Path) -> Dict:
+    configure(root, args.engine, not args.no_cache)
+
+    # Imported after configure so nothing sees the default directories
+    from app.config import settings
+    from app.latex_compiler import LatexCompiler
+    from app.storage import LocalStorageProvider
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    storage_dir = Path(settings.LOCAL_STORAGE_DIR)
+    styles: List[str] = []
+    for number in range(max(levels)):
+        styles = write_styles(storage_dir / f"bench-{number}", args.classes)
+
+    # Even images come over HTTP, odd ones from local storage
+    served: Dict[str, bytes] = {}
+    local_refs: Dict[int, str] = {}
+    for index in range(args.images):
+        data = make_image(index, args.image_width, args.image_height)
+        if index % 2 == 0:
+            served[f"img{index}.png"] = data
+        else:
+            path = storage_dir / ASSETS_PROJECT / "images" / f"img{index}.png"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            local_refs[index] = f"storage/{ASSETS_PROJECT}/images/img{index}.png"
+
+    server = ImageServer(served)
+    base_url = await server.start()
+    image_refs = [
+        f"{base_url}/img{index}.png" if index % 2 == 0 else local_refs[index]
+        for index in range(args.images)
+    ]
+    run_id = uuid.uuid4().hex[:8]
+    serials = itertools.count()
+
+    def document_for() -> str:
+        # Every compile of the run gets a distinct document
+        return make_document(args.pages, image_refs, styles, f"{run_id}-{next(serials)}")
+
+    storage = LocalStorageProvider(settings.LOCAL_STORAGE_DIR, settings.STORAGE_INDEX_PATH)
+    compiler = LatexCompiler(storage, settings.TEMP_DIR)
+    try:
+        if args.warmup:
+            await run_level(compiler, storage, 1, args.warmup, document_for, args.incremental, args.mode)
+
+        results = []
+        for concurrency in levels:
+            count = args.compiles or max(8, concurrency * 4)
+            level = await run_level(
+                compiler, storage, concurrency, count, document_for, args.incremental, args.mode
+            )
+            total = level["phases"].get("total", {})
+            print(
+                f"concurrency {concurrency:>3}: {level['throughput_per_second']:>8.2f} compiles/s  "
+                f"p50 {total.get('p50_ms', 0):>9.1f}ms  p95 {total.get('p95_ms', 0):>9.1f}ms  "
+                f"p99 {total.get('p99_ms', 0):>9.1f}ms  errors {level['errors']}",
+                file=sys.stderr
+            )
+            results.append(level)
+    finally:
+        await server.stop()
+        await compiler.image_cache.close()
+        compiler.image_derivatives.close()
+        storage.close()
+
+    return {
+        "benchmark": "compile",
+        "config": {
+            "engine": args.engine,
+            "pages": args.pages,
+            "images": args.images,
+            "classes": args.classes,
+            "image_size": [args.image_width, args.image_height],
+            "caches": not args.no_cache,
+            "incremental": args.incremental,
+            "mode": args.mode,
+            "warmup": args.warmup
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "image_server": {"requests": server.requests, "not_modified": server.not_modified},
+        "levels": results
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compile_bench", description=__doc__.split("\n")[0])
+    parser.add_argument("--engine", default="stub", help="'stub' or a TeX engine executable such as pdflatex")
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--images", type=int, default=6)
+    parser.add_argument("--classes", type=int, default=2, help="Project style files per document")
+    parser.add_argument("--image-width", type=int, default=640)
+    parser.add_argument("--image-height", type=int, default=480)
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--compiles", type=int, default=0, help="Compiles per level (default: 4 per worker, at least 8)")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed compiles before the first level")
+    parser.add_argument("--incremental", action="store_true", help="Compile in warm build directories")
+    parser.add_argument("--mode", choices=("final", "preview"), default="final", help="Compile mode")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the compile and format caches")
+    parser.add_argument("--work-dir", help="Directory for storage and caches (default: a fresh temporary one)")
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against the baseline")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s %(name)s: %(message)s")
+    logging.getLogger("latex-service").setLevel(args.log_level.upper())
+
+    root = Path(args.work_dir or tempfile.mkdtemp(prefix="latex-bench-"))
+    results = asyncio.run(run(args, root))
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        results["regressions"] = regressions
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+
+    for regression in results.get("regressions", []):
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if results.get("regressions") else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+# benchmarks/documents.py
+"""Synthetic projects for the compile benchmarks"""
+import io
+from pathlib import Path
+from typing import Dict, List
+
+from PIL import Image
+
+PARAGRAPH = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud "
+    "exercitation ullamco laboris nisi ut aliquip ex ea commodo consequat. "
+)
+
+def make_image(index: int, width: int, height: int) -> bytes:
+    """PNG gradient that differs per index, so every image has its own digest"""
+    img = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    img.putpixel((index % width, 0), (255, index % 256, 0))
+    buffer = io.BytesIO()
+    img.save(buffer, "PNG")
+    return buffer.getvalue()
+
+def make_style(index: int) -> str:
+    return (
+        f"\\NeedsTeXFormat{{LaTeX2e}}\n"
+        f"\\ProvidesPackage{{benchstyle{index}}}\n"
+        f"\\newcommand{{\\benchmacro{chr(ord('a') + index % 26)}{index}}}{{Style {index}}}\n"
+    )
+
+def write_styles(project_dir: Path, count: int) -> List[str]:
+    """Write count style files into a project's storage directory and return their package names"""
+    project_dir.mkdir(parents=True, exist_ok=True)
+    names = []
+    for index in range(count):
+        name = f"benchstyle{index}"
+        (project_dir / f"{name}.sty").write_text(make_style(index))
+        names.append(name)
+    return names
+
+def make_document(pages: int, image_refs: List[str], styles: List[str], nonce: str) -> str:
+    """LaTeX source with the given page count, images spread over the pages and a cross-reference
+
+    nonce makes each document distinct so the compile cache never answers for it.
+    """
+    preamble = ["\\documentclass{article}", "\\usepackage{graphicx}"]
+    preamble.extend(f"\\usepackage{{{name}}}" for name in styles)
+
+    body: List[str] = [f"% run {nonce}", "\\section{Introduction}\\label{sec:intro}", "See Section~\\ref{sec:last}."]
+    per_page: Dict[int, List[str]] = {}
+    for index, ref in enumerate(image_refs):
+        per_page.setdefault(index % max(pages, 1), []).append(ref)
+    for page in range(pages):
+        if page:
+            body.append("\\newpage")
+        body.append(PARAGRAPH * 6)
+        for ref in per_page.get(page, []):
+            body.append(f"\\includegraphics[width=0.4\\textwidth]{{{ref}}}")
+    body.append("\\section{Conclusion}\\label{sec:last}")
+    body.append("Back to Section~\\ref{sec:intro}.")
+
+    return "\n".join(preamble + ["\\begin{document}"] + body + ["\\end{document}", ""])
@@ -0,0 +1,43 @@
+# benchmarks/image_server.py
+"""Local HTTP server for benchmark images, with ETag revalidation like a real object store"""
+import hashlib
+from typing import Dict, Optional
+
+from aiohttp import web
+
+class ImageServer:
+    def __init__(self, images: Dict[str, bytes]):
+        self.images = images
+        self.requests = 0
+        self.not_modified = 0
+        self._etags = {name: f'"{hashlib.sha256(data).hexdigest()[:16]}"' for name, data in images.items()}
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    async def _serve(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        name = request.match_info["name"]
+        if name not in self.images:
+            raise web.HTTPNotFound()
+        etag = self._etags[name]
+        if request.headers.get("If-None-Match") == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=self.images[name], content_type="image/png", headers={"ETag": etag})
+
+    async def start(self) -> str:
+        """Start listening on a free local port and return the base URL"""
+        app = web.Application()
+        app.router.add_get("/images/{name}", self._serve)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}/images"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# benchmarks/stub_engine.py
+"""Stand-in for pdflatex that does no typesetting
+
+It accepts the same command lines the compiler issues, checks that every
+\\includegraphics file and \\input exists, prints TeX-style page markers and
+writes a .log, an .aux with the document's labels and a valid PDF with one
+blank page per \\newpage. Benchmarks run against it to isolate the time
+spent in the service itself.
+"""
+import os
+import re
+import sys
+
+INCLUDE_GRAPHICS = re.compile(r'\\includegraphics(\[.*?\])?\{(.*?)\}')
+INPUT = re.compile(r'\\input\{(.*?)\}')
+LABEL = re.compile(r'\\label\{(.*?)\}')
+
+def write_pdf(path: str, pages: int) -> None:
+    """Write a minimal valid PDF with the given number of blank pages"""
+    kids = " ".join(f"{3 + i} 0 R" for i in range(pages))
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>",
+        *["<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>"] * pages,
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+def main(argv) -> int:
+    options = dict(arg.lstrip("-").split("=", 1) for arg in argv if arg.startswith("-") and "=" in arg)
+    tex_file = [arg for arg in argv if not arg.startswith(("-", "&"))][-1]
+    with open(tex_file, encoding="utf-8", errors="replace") as f:
+        source = f.read()
+
+    if "-ini" in argv:
+        # Format dump: keep the preamble so a later load can be checked
+        with open(f"{options['jobname']}.fmt", "w") as f:
+            f.write(source)
+        return 0
+
+    stem = os.path.splitext(os.path.basename(tex_file))[0]
+    if "fmt" in options and not os.path.exists(f"{options['fmt']}.fmt"):
+        print(f"I can't find the format file `{options['fmt']}.fmt'!")
+        return 1
+
+    log = [f"This is stub pdfTeX\n({tex_file}"]
+    for line_number, line in enumerate(source.splitlines(), start=1):
+        for name in INPUT.findall(line):
+            if not (os.path.exists(name) or os.path.exists(f"{name}.tex")):
+                print(f"./{tex_file}:{line_number}: LaTeX Error: File `{name}' not found.", flush=True)
+                return 1
+        for _, name in INCLUDE_GRAPHICS.findall(line):
+            if not os.path.exists(name):
+                print(f"./{tex_file}:{line_number}: LaTeX Error: File `{name}' not found.", flush=True)
+                return 1
+
+    pages = source.count("\\newpage") + 1
+    for page in range(1, pages + 1):
+        print(f"[{page}]", end=" ", flush=True)
+    print(f"\nOutput written on {stem}.pdf ({pages} pages).")
+    log.append(f"Output written on {stem}.pdf ({pages} pages).\n")
+
+    with open(f"{stem}.log", "w") as f:
+        f.write("\n".join(log))
+    with open(f"{stem}.aux", "w") as f:
+        f.write("\\relax\n")
+        f.writelines(f"\\newlabel{{{label}}}{{{{1}}{{1}}}}\n" for label in LABEL.findall(source))
+        f.write(f"\\gdef \\@abspage@last{{{pages}}}\n")
+    write_pdf(f"{stem}.pdf", pages)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,53 @@
+# tests/test_build_dirs.py
+import asyncio
+
+from app.build_dirs import WarmBuildDirectories
+
+def test_release_records_size_and_reuses_directory(tmp_path):
+    build_dirs = WarmBuildDirectories(str(tmp_path), 1024 * 1024, 3600)
+
+    async def compile_twice():
+        async with build_dirs.acquire("project") as work_dir:
+            (work_dir / "document.aux").write_bytes(b"a" * 100)
+        async with build_dirs.acquire("project") as again:
+            assert (again / "document.aux").exists()
+        return work_dir
+
+    work_dir = asyncio.run(compile_twice())
+    assert work_dir.exists()
+    assert build_dirs.stats()["size_bytes"] == 100
+
+def test_idle_directories_are_evicted_without_another_compile(tmp_path, monkeypatch):
+    monkeypatch.setattr(WarmBuildDirectories, "EVICTION_INTERVAL", 0.05)
+    build_dirs = WarmBuildDirectories(str(tmp_path), 1024 * 1024, 60)
+
+    async def compile_then_idle():
+        async with build_dirs.acquire("project") as work_dir:
+            (work_dir / "document.aux").write_text("x")
+        assert work_dir.exists()
+        # An hour passes without any other compile
+        build_dirs._last_used[work_dir.name] -= 3600
+        eviction = asyncio.create_task(build_dirs.run_eviction())
+        await asyncio.sleep(0.2)
+        eviction.cancel()
+        return work_dir
+
+    work_dir = asyncio.run(compile_then_idle())
+    assert not work_dir.exists()
+    assert build_dirs.stats()["directories"] == 0
+    assert build_dirs.evictions == 1
+
+def test_directories_over_budget_are_evicted_least_recently_used_first(tmp_path):
+    build_dirs = WarmBuildDirectories(str(tmp_path), 150, 3600)
+
+    async def compile_projects():
+        for project in ("old", "new"):
+            async with build_dirs.acquire(project) as work_dir:
+                (work_dir / "document.aux").write_bytes(b"a" * 100)
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(compile_projects())
+    names = [path.name for path in tmp_path.iterdir() if path.name != WarmBuildDirectories.TRASH_DIR]
+    assert len(names) == 1 and names[0].startswith("new-")
+    assert build_dirs.stats()["size_bytes"] == 100
@@ -0,0 +1,30 @@
+# tests/test_cache.py
+import asyncio
+
+from app.cache import DiskCache
+
+def test_put_async_copies_and_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), 250)
+    for name in ("a", "b", "c"):
+        (tmp_path / name).write_bytes(name.encode() * 100)
+
+    async def fill():
+        await cache.put_async("aa", tmp_path / "a")
+        await cache.put_async("bb", tmp_path / "b", move=True)
+        assert cache.get("aa") is not None
+        await cache.put_async("cc", tmp_path / "c")
+
+    asyncio.run(fill())
+    assert (tmp_path / "a").exists() and not (tmp_path / "b").exists()
+    assert cache.get("bb") is None
+    assert cache.get("aa").read_bytes() == b"a" * 100
+    assert cache.stats()["size_bytes"] == 200
+
+def test_put_async_leaves_files_over_budget_alone(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), 10)
+    source = tmp_path / "big"
+    source.write_bytes(b"x" * 100)
+
+    assert asyncio.run(cache.put_async("big", source, move=True)) == source
+    assert source.exists()
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,59 @@
+# tests/test_format_cache.py
+import asyncio
+from pathlib import Path
+
+from app.format_cache import FormatCache
+
+PREAMBLE = "\\documentclass{article}\n"
+
+def fake_build(size: int):
+    """A build callback that dumps a format of size bytes, counting its calls"""
+    calls = []
+
+    async def build(source: Path, job_name: str) -> bool:
+        calls.append(job_name)
+        (source.parent / f"{job_name}.fmt").write_bytes(b"f" * size)
+        return True
+
+    return build, calls
+
+def test_format_is_cached_and_reused(tmp_path):
+    cache = FormatCache(str(tmp_path / "cache"), 1024)
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    build, calls = fake_build(100)
+
+    first = asyncio.run(cache.get_or_build("k", PREAMBLE, work_dir, build))
+    second = asyncio.run(cache.get_or_build("k", PREAMBLE, work_dir, build))
+
+    assert first is not None and first.exists()
+    assert second == first
+    assert len(calls) == 1
+    assert not list(work_dir.iterdir())
+
+def test_format_over_cache_budget_is_not_used(tmp_path):
+    cache = FormatCache(str(tmp_path / "cache"), 10)
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    build, calls = fake_build(100)
+
+    assert asyncio.run(cache.get_or_build("k", PREAMBLE, work_dir, build)) is None
+    # Known bad from now on, so it isn't dumped again on every compile
+    assert asyncio.run(cache.get_or_build("k", PREAMBLE, work_dir, build)) is None
+    assert len(calls) == 1
+    assert cache.stats()["known_bad"] == 1
+    assert not list(work_dir.iterdir())
+
+def test_failed_build_is_not_retried(tmp_path):
+    cache = FormatCache(str(tmp_path / "cache"), 1024)
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    calls = []
+
+    async def build(source: Path, job_name: str) -> bool:
+        calls.append(job_name)
+        return False
+
+    assert asyncio.run(cache.get_or_build("k", PREAMBLE, work_dir, build)) is None
+    assert asyncio.run(cache.get_or_build("k", PREAMBLE, work_dir, build)) is None
+    assert len(calls) == 1
@@ -0,0 +1,50 @@
+# tests/test_process.py
+import sys
+import time
+import asyncio
+
+import pytest
+
+from app.process import stream_command
+
+def is_running(pid: int) -> bool:
+    """Whether pid exists and isn't a zombie waiting to be reaped"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(") ", 1)[1][0] not in "ZX"
+    except FileNotFoundError:
+        return False
+
+def test_stream_command_stops_early(tmp_path):
+    script = "import time\nprint('one', flush=True)\nprint('two', flush=True)\ntime.sleep(30)\n"
+
+    returncode, tail, stopped = asyncio.run(stream_command(
+        [sys.executable, "-c", script], tmp_path, lambda line: line == "two", 1024
+    ))
+
+    assert stopped
+    assert returncode != 0
+    assert tail.text() == "one\ntwo"
+
+def test_stream_command_kills_process_group_when_on_line_fails(tmp_path):
+    # The child spawns a grandchild and reports its pid before the callback blows up
+    script = (
+        "import subprocess, time\n"
+        "child = subprocess.Popen(['sleep', '30'])\n"
+        "print(child.pid, flush=True)\n"
+        "time.sleep(30)\n"
+    )
+    pids = []
+
+    def on_line(line: str) -> bool:
+        pids.append(int(line))
+        raise ValueError("bad line")
+
+    with pytest.raises(ValueError):
+        asyncio.run(stream_command([sys.executable, "-c", script], tmp_path, on_line, 1024))
+
+    # The grandchild went down with the engine's process group; its SIGKILL may take a moment to land
+    deadline = time.monotonic() + 5
+    while is_running(pids[0]) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not is_running(pids[0])
@@ -0,0 +1,40 @@
+# tests/test_tex_output.py
+from app.tex_output import TexOutputMonitor
+
+def test_file_line_errors_are_reported():
+    events = []
+    monitor = TexOutputMonitor(lambda phase, details: events.append((phase, details)))
+
+    assert not monitor.feed("./document.tex:12: Undefined control sequence.")
+    assert not monitor.feed("/usr/share/texlive/texmf-dist/tex/latex/base/article.cls:42: Missing number.")
+    assert not monitor.feed("chapter.tex:3: Missing $ inserted.")
+
+    assert [(error["file"], error["line"]) for error in monitor.errors] == [
+        ("./document.tex", 12),
+        ("/usr/share/texlive/texmf-dist/tex/latex/base/article.cls", 42),
+        ("chapter.tex", 3)
+    ]
+    assert [phase for phase, _ in events] == ["diagnostic"] * 3
+
+def test_typeout_shaped_like_an_error_is_ignored():
+    # What \typeout{a:1: b} or \message{step:12: done} prints
+    monitor = TexOutputMonitor(fail_fast=True)
+
+    assert not monitor.feed("a:1: b")
+    assert not monitor.feed("step:12: done")
+    assert not monitor.feed("Chapter 3:12: Results")
+    assert monitor.errors == []
+
+def test_fail_fast_stops_at_first_error():
+    monitor = TexOutputMonitor(fail_fast=True)
+
+    assert not monitor.feed("(./document.tex [1]")
+    assert monitor.feed("./document.tex:7: Undefined control sequence.")
+    assert monitor.first_error["line"] == 7
+    assert monitor.pages == 1
+
+def test_bang_errors_are_reported_without_location():
+    monitor = TexOutputMonitor()
+
+    monitor.feed("! Emergency stop.")
+    assert monitor.errors == [{"severity": "error", "message": "Emergency stop.", "file": None, "line": None}]